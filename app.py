@@ -10,18 +10,51 @@ Certificate Generator Dashboard v2
 import eventlet
 eventlet.monkey_patch()
 
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response
 from flask_socketio import SocketIO, emit
 import threading
 import time
 import re
 import json
 import os
+import sys
 import glob
+import sqlite3
+import bisect
+import random
+import atexit
+import hashlib
+import hmac
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
+from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
+from googleapiclient.errors import HttpError
+import google_auth_httplib2
+import httplib2
 import io
+import queue
+import tempfile
+import itertools
+import logging.handlers
+import zipfile
+import copy
+import socket
+import urllib.request
+
+# Optional: local PDF rendering (render_mode 'local')
+try:
+    from pypdf import PdfReader, PdfWriter
+    from reportlab.pdfgen import canvas as pdf_canvas
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.lib.colors import HexColor
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+    LOCAL_RENDER_AVAILABLE = True
+except ImportError:
+    LOCAL_RENDER_AVAILABLE = False
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'certificate-generator-secret'
@@ -35,7 +68,6 @@ state = {
     'failed': 0,
     'current_name': '',
     'start_time': None,
-    'logs': [],
     'retry_count': 0,  # Current retry attempt
     'max_retries': 1,  # Maximum number of retry attempts
     
@@ -60,6 +92,47 @@ state = {
         'name_column': '',  # Auto-detected column with name
         'auto_watch': False,
         'watch_interval': 30,  # seconds
+        'broadcast_interval_ms': 250,  # Dashboard update tick
+        'watch_full_scan_every': 10,  # Watcher ticks between full sheet scans
+        'link_flush_rows': 50,  # Write buffered links every N rows...
+        'link_flush_interval': 5,  # ...or every T seconds
+        'account_concurrency': 2,  # Workers per service account
+        'stall_timeout': 300,  # Re-queue a row without progress for this long (seconds)
+        'green_pool_size': 500,  # Most green threads (account + stage workers) one run may use
+        # Name cleanup, fingerprints and local rendering run on eventlet's OS
+        # threads (EVENTLET_THREADPOOL_SIZE) in chunks of cpu_batch_size
+        'cpu_offload': True,
+        'cpu_batch_size': 500,
+        # Workers per pipeline stage (0 = one per account worker) and queue bound
+        'pipeline_workers': {'replace': 0, 'export': 0, 'upload': 0, 'finish': 0},
+        'pipeline_queue_size': 10,
+        'copy_batch_size': 5,  # Template copies sent per Drive batch request
+        # Pre-fill static variables in one template copy only for runs of at
+        # least this many rows (the copy costs a copy, an update and a delete)
+        'bake_min_rows': 20,
+        # Requests per minute per service account, per API family
+        'api_quotas': {'drive': 300, 'docs': 60, 'slides': 60, 'sheets': 60},
+        'service_pool_size': 4,  # Idle API client sets kept per account
+        # 'drive' fills a template copy per row; 'local' draws names onto one exported PDF
+        'render_mode': 'drive',
+        'reuse_outputs': True,  # Reuse an existing PDF for identical template + values
+        # PDFs between export and upload: total held in memory, per-PDF share
+        # (larger ones spill to disk) and download/upload chunk size
+        'pdf_memory_budget_mb': 64,
+        'pdf_spool_mb': 4,
+        'pdf_chunk_mb': 1,
+        'zip_fetch_workers': 4,  # Concurrent Drive downloads for a job's ZIP
+        # 'local' generates in this process; 'workers' queues rows for worker processes
+        'execution': 'local',
+        'worker_lease_seconds': 120,  # A worker's rows go back to the queue if not renewed
+        # Drive browser: listing page size, cache lifetime (seconds) and
+        # subfolders listed ahead in the background
+        'drive_page_size': 200,
+        'drive_cache_ttl': 300,
+        'drive_prefetch': 10,
+        'render_font': '',  # TTF font with Arabic glyphs, for local rendering
+        # [{placeholder, page, x, y, width, font_size, color, align, font}] in PDF points
+        'render_fields': [],
         'cleanup': {
             'enabled': True,
             'remove_words': [
@@ -149,8 +222,8 @@ state = {
     'accounts': [],
     'accounts_loaded': False,
     
-    # Processed names (to detect new ones)
-    'processed_names': set(),
+    # Job being generated (id in job_store)
+    'job_id': None,
 }
 
 # Threading control
@@ -198,77 +271,296 @@ def column_to_index(col):
             result = result * 26 + (ord(char) - ord('A') + 1)
     return result - 1 if result > 0 else 0
 
-def clean_name(name):
-    """Clean name by removing titles and prefixes from start AND end"""
-    cleanup = state['config'].get('cleanup', {})
+# Patterns used by clean_name that do not depend on the cleanup config
+RE_CIVIL_RECORD = re.compile(r'سجل مدني.*$', re.IGNORECASE)
+RE_NUMBER_LABEL = re.compile(r'رقم.*$', re.IGNORECASE)
+RE_TRAILING_ID = re.compile(r'\s*[/،,]\s*\d{7,}.*$')
+RE_TRAILING_SLASH_NUMBER = re.compile(r'\s*/\s*\d+.*$')
+RE_LEADING_PUNCT = re.compile(r'^[\s:/،,._\-\u2013\u2014]+')
+RE_TRAILING_PUNCT = re.compile(r'[\s:/،,._\-\u2013\u2014]+$')
+RE_LEADING_ALEF = re.compile(r'^[اأإ][\s:_\-\u2013\u2014]+')
+RE_MULTI_SPACE = re.compile(r'\s+')
+RE_LEADING_SINGLE_LETTER = re.compile(r'^\s*(?:[A-Za-z\u0620-\u06FF])(?:\.)?\s+')
+RE_TRAILING_SINGLE_LETTER = re.compile(r'\s+(?:[A-Za-z\u0620-\u06FF])(?:\.)?\s*$')
+
+# Feminine endings accepted right after a title (e.g. شيخ → شيخه)
+TITLE_SUFFIXES = ('ه', 'ة')
+
+def _fold_char(char):
+    """Case-fold one character without changing string length"""
+    lowered = char.lower()
+    return lowered if len(lowered) == 1 else char
+
+class CleanupEngine:
+    """Compiled form of the cleanup config used by clean_name.
+
+    Titles are stored in a character trie so stripping them from the start of
+    a name is a single walk instead of a ~200-way regex alternation.
+    """
     
-    if not cleanup.get('enabled', True):
-        return name
+    def __init__(self, cleanup, version=0):
+        self.version = version
+        # Identifies the rules themselves, so identical saves keep cached names
+        self.fingerprint = hashlib.sha1(
+            json.dumps(cleanup, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        ).hexdigest()
+        self.enabled = cleanup.get('enabled', True)
+        self.remove_before_slash = cleanup.get('remove_before_slash', True)
+        self.remove_alef = cleanup.get('remove_alef', True)
+        self.trim_spaces = cleanup.get('trim_spaces', True)
+        self.remove_single_letter_tokens = cleanup.get('remove_single_letter_tokens', True)
+        
+        self.trie = {}
+        for word in cleanup.get('remove_words', []):
+            if not word:
+                continue
+            node = self.trie
+            for char in word:
+                node = node.setdefault(_fold_char(char), {})
+            node[None] = True  # End-of-word marker
+    
+    def _match_title(self, text, pos):
+        """Return end position of the longest title at pos, or -1"""
+        node = self.trie
+        best = -1
+        i = pos
+        length = len(text)
+        while True:
+            if None in node:
+                # Title may carry a feminine ending; it must end at a word boundary
+                if i < length and text[i] in TITLE_SUFFIXES and (i + 1 == length or text[i + 1].isspace()):
+                    best = i + 1
+                elif i == length or text[i].isspace():
+                    best = i
+            if i == length:
+                break
+            node = node.get(_fold_char(text[i]))
+            if node is None:
+                break
+            i += 1
+        return best
+    
+    def strip_titles(self, text):
+        """Remove titles from the start as whole words (repeats for stacked titles).
+        
+        We DO NOT remove from end to protect family names like "El Sayed" (السيد).
+        """
+        if not self.trie:
+            return text
+        
+        while True:
+            pos = 0
+            while pos < len(text) and text[pos].isspace():
+                pos += 1
+            end = self._match_title(text, pos)
+            if end < 0:
+                return text
+            while end < len(text) and text[end].isspace():
+                end += 1
+            text = text[end:]
+    
+    def clean(self, name):
+        if not self.enabled:
+            return name
+        
+        cleaned = name
+        
+        # Remove everything before FIRST / ONLY (if it appears near the start)
+        # This handles "المهندس / شداد" but keeps "شداد / 1093267308"
+        if self.remove_before_slash and '/' in cleaned:
+            slash_pos = cleaned.index('/')
+            # Only remove before slash if it's in first 30% of string (likely a title)
+            if slash_pos < len(cleaned) * 0.3:
+                cleaned = cleaned.split('/', 1)[-1]  # Split only on first /
+        
+        # Remove common ID/phone patterns (after main name)
+        # Remove "سجل مدني" and anything after it
+        cleaned = RE_CIVIL_RECORD.sub('', cleaned)
+        cleaned = RE_NUMBER_LABEL.sub('', cleaned)
+        # Remove standalone numbers (IDs, phones) - 7+ digits
+        cleaned = RE_TRAILING_ID.sub('', cleaned)
+        # Remove trailing / with numbers
+        cleaned = RE_TRAILING_SLASH_NUMBER.sub('', cleaned)
+        
+        cleaned = self.strip_titles(cleaned)
+        
+        # Remove leading/trailing punctuation (include underscore and dashes)
+        cleaned = RE_LEADING_PUNCT.sub('', cleaned)
+        cleaned = RE_TRAILING_PUNCT.sub('', cleaned)
+        
+        # Remove standalone alef at start (ا or أ possibly followed by punctuation)
+        if self.remove_alef:
+            cleaned = RE_LEADING_ALEF.sub('', cleaned)
+        
+        # Trim spaces and remove any remaining / at start or end
+        if self.trim_spaces:
+            cleaned = RE_MULTI_SPACE.sub(' ', cleaned).strip()
+            cleaned = cleaned.strip('/')  # Remove / from start/end
+            cleaned = cleaned.strip()  # Final trim
+        
+        # Remove single-letter tokens at start or end (e.g., 'د ', 'د.', 'A ')
+        if self.remove_single_letter_tokens:
+            cleaned = RE_LEADING_SINGLE_LETTER.sub('', cleaned)
+            cleaned = RE_TRAILING_SINGLE_LETTER.sub('', cleaned)
+        
+        return cleaned
+
+class NameCache:
+    """Size-bounded LRU cache for name transformations, with hit/miss stats"""
+    
+    def __init__(self, max_size=20000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    def get_or_compute(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        
+        value = compute()
+        
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return value
+    
+    def get_many(self, keys):
+        """{key: value} for the keys that are cached"""
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[key] = self.entries[key]
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        return found
+    
+    def put_many(self, items):
+        with self.lock:
+            for key, value in items:
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
     
-    cleaned = name
-    
-    # Remove everything before FIRST / ONLY (if it appears near the start)
-    # This handles "المهندس / شداد" but keeps "شداد / 1093267308"
-    if cleanup.get('remove_before_slash', True) and '/' in cleaned:
-        slash_pos = cleaned.index('/')
-        # Only remove before slash if it's in first 30% of string (likely a title)
-        if slash_pos < len(cleaned) * 0.3:
-            cleaned = cleaned.split('/', 1)[-1]  # Split only on first /
-    
-    # Remove common ID/phone patterns (after main name)
-    # Remove "سجل مدني" and anything after it
-    cleaned = re.sub(r'سجل مدني.*$', '', cleaned, flags=re.IGNORECASE)
-    cleaned = re.sub(r'رقم.*$', '', cleaned, flags=re.IGNORECASE)
-    # Remove standalone numbers (IDs, phones) - 7+ digits
-    cleaned = re.sub(r'\s*[/،,]\s*\d{7,}.*$', '', cleaned)
-    # Remove trailing / with numbers
-    cleaned = re.sub(r'\s*/\s*\d+.*$', '', cleaned)
-    
-    # Get words to remove
-    words = cleanup.get('remove_words', [])
-    
-    # Sort by length (longest first) to avoid partial matches
-    words_sorted = sorted(words, key=len, reverse=True)
-
-    # Build robust patterns to remove titles from start as whole words.
-    # We DO NOT remove from end to protect family names like "El Sayed" (السيد).
-    # We enforce word boundaries to prevent partial matches (e.g. chopping 'Ahmed').
-    if words_sorted:
-        words_escaped = [re.escape(w) for w in words_sorted]
-        # Match at start, followed by space or end of string.
-        begin_pattern = r'^\s*(?:' + '|'.join(words_escaped) + r')(?:[هة])?(?=\s|$)\s*'
-
-        # Repeat removal until no further changes (handles multiple titles)
-        prev = None
-        while prev != cleaned:
-            prev = cleaned
-            # Only remove from start
-            cleaned = re.sub(begin_pattern, '', cleaned, flags=re.IGNORECASE)
-    
-    # Remove leading/trailing punctuation (include underscore and dashes)
-    cleaned = re.sub(r'^[\s:/،,._\-\u2013\u2014]+', '', cleaned)
-    cleaned = re.sub(r'[\s:/،,._\-\u2013\u2014]+$', '', cleaned)
-    
-    # Remove standalone alef at start (ا or أ possibly followed by punctuation)
-    if cleanup.get('remove_alef', True):
-        cleaned = re.sub(r'^[اأإ][\s:_\-\u2013\u2014]+', '', cleaned)
-    
-    # Trim spaces and remove any remaining / at start or end
-    if cleanup.get('trim_spaces', True):
-        cleaned = re.sub(r'\s+', ' ', cleaned).strip()
-        cleaned = cleaned.strip('/')  # Remove / from start/end
-        cleaned = cleaned.strip()  # Final trim
-
-    # Remove single-letter tokens at start or end (e.g., 'د ', 'د.', 'A ')
-    if cleanup.get('remove_single_letter_tokens', True):
-        # Start: single Arabic/Latin letter optionally followed by a dot and spaces
-        cleaned = re.sub(r'^\s*(?:[A-Za-z\u0620-\u06FF])(?:\.)?\s+', '', cleaned)
-        # End: single Arabic/Latin letter optionally preceded by spaces and optional dot
-        cleaned = re.sub(r'\s+(?:[A-Za-z\u0620-\u06FF])(?:\.)?\s*$', '', cleaned)
-
-    return cleaned
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0,
+            }
+
+NAME_CACHE_SIZE = 20000
+
+# Cleaned names are keyed on (cleanup fingerprint, raw value); normalized
+# names do not depend on the cleanup config and are keyed on the value alone
+clean_name_cache = NameCache(NAME_CACHE_SIZE)
+normalized_name_cache = NameCache(NAME_CACHE_SIZE)
+
+# Batches smaller than this are not worth a trip to the thread pool
+OFFLOAD_MIN_BATCH = 64
+
+def offload(fn, *args, size=None):
+    """Run CPU-bound fn(*args) on one of eventlet's OS threads, so the hub
+    keeps serving the dashboard and sockets meanwhile. Runs inline when
+    cpu_offload is off or the batch (size) is small. fn must not take locks:
+    they are green and only work on the hub."""
+    if not state['config'].get('cpu_offload', True) or (size is not None and size < OFFLOAD_MIN_BATCH):
+        return fn(*args)
+    from eventlet import tpool
+    return tpool.execute(fn, *args)
+
+def compute_batch(cache, keys, compute):
+    """{key: value} for keys; cache misses are computed with compute(keys)
+    off the hub, cpu_batch_size keys at a time"""
+    values = cache.get_many(keys)
+    missing = [key for key in dict.fromkeys(keys) if key not in values]
+    chunk_size = max(1, int(state['config'].get('cpu_batch_size', 500)))
+    for i in range(0, len(missing), chunk_size):
+        chunk = missing[i:i + chunk_size]
+        computed = offload(compute, chunk, size=len(chunk))
+        cache.put_many(zip(chunk, computed))
+        values.update(zip(chunk, computed))
+    return values
+
+# Compiled cleanup engine, rebuilt only when the cleanup config is saved
+cleanup_engine = None
+cleanup_version = 0
+cleanup_engine_lock = threading.Lock()
+
+def get_cleanup_engine():
+    """Return the compiled engine for the current cleanup config"""
+    global cleanup_engine
+    engine = cleanup_engine
+    if engine is not None and engine.version == cleanup_version:
+        return engine
+    with cleanup_engine_lock:
+        if cleanup_engine is None or cleanup_engine.version != cleanup_version:
+            previous = cleanup_engine
+            cleanup_engine = CleanupEngine(state['config'].get('cleanup', {}), cleanup_version)
+            if previous is not None and previous.fingerprint != cleanup_engine.fingerprint:
+                # Rules changed - cached results are stale
+                clean_name_cache.clear()
+        return cleanup_engine
+
+def invalidate_cleanup_engine():
+    """Force the next clean_name call to recompile the cleanup config"""
+    global cleanup_version
+    with cleanup_engine_lock:
+        cleanup_version += 1
+    # Rebuild now so a rule change flushes the name cache immediately
+    get_cleanup_engine()
+
+def clean_name(name, engine=None):
+    """Clean name by removing titles and prefixes from start AND end
+    (with engine's rules instead of the saved config if given)"""
+    engine = engine or get_cleanup_engine()
+    return clean_name_cache.get_or_compute((engine.fingerprint, name), lambda: engine.clean(name))
+
+def clean_names(names):
+    """Clean a batch of names with a single engine lookup (misses off the hub)"""
+    engine = get_cleanup_engine()
+    keys = [(engine.fingerprint, name) for name in names]
+    values = compute_batch(clean_name_cache, keys, lambda chunk: [engine.clean(name) for _, name in chunk])
+    return [values[key] for key in keys]
+
+def get_name_cache_stats():
+    """Hit/miss statistics for the name caches"""
+    return {
+        'clean': clean_name_cache.stats(),
+        'normalize': normalized_name_cache.stats(),
+    }
+
+RE_TASHKEEL = re.compile(r'[\u064B-\u065F]')
 
 def normalize_name_for_comparison(name):
+    """Normalize name for duplicate detection (cached)"""
+    return normalized_name_cache.get_or_compute(name, lambda: _normalize_name(name))
+
+def normalize_names(names):
+    """normalize_name_for_comparison for a batch (misses off the hub)"""
+    values = compute_batch(normalized_name_cache, names, lambda chunk: [_normalize_name(name) for name in chunk])
+    return [values[name] for name in names]
+
+def _normalize_name(name):
     """Normalize name for duplicate detection (handle typos)"""
     normalized = name
     
@@ -283,7 +575,7 @@ def normalize_name_for_comparison(name):
     normalized = normalized.replace('ة', 'ه')
     
     # Remove all diacritics (tashkeel)
-    normalized = re.sub(r'[\u064B-\u065F]', '', normalized)
+    normalized = RE_TASHKEEL.sub('', normalized)
     
     # Normalize multiple spaces to single space
     normalized = re.sub(r'\s+', ' ', normalized).strip()
@@ -293,38 +585,202 @@ def normalize_name_for_comparison(name):
 # Lock for thread-safe state updates
 state_lock = threading.Lock()
 
-def add_log(message, level='info'):
-    """Add log message and broadcast"""
-    timestamp = time.strftime('%H:%M:%S')
-    log_entry = {'time': timestamp, 'message': message, 'level': level}
+LOG_FILE = 'certificates.log'
+
+# python app.py worker ... - a worker keeps no files of its own next to the
+# controller's (it may run from the same directory)
+WORKER_MODE = sys.argv[1:2] == ['worker']
+
+class LogStore:
+    """Recent log entries in a ring buffer, all of them in a rotating JSONL file.
+
+    Every entry gets an increasing sequence number, so clients can ask for
+    just what came after the last entry they saw. Entries older than the
+    ring are read back from disk.
+    """
+    
+    def __init__(self, path=LOG_FILE, capacity=500, max_bytes=5 * 1024 * 1024, backups=5):
+        self.lock = threading.Lock()
+        self.path = path
+        self.backups = backups
+        self.ring = deque(maxlen=capacity)
+        self.seq = 0
+        self.handler = None
+        if path is None:
+            return  # Ring buffer only
+        self.handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8'
+        )
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+        
+        # Continue numbering (and the live view) from the previous run
+        for path in reversed(self._files()):
+            entries = list(self._read(path))
+            if entries:
+                self.ring.extend(entries)
+                self.seq = entries[-1]['seq']
+                break
+    
+    def _files(self):
+        """Log files, oldest first"""
+        rotated = [f'{self.path}.{i}' for i in range(self.backups, 0, -1)]
+        return [path for path in rotated if os.path.exists(path)] + [self.path]
+    
+    def _read(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue  # Partially written line
+        except OSError:
+            return
+    
+    def append(self, message, level, job=None):
+        with self.lock:
+            self.seq += 1
+            entry = {
+                'seq': self.seq,
+                'ts': round(time.time(), 3),
+                'time': time.strftime('%H:%M:%S'),
+                'message': message,
+                'level': level,
+            }
+            if job:
+                entry['job'] = job
+            self.ring.append(entry)
+            if self.handler is None:
+                return entry
+            try:
+                self.handler.emit(logging.makeLogRecord({'msg': json.dumps(entry, ensure_ascii=False)}))
+            except Exception:
+                pass
+        return entry
     
+    def recent(self, n=50):
+        with self.lock:
+            return list(self.ring)[-n:]
+    
+    def query(self, after=0, levels=None, limit=500, job=None):
+        """Entries with seq > after (optionally only some levels or one job), oldest first"""
+        with self.lock:
+            ring = list(self.ring)
+            last_seq = self.seq
+        
+        if self.handler is None or (ring and after >= ring[0]['seq'] - 1):
+            source = ring
+        else:
+            self.handler.flush()
+            source = itertools.chain.from_iterable(self._read(path) for path in self._files())
+        
+        entries = []
+        for entry in source:
+            if entry['seq'] <= after or (levels and entry['level'] not in levels):
+                continue
+            if job and entry.get('job') != job:
+                continue
+            entries.append(entry)
+            if len(entries) >= limit:
+                break
+        return entries, last_seq
+
+log_store = LogStore(None if WORKER_MODE else LOG_FILE)
+
+def add_log(message, level='info', job=None):
+    """Add log message; sent to clients on the next broadcaster tick.
+    job (a JobContext) tags the entry and keeps it in the job's own log."""
+    entry = log_store.append(message, level, job.id if job else None)
+    if job:
+        job.logs.append(entry)
+    broadcaster.log(entry)
+
+def state_snapshot():
+    """Dashboard fields of the current state"""
     with state_lock:
-        state['logs'].append(log_entry)
-        if len(state['logs']) > 500:
-            state['logs'] = state['logs'][-500:]
+        now = time.time()
+        start_time = state['start_time']
+        return {
+            'status': state['status'],
+            'total': state['total'],
+            'completed': state['completed'],
+            'failed': state['failed'],
+            'current_name': state['current_name'],
+            'elapsed': int(now - start_time) if start_time else 0,
+            'rate': round(state['completed'] / ((now - start_time) / 60), 1) if start_time and now > start_time else 0,
+            'watching': state['config']['auto_watch'],
+        }
+
+class Broadcaster:
+    """Pushes state and logs to clients at most once per tick.
+
+    broadcast_state() and add_log() only mark work for the next tick; a tick
+    emits one 'state_update' with the fields that changed since the last one
+    (the dashboard's job, plus 'active_jobs' for the jobs beside it) and one
+    'logs' event with the entries added in between.
+    """
     
-    try:
-        socketio.emit('log', log_entry, namespace='/')
-    except:
-        pass
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.dirty = threading.Event()
+        self.pending_logs = []
+        self.last = {}
+        self.thread = None
+        self.ticks = 0
+        self.requests = 0
+    
+    def _ensure_started(self):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, daemon=True)
+                    self.thread.start()
+    
+    def request(self):
+        """Send the state on the next tick"""
+        self.requests += 1
+        self._ensure_started()
+        self.dirty.set()
+    
+    def log(self, entry):
+        with self.lock:
+            self.pending_logs.append(entry)
+        self.request()
+    
+    def _run(self):
+        while True:
+            self.dirty.wait()
+            self.dirty.clear()
+            try:
+                self.tick()
+            except Exception:
+                pass
+            time.sleep(self.interval)
+    
+    def tick(self):
+        with self.lock:
+            logs, self.pending_logs = self.pending_logs, []
+        
+        data = state_snapshot()
+        data['active_jobs'] = [ctx.summary() for ctx in job_manager.active() if ctx is not default_job]
+        changed = {key: value for key, value in data.items() if self.last.get(key) != value}
+        self.last = data
+        self.ticks += 1
+        
+        if changed:
+            socketio.emit('state_update', changed, namespace='/')
+        if logs:
+            socketio.emit('logs', logs, namespace='/')
+    
+    def stats(self):
+        return {'interval': self.interval, 'ticks': self.ticks, 'requests': self.requests}
+
+broadcaster = Broadcaster(state['config']['broadcast_interval_ms'] / 1000)
 
 def broadcast_state():
-    """Send current state to all clients"""
-    try:
-        with state_lock:
-            data = {
-                'status': state['status'],
-                'total': state['total'],
-                'completed': state['completed'],
-                'failed': state['failed'],
-                'current_name': state['current_name'],
-                'elapsed': time.time() - state['start_time'] if state['start_time'] else 0,
-                'rate': state['completed'] / ((time.time() - state['start_time']) / 60) if state['start_time'] and time.time() > state['start_time'] else 0,
-                'watching': state['config']['auto_watch'],
-            }
-        socketio.emit('state_update', data, namespace='/')
-    except:
-        pass
+    """Send current state to all clients (coalesced by the broadcaster)"""
+    broadcaster.request()
 
 def load_service_accounts():
     """Load all service account JSON files"""
@@ -354,346 +810,2131 @@ def load_service_accounts():
     add_log(f'📊 Loaded {len(state["accounts"])} service accounts', 'info')
     return len(state['accounts']) > 0
 
-def get_services(acc_idx=0):
-    """Get API services for an account"""
+# ============ METRICS ============
+
+# Histogram buckets (seconds) for API stages and sheet scans
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+class Metrics:
+    """Counters, histograms and gauges rendered in the Prometheus text format"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta = {}  # {name: (type, help)}
+        self.buckets = {}  # {histogram name: bucket bounds}
+        self.values = {}  # {(name, labels): counter value or [bucket counts..., sum, count]}
+        self.gauges = {}  # {name: fn() -> {labels: value}}
+    
+    def counter(self, name, help_text):
+        self.meta[name] = ('counter', help_text)
+    
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.meta[name] = ('histogram', help_text)
+        self.buckets[name] = buckets
+    
+    def gauge(self, name, help_text, fn):
+        self.meta[name] = ('gauge', help_text)
+        self.gauges[name] = fn
+    
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+    
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        bounds = self.buckets[name]
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(bounds) + 2)
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+    
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+    
+    def render(self):
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+        
+        with self.lock:
+            values = {key: (list(v) if isinstance(v, list) else v) for key, v in self.values.items()}
+        
+        lines = []
+        for name, (kind, help_text) in self.meta.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'gauge':
+                try:
+                    samples = self.gauges[name]()
+                except Exception:
+                    samples = {}
+                for labels, value in samples.items():
+                    lines.append(f'{name}{fmt(labels)} {value}')
+                continue
+            for (metric, labels), value in sorted(values.items()):
+                if metric != name:
+                    continue
+                if kind == 'counter':
+                    lines.append(f'{name}{fmt(labels)} {value}')
+                    continue
+                for bound, count in zip(self.buckets[name], value):
+                    lines.append(f'{name}_bucket{fmt(labels, [("le", bound)])} {count}')
+                lines.append(f'{name}_bucket{fmt(labels, [("le", "+Inf")])} {value[-1]}')
+                lines.append(f'{name}_sum{fmt(labels)} {round(value[-2], 6)}')
+                lines.append(f'{name}_count{fmt(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.histogram('certgen_stage_seconds', 'Time spent per certificate stage (copy, replace, export, upload, finish, delete, sheet_write)')
+metrics.counter('certgen_certificates_total', 'Certificates finished per service account and result')
+metrics.counter('certgen_api_requests_total', 'Google API requests per service account and API family')
+metrics.counter('certgen_rate_limited_total', 'Quota (429) errors per service account and API family')
+metrics.counter('certgen_rate_limit_wait_seconds_total', 'Time spent waiting for rate-limiter tokens')
+metrics.histogram('certgen_watcher_scan_seconds', 'Duration of auto-watch sheet scans')
+metrics.gauge('certgen_queue_rows', 'Rows of the running jobs by queue state', lambda: {
+    (('job', ctx.id), ('state', key)): ctx.work_queue.stats()[key]
+    for ctx in job_manager.active() if ctx.work_queue
+    for key in ('pending', 'in_flight')
+})
+metrics.gauge('certgen_pipeline_queue_depth', 'Rows waiting for each pipeline stage of the running jobs', lambda: {
+    (('job', ctx.id), ('stage', name)): depth
+    for ctx in job_manager.active() if ctx.pipeline
+    for name, depth in ctx.pipeline.depths().items()
+})
+metrics.gauge('certgen_account_slots_used', 'Account slots held by each running job', lambda: {
+    (('job', job_key),): held for job_key, held in account_scheduler.stats()['held'].items()
+})
+metrics.gauge('certgen_links_pending', 'Links buffered for the sheet', lambda: {(): link_writer.stats()['pending']})
+metrics.gauge('certgen_temp_docs_pending', 'Temp copies waiting for deletion', lambda: {(): janitor.stats()['pending']})
+
+# ============ SERVICE POOL ============
+
+class ServicePool:
+    """Reusable Google API clients, pooled per service account.
+
+    A lease is a (drive, docs, slides, sheets) tuple sharing one authorized
+    HTTP transport. httplib2 is not thread-safe, so a lease is used by one
+    worker at a time; released leases are kept for reuse (up to max_idle
+    per account) instead of calling build() again.
+    """
+    
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self.idle = {}     # {acc_idx: [services, ...]}
+        self.built = {}    # {acc_idx: count}
+        self.reused = {}   # {acc_idx: count}
+        self.lock = threading.Lock()
+    
+    def _build(self, creds):
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=120))
+        return (
+            build('drive', 'v3', http=http, cache_discovery=False),
+            build('docs', 'v1', http=http, cache_discovery=False),
+            build('slides', 'v1', http=http, cache_discovery=False),
+            build('sheets', 'v4', http=http, cache_discovery=False)
+        )
+    
+    def acquire(self, acc_idx):
+        with self.lock:
+            idle = self.idle.get(acc_idx)
+            if idle:
+                self.reused[acc_idx] = self.reused.get(acc_idx, 0) + 1
+                return idle.pop()
+            self.built[acc_idx] = self.built.get(acc_idx, 0) + 1
+        
+        creds = state['accounts'][acc_idx]['creds']
+        return self._build(creds)
+    
+    def release(self, acc_idx, services):
+        with self.lock:
+            idle = self.idle.setdefault(acc_idx, [])
+            if len(idle) < self.max_idle:
+                idle.append(services)
+    
+    def resize(self, max_idle):
+        with self.lock:
+            self.max_idle = max_idle
+            for idle in self.idle.values():
+                del idle[max_idle:]
+    
+    def clear(self):
+        """Drop all pooled clients (e.g. after accounts are reloaded)"""
+        with self.lock:
+            self.idle = {}
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'max_idle': self.max_idle,
+                'accounts': {
+                    str(acc_idx): {
+                        'built': self.built.get(acc_idx, 0),
+                        'reused': self.reused.get(acc_idx, 0),
+                        'idle': len(self.idle.get(acc_idx, [])),
+                    }
+                    for acc_idx in sorted(set(self.built) | set(self.reused))
+                }
+            }
+
+service_pool = ServicePool(state['config']['service_pool_size'])
+
+@contextmanager
+def account_services(acc_idx=0):
+    """Lease pooled API services for an account:
+
+        with account_services(acc_idx) as (drive, docs, slides, sheets):
+            ...
+    """
     if not state['accounts']:
         load_service_accounts()
     if not state['accounts']:
-        return None, None, None, None
-    
-    creds = state['accounts'][acc_idx % len(state['accounts'])]['creds']
-    return (
-        build('drive', 'v3', credentials=creds, cache_discovery=False),
-        build('docs', 'v1', credentials=creds, cache_discovery=False),
-        build('slides', 'v1', credentials=creds, cache_discovery=False),
-        build('sheets', 'v4', credentials=creds, cache_discovery=False)
-    )
+        yield None, None, None, None
+        return
+    
+    acc_idx = acc_idx % len(state['accounts'])
+    services = service_pool.acquire(acc_idx)
+    try:
+        yield services
+    finally:
+        service_pool.release(acc_idx, services)
 
 # ============ FOLDER BROWSING ============
 
 def list_sheets_in_folder(folder_id):
     """List all Google Sheets in a folder"""
-    drive, _, _, _ = get_services(0)
-    if not drive:
-        return []
-    
-    try:
-        results = drive.files().list(
-            q=f"'{folder_id}' in parents and mimeType='application/vnd.google-apps.spreadsheet' and trashed=false",
-            fields="files(id, name, modifiedTime)",
-            orderBy="modifiedTime desc",
-            supportsAllDrives=True,
-            includeItemsFromAllDrives=True
-        ).execute()
+    with account_services(0) as (drive, _, _, _):
+        if not drive:
+            return []
         
-        return results.get('files', [])
-    except Exception as e:
-        add_log(f'❌ Error listing folder: {e}', 'error')
-        return []
+        try:
+            results = drive.files().list(
+                q=f"'{folder_id}' in parents and mimeType='application/vnd.google-apps.spreadsheet' and trashed=false",
+                fields="files(id, name, modifiedTime)",
+                orderBy="modifiedTime desc",
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True
+            ).execute()
+            
+            return results.get('files', [])
+        except Exception as e:
+            add_log(f'❌ Error listing folder: {e}', 'error')
+            return []
 
 def list_folder_contents(folder_id):
     """List folders and sheets in a folder"""
-    drive, _, _, _ = get_services(0)
-    if not drive:
-        return {'folders': [], 'sheets': []}
-    
-    try:
-        # Get folders
-        folders_result = drive.files().list(
-            q=f"'{folder_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false",
-            fields="files(id, name)",
-            orderBy="name",
-            supportsAllDrives=True,
-            includeItemsFromAllDrives=True
-        ).execute()
+    with account_services(0) as (drive, _, _, _):
+        if not drive:
+            return {'folders': [], 'sheets': []}
         
-        # Get sheets
-        sheets_result = drive.files().list(
-            q=f"'{folder_id}' in parents and mimeType='application/vnd.google-apps.spreadsheet' and trashed=false",
-            fields="files(id, name, modifiedTime)",
-            orderBy="modifiedTime desc",
-            supportsAllDrives=True,
-            includeItemsFromAllDrives=True
-        ).execute()
-        
-        return {
-            'folders': folders_result.get('files', []),
-            'sheets': sheets_result.get('files', [])
-        }
-    except Exception as e:
-        add_log(f'❌ Error listing folder: {e}', 'error')
-        return {'folders': [], 'sheets': []}
+        try:
+            # Get folders
+            folders_result = drive.files().list(
+                q=f"'{folder_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false",
+                fields="files(id, name)",
+                orderBy="name",
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True
+            ).execute()
+            
+            # Get sheets
+            sheets_result = drive.files().list(
+                q=f"'{folder_id}' in parents and mimeType='application/vnd.google-apps.spreadsheet' and trashed=false",
+                fields="files(id, name, modifiedTime)",
+                orderBy="modifiedTime desc",
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True
+            ).execute()
+            
+            return {
+                'folders': folders_result.get('files', []),
+                'sheets': sheets_result.get('files', [])
+            }
+        except Exception as e:
+            add_log(f'❌ Error listing folder: {e}', 'error')
+            return {'folders': [], 'sheets': []}
 
-# ============ CERTIFICATE GENERATION ============
+# ============ JOB STORE ============
 
-class RateLimiter:
-    def __init__(self, max_per_min=50):
-        self.max = max_per_min
-        self.timestamps = []
+STATE_DB_FILE = 'certificates.db'
+
+class JobStore:
+    """SQLite record of generation jobs and per-row results.
+
+    Each sheet row keeps its latest status ('pending', 'in_progress', 'done',
+    'failed'), output file id, link, attempt count and timings, so a restarted
+    service can resume an interrupted job and a sheet scan can trust rows
+    that are already done. In worker execution the rows are also the queue:
+    workers lease pending rows ('leased' until lease_until).
+    """
+    
+    def __init__(self, path=STATE_DB_FILE):
+        self.path = path
         self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sheet_id TEXT,
+                    template_id TEXT,
+                    target_folder_id TEXT,
+                    config TEXT,
+                    variables TEXT,
+                    status TEXT,
+                    total INTEGER DEFAULT 0,
+                    started_at REAL,
+                    finished_at REAL
+                )""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS rows (
+                    sheet_id TEXT,
+                    row INTEGER,
+                    job_id INTEGER,
+                    name TEXT,
+                    row_data TEXT,
+                    status TEXT,
+                    file_id TEXT,
+                    link TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    started_at REAL,
+                    finished_at REAL,
+                    error TEXT,
+                    PRIMARY KEY (sheet_id, row)
+                )""")
+            self.conn.execute('CREATE INDEX IF NOT EXISTS rows_job ON rows (job_id, status)')
+            columns = {r['name'] for r in self.conn.execute('PRAGMA table_info(rows)')}
+            if 'lease_owner' not in columns:
+                self.conn.execute('ALTER TABLE rows ADD COLUMN lease_owner TEXT')
+                self.conn.execute('ALTER TABLE rows ADD COLUMN lease_until REAL')
+            columns = {r['name'] for r in self.conn.execute('PRAGMA table_info(jobs)')}
+            if 'job_key' not in columns:
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN job_key TEXT DEFAULT 'default'")
+                self.conn.execute('ALTER TABLE jobs ADD COLUMN weight REAL DEFAULT 1')
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS outputs (
+                    key TEXT PRIMARY KEY,
+                    file_id TEXT,
+                    link TEXT,
+                    created_at REAL
+                )""")
+            columns = {r['name'] for r in self.conn.execute('PRAGMA table_info(outputs)')}
+            if 'account' not in columns:
+                self.conn.execute('ALTER TABLE outputs ADD COLUMN account INTEGER')
     
-    def wait(self):
+    def _execute(self, sql, params=()):
+        with self.lock, self.conn:
+            return self.conn.execute(sql, params)
+    
+    def _query(self, sql, params=()):
         with self.lock:
-            now = time.time()
-            self.timestamps = [t for t in self.timestamps if now - t < 60]
-            if len(self.timestamps) >= self.max:
-                wait_time = 60 - (now - self.timestamps[0]) + 0.5
-                add_log(f'⏳ Rate limit, waiting {wait_time:.0f}s...', 'warning')
-                time.sleep(wait_time)
-                self.timestamps = []
-            self.timestamps.append(time.time())
-
-def process_certificate(acc_idx, row_idx, row_data, rate_limiter):
-    """Process one certificate"""
-    if stop_flag.is_set():
-        return False
+            return [dict(r) for r in self.conn.execute(sql, params).fetchall()]
     
-    while pause_flag.is_set():
-        time.sleep(0.5)
-        if stop_flag.is_set():
-            return False
+    def start_job(self, config, variables, todo, name_col_idx, job_key='default', weight=1):
+        """Record a new job and its rows as pending; returns the job id"""
+        rows = offload(lambda: [
+            (row_idx, row_data[name_col_idx].strip() if len(row_data) > name_col_idx else '',
+             json.dumps(row_data, ensure_ascii=False))
+            for row_idx, row_data in todo
+        ], size=len(todo))
+        with self.lock, self.conn:
+            job_id = self.conn.execute(
+                'INSERT INTO jobs (sheet_id, template_id, target_folder_id, config, variables, status, total, started_at, job_key, weight) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (config['sheet_id'], config['template_doc_id'], config['target_folder_id'],
+                 json.dumps(config, ensure_ascii=False), json.dumps(variables, ensure_ascii=False),
+                 'running', len(todo), time.time(), job_key, weight)
+            ).lastrowid
+            self.conn.executemany(
+                'INSERT INTO rows (sheet_id, row, job_id, name, row_data, status) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (sheet_id, row) DO UPDATE SET job_id = excluded.job_id, name = excluded.name, '
+                'row_data = excluded.row_data, status = excluded.status, error = NULL',
+                [(config['sheet_id'], row_idx, job_id, name, row_data, 'pending') for row_idx, name, row_data in rows]
+            )
+        return job_id
     
-    rate_limiter.wait()
-    drive, docs, slides, sheets = get_services(acc_idx)
+    def finish_job(self, job_id, status):
+        self._execute('UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?', (status, time.time(), job_id))
     
-    config = state['config']
-    variables = state['variables']
+    def mark_started(self, sheet_id, row):
+        self._execute(
+            "UPDATE rows SET status = 'in_progress', attempts = attempts + 1, started_at = ?, finished_at = NULL "
+            'WHERE sheet_id = ? AND row = ?',
+            (time.time(), sheet_id, row)
+        )
     
-    # Detect if template is Slides or Docs
-    template_type = config.get('template_type', 'doc')  # 'doc' or 'slide'
+    def mark_done(self, sheet_id, row, file_id, link):
+        self._execute(
+            "UPDATE rows SET status = 'done', file_id = ?, link = ?, finished_at = ?, error = NULL "
+            'WHERE sheet_id = ? AND row = ?',
+            (file_id, link, time.time(), sheet_id, row)
+        )
     
-    # Get file name from name column
-    name_col = config.get('name_column', '')
-    if name_col:
-        name_col_idx = column_to_index(name_col)
-    else:
-        # Fallback to first variable's column or column A
-        if variables and variables[0].get('column'):
-            name_col_idx = column_to_index(variables[0]['column'])
-        else:
-            name_col_idx = 0
+    def mark_failed(self, sheet_id, row, error):
+        self._execute(
+            "UPDATE rows SET status = 'failed', finished_at = ?, error = ? WHERE sheet_id = ? AND row = ?",
+            (time.time(), str(error)[:500], sheet_id, row)
+        )
     
-    raw_name = row_data[name_col_idx] if len(row_data) > name_col_idx else f'Certificate_{row_idx}'
+    def lease_rows(self, job_id, worker, limit, seconds):
+        """Lease up to limit pending rows of a job to worker; returns
+        (rows as [{sheet_id, row, row_data}], expired leases re-queued)"""
+        now = time.time()
+        with self.lock, self.conn:
+            # Rows of workers that stopped renewing go back to the queue
+            requeued = self.conn.execute(
+                "UPDATE rows SET status = 'pending', lease_owner = NULL "
+                "WHERE job_id = ? AND status = 'leased' AND lease_until < ?",
+                (job_id, now)
+            ).rowcount
+            rows = [dict(r) for r in self.conn.execute(
+                "SELECT sheet_id, row, row_data FROM rows WHERE job_id = ? AND status = 'pending' ORDER BY row LIMIT ?",
+                (job_id, limit)
+            ).fetchall()]
+            self.conn.executemany(
+                "UPDATE rows SET status = 'leased', lease_owner = ?, lease_until = ?, attempts = attempts + 1, "
+                'started_at = ?, finished_at = NULL WHERE sheet_id = ? AND row = ?',
+                [(worker, now + seconds, now, r['sheet_id'], r['row']) for r in rows]
+            )
+        for r in rows:
+            r['row_data'] = json.loads(r['row_data'])
+        return rows, requeued
     
-    # Clean the name
-    file_name = clean_name(raw_name)
+    def renew_leases(self, worker, rows, seconds):
+        """Extend worker's leases on [(job_id, row)]"""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE rows SET lease_until = ? WHERE job_id = ? AND row = ? AND status = 'leased' AND lease_owner = ?",
+                [(time.time() + seconds, job_id, row, worker) for job_id, row in rows]
+            )
     
-    state['current_name'] = file_name
-    broadcast_state()
+    def row_status(self, sheet_id, row):
+        rows = self._query('SELECT status, lease_owner FROM rows WHERE sheet_id = ? AND row = ?', (sheet_id, row))
+        return rows[0] if rows else None
     
-    doc_id = None
+    def queue_counts(self, job_id):
+        """{status: rows} of a job"""
+        rows = self._query('SELECT status, COUNT(*) AS n FROM rows WHERE job_id = ? GROUP BY status', (job_id,))
+        return {r['status']: r['n'] for r in rows}
     
-    # Use shared root folder as temp folder
-    temp_folder = config.get('temp_folder_id') or SHARED_ROOT_FOLDER
+    def get_output(self, key):
+        rows = self._query('SELECT file_id, link, account FROM outputs WHERE key = ?', (key,))
+        return rows[0] if rows else None
     
-    try:
-        # 1. Copy template
-        doc_id = drive.files().copy(
-            fileId=config['template_doc_id'],
-            body={'name': file_name, 'parents': [temp_folder]},
-            supportsAllDrives=True,
-            fields='id'
-        ).execute()['id']
-        
-        time.sleep(0.3)
-        
-        # 2. Replace ALL variables
-        requests = []
-        for idx, var in enumerate(variables):
-            placeholder = var['placeholder']
-            
-            if var['source'] == 'column':
-                col_idx = column_to_index(var['column'])
-                raw_value = row_data[col_idx] if len(row_data) > col_idx else ''
-                # Always clean name values
-                value = clean_name(raw_value)
-            else:
-                value = var.get('value', '')
-            
-            requests.append({
-                'replaceAllText': {
-                    'containsText': {'text': placeholder, 'matchCase': True},
-                    'replaceText': str(value)
-                }
-            })
-        
-        if requests:
-            if template_type == 'slide':
-                # Use Slides API
-                slides.presentations().batchUpdate(
-                    presentationId=doc_id,
-                    body={'requests': requests}
-                ).execute()
-            else:
-                # Use Docs API
-                docs.documents().batchUpdate(
-                    documentId=doc_id,
-                    body={'requests': requests}
-                ).execute()
-        
-        # 3. Export as PDF
-        pdf_data = drive.files().export(fileId=doc_id, mimeType='application/pdf').execute()
-        
-        # 4. Upload PDF
-        pdf_file = drive.files().create(
-            body={'name': f'{file_name}.pdf', 'parents': [config['target_folder_id']]},
-            media_body=MediaIoBaseUpload(io.BytesIO(pdf_data), mimetype='application/pdf'),
-            fields='webViewLink',
-            supportsAllDrives=True
-        ).execute()
-        
-        # 5. Delete temp doc (try multiple times)
-        delete_success = False
-        for attempt in range(3):
-            try:
-                time.sleep(0.5)  # Wait a bit before deleting
-                drive.files().delete(fileId=doc_id, supportsAllDrives=True).execute()
-                delete_success = True
-                doc_id = None
-                break
-            except Exception as del_err:
-                if attempt == 2:  # Last attempt
-                    # Try to trash instead
-                    try:
-                        drive.files().update(fileId=doc_id, body={'trashed': True}, supportsAllDrives=True).execute()
-                        doc_id = None
-                    except:
-                        add_log(f'⚠️ Could not delete temp doc: {str(del_err)[:80]}', 'warning')
-        
-        # 6. Update sheet with link
-        link_col = config['link_column'].upper()
-        
-        # row_idx is now the actual row number in the sheet
-        actual_row = row_idx
-        
-        sheets.spreadsheets().values().update(
-            spreadsheetId=config['sheet_id'],
-            range=f"{link_col}{actual_row}",
-            valueInputOption='RAW',
-            body={'values': [[pdf_file['webViewLink']]]}
-        ).execute()
-        
-        # Track processed names
-        with state_lock:
-            state['processed_names'].add(file_name)
-            state['completed'] += 1
-        
-        add_log(f'✅ [{state["completed"]}/{state["total"]}] {file_name}', 'success')
-        broadcast_state()
-        
-        return True
-        
-    except Exception as e:
-        with state_lock:
-            state['failed'] += 1
-        add_log(f'❌ {file_name}: {str(e)[:100]}', 'error')
-        
-        if doc_id:
-            try:
-                drive.files().delete(fileId=doc_id, supportsAllDrives=True).execute()
-            except:
-                pass
-        
-        broadcast_state()
-        return False
+    def put_output(self, key, file_id, link, account=None):
+        self._execute(
+            'INSERT OR REPLACE INTO outputs (key, file_id, link, created_at, account) VALUES (?, ?, ?, ?, ?)',
+            (key, file_id, link, time.time(), account)
+        )
+    
+    def drop_output(self, key):
+        self._execute('DELETE FROM outputs WHERE key = ?', (key,))
+    
+    def interrupted_jobs(self):
+        """Jobs still marked running (the service died mid-run), newest first"""
+        return self._query("SELECT * FROM jobs WHERE status = 'running' ORDER BY id DESC")
+    
+    def unfinished_rows(self, job_id):
+        """[(row, row_data)] of a job's rows that are not done"""
+        rows = self._query(
+            "SELECT row, row_data FROM rows WHERE job_id = ? AND status != 'done' ORDER BY row",
+            (job_id,)
+        )
+        return [(r['row'], json.loads(r['row_data'])) for r in rows]
+    
+    def job_files(self, job_id):
+        """[{row, name, file_id}] of a job's generated PDFs"""
+        return self._query(
+            "SELECT row, name, file_id FROM rows WHERE job_id = ? AND status = 'done' AND file_id IS NOT NULL ORDER BY row",
+            (job_id,)
+        )
+    
+    def recent_jobs(self, limit=20):
+        return self._query(
+            'SELECT j.id, j.sheet_id, j.template_id, j.status, j.total, j.started_at, j.finished_at, '
+            "SUM(r.status = 'done') AS done, SUM(r.status = 'failed') AS failed, "
+            'AVG(r.finished_at - r.started_at) AS avg_seconds '
+            'FROM jobs j LEFT JOIN rows r ON r.job_id = j.id '
+            'GROUP BY j.id ORDER BY j.id DESC LIMIT ?',
+            (limit,)
+        )
 
-def account_worker(acc_idx, items, rate_limiter):
-    """Worker for one account"""
-    for row_idx, row_data in items:
-        if stop_flag.is_set():
-            break
-        process_certificate(acc_idx, row_idx, row_data, rate_limiter)
+job_store = JobStore(':memory:' if WORKER_MODE else STATE_DB_FILE)
 
-def get_pending_rows():
-    """Get rows that need certificates"""
-    config = state['config']
+class OutputCache:
+    """Reuses PDFs already generated for the same template and values.
+
+    Keyed by the template's Drive version plus every resolved variable (and
+    the render settings in local mode), so an edited template or a changed
+    name never matches. Hits are checked against Drive before reuse.
+    """
     
-    if not config['sheet_id']:
-        return []
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
     
-    try:
-        _, _, _, sheets = get_services(0)
-        
-        # Determine range based on mode
-        if config['range_mode'] == 'custom':
-            range_start = int(config.get('range_start', 2))
-            range_end = int(config.get('range_end', 1000))
-            sheet_range = f'A{range_start}:Z{range_end}'
-            start_row = range_start
-            skip_header = False
-        else:
-            # All rows mode - start from row 2 (after header)
-            sheet_range = 'A2:Z'
-            start_row = 2
-            skip_header = False
-        
-        result = sheets.spreadsheets().values().get(
-            spreadsheetId=config['sheet_id'],
-            range=sheet_range
-        ).execute()
-        
-        rows = result.get('values', [])
-        
-        link_col_idx = column_to_index(config['link_column'])
-        
-        # Get name column from first variable
-        variables = state.get('variables', [])
+    def begin(self, ctx, acc_idx=0):
+        """Pin the template revision for the job's run; disables the cache on error"""
+        config = ctx.config
+        ctx.output_key = None
+        if not config.get('reuse_outputs', True):
+            return
+        try:
+            with account_services(acc_idx) as (drive, _, _, _):
+                info = execute_api(drive.files().get(
+                    fileId=config['template_doc_id'],
+                    fields='id, version',
+                    supportsAllDrives=True
+                ), acc_idx, 'drive')
+        except Exception as e:
+            ctx.log(f'⚠️ Output cache off for this run: {str(e)[:100]}', 'warning')
+            return
+        key = [config['template_doc_id'], info.get('version')]
+        if ctx.local_render:
+            key += [config.get('render_font'), config.get('render_fields')]
+        ctx.output_key = key
+    
+    def key(self, job):
+        payload = json.dumps([job.ctx.output_key, job.values], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def lookup(self, job):
+        """Fill job.file_id/link from the cache; returns True on a hit"""
+        if job.ctx.output_key is None:
+            return False
+        job.cache_key = self.key(job)
+        hit = self.store.get_output(job.cache_key)
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if hit:
+            job.file_id, job.link = hit['file_id'], hit['link']
+            # Checked with the account that uploaded it (older entries: the job's)
+            job.cache_account = hit['account'] if hit['account'] is not None else job.acc_idx
+        return bool(hit)
+    
+    def remember(self, job):
+        if job.cache_key and job.file_id:
+            account = job.acc_idx if isinstance(job.acc_idx, int) else None
+            self.store.put_output(job.cache_key, job.file_id, job.link, account)
+    
+    def skip(self, job):
+        """Generate a hit's row normally without dropping the entry (its file
+        could not be checked)"""
+        job.file_id = job.link = None
+    
+    def forget(self, job):
+        """Drop a hit whose file is gone and generate the row normally"""
+        self.store.drop_output(job.cache_key)
+        self.skip(job)
+        with self.lock:
+            self.stale += 1
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': default_job.output_key is not None,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'hit_rate': round(self.hits / lookups * 100, 1) if lookups else 0,
+            }
+
+output_cache = OutputCache(job_store)
+
+def drop_linked_rows(config, todo):
+    """Rows of todo that have no link yet. A row may have been finished just
+    before the service stopped: its link is then in the sheet or still
+    buffered from the link journal, and generating it again would make a
+    second PDF."""
+    sheet_id = config['sheet_id']
+    link_col = config['link_column'].upper()
+    link_col_idx = column_to_index(link_col)
+    first_row, last_row = todo[0][0], todo[-1][0]
+    try:
+        with account_services(0) as (_, _, _, sheets):
+            rows = read_sheet_rows(sheets, sheet_id, first_row, last_row)
+    except Exception as e:
+        add_log(f'⚠️ Could not check existing links before resuming: {str(e)[:100]}', 'warning')
+        rows = []
+    
+    pending = []
+    for row_idx, row_data in todo:
+        sheet_row = rows[row_idx - first_row] if row_idx - first_row < len(rows) else []
+        link = sheet_row[link_col_idx].strip() if len(sheet_row) > link_col_idx else ''
+        if link:
+            job_store.mark_done(sheet_id, row_idx, None, link)
+        elif not link_writer.is_pending(sheet_id, f'{link_col}{row_idx}'):
+            pending.append((row_idx, row_data))
+    return pending
+
+def resume_interrupted_jobs():
+    """Continue the jobs the service was running when it stopped; returns
+    how many were resumed"""
+    global generator_thread
+    
+    resumed = 0
+    dashboard_restored = False
+    for job in job_store.interrupted_jobs():
+        todo = job_store.unfinished_rows(job['id'])
+        job_store.finish_job(job['id'], 'interrupted')
+        config = json.loads(job['config'])
+        if todo:
+            todo = drop_linked_rows(config, todo)
+        if not todo:
+            continue
+        
+        variables = json.loads(job['variables'])
+        resumed += 1
+        
+        if (job['job_key'] or 'default') == default_job.id and not dashboard_restored:
+            # Restore the dashboard's configuration (watching is not resumed automatically)
+            dashboard_restored = True
+            state['config'].update(config)
+            state['config']['auto_watch'] = False
+            state['variables'] = variables
+            invalidate_cleanup_engine()
+            
+            add_log(f'♻️ Resuming job {job["id"]}: {len(todo)} certificates left', 'info')
+            generator_thread = threading.Thread(target=run_generator, args=(todo,))
+            generator_thread.start()
+        else:
+            ctx = job_manager.create(config, variables, float(job['weight'] or 1), todo)
+            ctx.log(f'♻️ Resuming job {job["id"]}: {len(todo)} certificates left', 'info')
+    return resumed
+
+# ============ CERTIFICATE GENERATION ============
+
+# Retry/backoff settings for quota errors (HTTP 429 / rateLimitExceeded)
+RATE_LIMIT_RETRIES = 5
+BACKOFF_BASE = 2  # seconds
+BACKOFF_MAX = 64  # seconds
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate_per_min"""
+    
+    def __init__(self, rate_per_min, burst=None):
+        self.rate = rate_per_min / 60.0
+        self.capacity = burst or max(1.0, rate_per_min / 6.0)  # ~10s of burst
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # Set by backoff after a quota error
+        self.strikes = 0
+        self.waited = 0.0
+    
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def reserve(self, n=1):
+        """Take n tokens and return how long the caller must wait to use them"""
+        now = time.monotonic()
+        self.refill(now)
+        self.tokens -= n
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        return max(wait, self.blocked_until - now)
+
+class RateLimiter:
+    """Per-account, per-API-family token buckets with adaptive 429 backoff.
+
+    Quotas are requests per minute per account for each family
+    ('drive', 'docs', 'slides', 'sheets'). Waiting happens outside the lock,
+    so one throttled family never blocks the others.
+    """
+    
+    def __init__(self, quotas):
+        self.quotas = dict(quotas)
+        self.buckets = {}  # {(acc_idx, family): TokenBucket}
+        self.lock = threading.Lock()
+    
+    def configure(self, quotas):
+        with self.lock:
+            self.quotas = dict(quotas)
+            self.buckets = {}
+    
+    def _bucket(self, acc_idx, family):
+        key = (acc_idx, family)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.quotas.get(family, 60))
+        return bucket
+    
+    def acquire(self, acc_idx, family, n=1):
+        with self.lock:
+            bucket = self._bucket(acc_idx, family)
+            wait = bucket.reserve(n)
+            bucket.waited += wait
+        
+        metrics.inc('certgen_api_requests_total', n, account=acc_idx, family=family)
+        if wait > 0:
+            metrics.inc('certgen_rate_limit_wait_seconds_total', wait, account=acc_idx, family=family)
+            if wait >= 5:
+                add_log(f'⏳ Rate limit ({family}, account {acc_idx}), waiting {wait:.0f}s...', 'warning')
+            # Waiting for quota (or a backoff) is progress, not a stall
+            end = time.monotonic() + wait
+            while True:
+                report_progress()
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+                time.sleep(min(remaining, PROGRESS_INTERVAL))
+        return wait
+    
+    def backoff(self, acc_idx, family):
+        """Record a quota error; returns the backoff delay in seconds"""
+        metrics.inc('certgen_rate_limited_total', account=acc_idx, family=family)
+        with self.lock:
+            bucket = self._bucket(acc_idx, family)
+            bucket.strikes += 1
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (bucket.strikes - 1)) + random.uniform(0, BACKOFF_BASE)
+            bucket.blocked_until = time.monotonic() + delay
+            bucket.tokens = min(bucket.tokens, 0)
+            return delay
+    
+    def success(self, acc_idx, family):
+        with self.lock:
+            bucket = self.buckets.get((acc_idx, family))
+            if bucket and bucket.strikes:
+                bucket.strikes = 0
+    
+    def stats(self):
+        with self.lock:
+            now = time.monotonic()
+            result = {}
+            for (acc_idx, family), bucket in sorted(self.buckets.items()):
+                bucket.refill(now)
+                result.setdefault(str(acc_idx), {})[family] = {
+                    'tokens': round(bucket.tokens, 2),
+                    'capacity': round(bucket.capacity, 2),
+                    'per_min': self.quotas.get(family, 60),
+                    'backoff': round(max(0, bucket.blocked_until - now), 1),
+                    'strikes': bucket.strikes,
+                    'waited': round(bucket.waited, 1),
+                }
+            return {'quotas': self.quotas, 'accounts': result}
+
+rate_limiter = RateLimiter(state['config']['api_quotas'])
+
+def is_rate_limit_error(error):
+    """True for HTTP 429 and 403 rateLimitExceeded/userRateLimitExceeded"""
+    if not isinstance(error, HttpError):
+        return False
+    status = getattr(error.resp, 'status', None)
+    if status == 429:
+        return True
+    if status == 403:
+        content = error.content.decode('utf-8', 'ignore') if isinstance(error.content, bytes) else str(error.content)
+        return 'rateLimitExceeded' in content or 'userRateLimitExceeded' in content
+    return False
+
+def execute_api(api_request, acc_idx, family):
+    """Execute a Google API request under the account's quota for family.
+
+    Quota errors back off exponentially (with jitter) and retry instead of
+    failing the certificate.
+    """
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        rate_limiter.acquire(acc_idx, family)
+        try:
+            result = api_request.execute()
+        except Exception as e:
+            if attempt < RATE_LIMIT_RETRIES and is_rate_limit_error(e):
+                delay = rate_limiter.backoff(acc_idx, family)
+                add_log(f'⏳ {family} quota exceeded (account {acc_idx}), retrying in {delay:.0f}s...', 'warning')
+                continue  # acquire() waits out the backoff
+            raise
+        rate_limiter.success(acc_idx, family)
+        return result
+
+# Google caps one HTTP batch at 100 calls
+BATCH_LIMIT = 100
+
+def execute_batch(service, acc_idx, family, requests):
+    """Send independent requests of one service as multipart HTTP batches.
+
+    requests is a list of (key, request). Returns {key: (response, error)}
+    so each sub-request's outcome maps back to its caller. Sub-requests hit
+    by quota errors are backed off and re-sent like execute_api does.
+    """
+    results = {}
+    
+    for chunk_start in range(0, len(requests), BATCH_LIMIT):
+        chunk = requests[chunk_start:chunk_start + BATCH_LIMIT]
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            outcomes = {}
+            
+            def callback(request_id, response, exception):
+                outcomes[int(request_id)] = (response, exception)
+            
+            batch = service.new_batch_http_request(callback=callback)
+            for i, (_, api_request) in enumerate(chunk):
+                batch.add(api_request, request_id=str(i))
+            
+            rate_limiter.acquire(acc_idx, family, len(chunk))
+            try:
+                batch.execute()
+            except Exception as e:
+                # The whole batch failed - every sub-request gets the error
+                outcomes = {i: (None, e) for i in range(len(chunk))}
+            
+            retry = []
+            for i, (key, api_request) in enumerate(chunk):
+                response, error = outcomes.get(i, (None, None))
+                if error is not None and attempt < RATE_LIMIT_RETRIES and is_rate_limit_error(error):
+                    retry.append((key, api_request))
+                else:
+                    results[key] = (response, error)
+            
+            if not retry:
+                rate_limiter.success(acc_idx, family)
+                break
+            delay = rate_limiter.backoff(acc_idx, family)
+            add_log(f'⏳ {family} quota exceeded in batch (account {acc_idx}), retrying {len(retry)} calls in {delay:.0f}s...', 'warning')
+            chunk = retry
+    
+    return results
+
+# ============ LINK WRITER ============
+
+# Links waiting to be written are journaled here so a crash before the
+# flush does not lose them; the journal is replayed on startup
+LINK_JOURNAL_FILE = 'pending-links.jsonl'
+
+class LinkWriter:
+    """Write-behind buffer for certificate links.
+
+    Workers add (row, link) pairs; they are written with one
+    values().batchUpdate per sheet every flush_rows links or flush_interval
+    seconds, and on stop/complete. Links that fail to flush stay queued.
+    """
+    
+    def __init__(self, flush_rows=50, flush_interval=5, journal_file=LINK_JOURNAL_FILE):
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.journal_file = journal_file
+        self.pending = OrderedDict()  # {(sheet_id, range): link}
+        self.oldest = None
+        self.flushes = 0
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+    
+    def start(self):
+        """Start the periodic flusher (idempotent)"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.thread.start()
+    
+    def _flush_loop(self):
+        while True:
+            time.sleep(1)
+            with self.lock:
+                due = self.oldest is not None and time.time() - self.oldest >= self.flush_interval
+            if due:
+                self.flush()
+    
+    def add(self, sheet_id, cell_range, link):
+        entry = {'sheet_id': sheet_id, 'range': cell_range, 'link': link}
+        with self.lock:
+            self.pending[(sheet_id, cell_range)] = link
+            if self.oldest is None:
+                self.oldest = time.time()
+            with open(self.journal_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            full = len(self.pending) >= self.flush_rows
+        
+        if full:
+            self.flush()
+    
+    def is_pending(self, sheet_id, cell_range):
+        with self.lock:
+            return (sheet_id, cell_range) in self.pending
+    
+    def replay_journal(self):
+        """Re-queue links left over from a previous run"""
+        if not os.path.exists(self.journal_file):
+            return 0
+        
+        with self.lock:
+            with open(self.journal_file, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Partially written last line
+                    self.pending[(entry['sheet_id'], entry['range'])] = entry['link']
+            if self.pending and self.oldest is None:
+                self.oldest = time.time()
+            return len(self.pending)
+    
+    def _rewrite_journal(self):
+        """Rewrite the journal to hold exactly the pending links (lock held)"""
+        if not self.pending:
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+            return
+        tmp_file = self.journal_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            for (sheet_id, cell_range), link in self.pending.items():
+                f.write(json.dumps({'sheet_id': sheet_id, 'range': cell_range, 'link': link}, ensure_ascii=False) + '\n')
+        os.replace(tmp_file, self.journal_file)
+    
+    def flush(self):
+        """Write all pending links; returns the number written"""
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    self.oldest = None
+                    return 0
+                batch = list(self.pending.items())
+            
+            by_sheet = {}
+            for (sheet_id, cell_range), link in batch:
+                by_sheet.setdefault(sheet_id, []).append({'range': cell_range, 'values': [[link]]})
+            
+            written = set()
+            acc_idx = self.flushes % max(1, len(state['accounts']))
+            self.flushes += 1
+            with account_services(acc_idx) as (_, _, _, sheets):
+                for sheet_id, data in by_sheet.items():
+                    try:
+                        with metrics.timer('certgen_stage_seconds', stage='sheet_write'):
+                            execute_api(sheets.spreadsheets().values().batchUpdate(
+                                spreadsheetId=sheet_id,
+                                body={
+                                    'valueInputOption': 'RAW',
+                                    'data': data
+                                }
+                            ), acc_idx, 'sheets')
+                        written.update((sheet_id, item['range']) for item in data)
+                    except Exception as e:
+                        add_log(f'⚠️ Could not write {len(data)} links, will retry: {str(e)[:80]}', 'warning')
+            
+            with self.lock:
+                for key, link in batch:
+                    if key in written and self.pending.get(key) == link:
+                        del self.pending[key]
+                self.oldest = time.time() if self.pending else None
+                self._rewrite_journal()
+            
+            return len(written)
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'pending': len(self.pending),
+                'flushes': self.flushes,
+                'flush_rows': self.flush_rows,
+                'flush_interval': self.flush_interval,
+            }
+
+link_writer = LinkWriter(state['config']['link_flush_rows'], state['config']['link_flush_interval'])
+atexit.register(link_writer.flush)
+
+def retry_until_ready(fn, attempts=5, delay=0.25):
+    """Call fn, retrying while a freshly created file is not visible yet (404/409)"""
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except HttpError as e:
+            if attempt == attempts - 1 or getattr(e.resp, 'status', None) not in (404, 409):
+                raise
+            time.sleep(delay * 2 ** attempt)
+
+MB = 1024 * 1024
+
+class MemoryBudget:
+    """Bytes of PDF data all workers may hold in memory together"""
+    
+    def __init__(self, limit):
+        self.lock = threading.Lock()
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self.spilled = 0
+    
+    def reserve(self, size):
+        """Grant size bytes, or 0 if that would go over the budget"""
+        with self.lock:
+            if self.used + size > self.limit:
+                self.spilled += 1
+                return 0
+            self.used += size
+            self.peak = max(self.peak, self.used)
+            return size
+    
+    def release(self, size):
+        with self.lock:
+            self.used -= size
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'limit_mb': round(self.limit / MB, 1),
+                'used_mb': round(self.used / MB, 1),
+                'peak_mb': round(self.peak / MB, 1),
+                'spilled': self.spilled,
+            }
+
+memory_budget = MemoryBudget(state['config']['pdf_memory_budget_mb'] * MB)
+
+class PdfSpool:
+    """Temp file holding one PDF between export and upload.
+
+    The export is not piped straight into the upload: a resumable upload
+    must be able to rewind and resend a failed chunk, and Drive does not
+    report an export's size up front. The spool stays in memory up to the
+    size granted by memory_budget and rolls over to disk beyond it; with no
+    grant left it goes straight to disk.
+    """
+    
+    def __init__(self):
+        self.grant = memory_budget.reserve(int(state['config']['pdf_spool_mb'] * MB))
+        if self.grant:
+            self.file = tempfile.SpooledTemporaryFile(max_size=self.grant)
+        else:
+            self.file = tempfile.TemporaryFile()
+    
+    def getvalue(self):
+        self.file.seek(0)
+        return self.file.read()
+    
+    def close(self):
+        self.file.close()
+        memory_budget.release(self.grant)
+        self.grant = 0
+
+class MediaDownload:
+    """Chunked download of a media request into a file, run by execute_api"""
+    
+    def __init__(self, api_request, fh, chunksize):
+        self.api_request = api_request
+        self.fh = fh
+        self.chunksize = chunksize
+    
+    def execute(self):
+        # Start over on retries
+        self.fh.seek(0)
+        self.fh.truncate()
+        downloader = MediaIoBaseDownload(self.fh, self.api_request, chunksize=self.chunksize)
+        done = False
+        while not done:
+            _, done = downloader.next_chunk()
+            report_progress()
+        return self.fh
+
+class CertificateJob:
+    """One row travelling through the certificate stages"""
+    
+    def __init__(self, acc_idx, row_idx, row_data, worker=None, ctx=None):
+        self.acc_idx = acc_idx
+        self.row_idx = row_idx
+        self.row_data = row_data
+        self.worker = worker
+        self.ctx = ctx or default_job
+        self.file_name = ''
+        self.doc_id = None
+        self.pdf_data = None  # PdfSpool
+        self.file_id = None
+        self.link = None
+        self.values = []  # [(placeholder, value)]
+        self.cache_key = None
+        self.cache_account = None  # Account that uploaded the cached PDF
+        self.lease = None  # AccountLease the row was admitted with
+    
+    def release_pdf(self):
+        """Free the PDF's memory grant and temp file"""
+        if self.pdf_data:
+            self.pdf_data.close()
+            self.pdf_data = None
+
+def build_certificate_job(acc_idx, row_idx, row_data, worker=None, ctx=None):
+    """Create the job for a row with its output file name and values"""
+    ctx = ctx or default_job
+    config = ctx.config
+    variables = ctx.variables
+    
+    # Get file name from name column
+    name_col = config.get('name_column', '')
+    if name_col:
+        name_col_idx = column_to_index(name_col)
+    else:
+        # Fallback to first variable's column or column A
         if variables and variables[0].get('column'):
             name_col_idx = column_to_index(variables[0]['column'])
         else:
-            name_col_idx = column_to_index('C')  # Default to C
+            name_col_idx = 0
+    
+    raw_name = row_data[name_col_idx] if len(row_data) > name_col_idx else f'Certificate_{row_idx}'
+    
+    job = CertificateJob(acc_idx % len(state['accounts']), row_idx, row_data, worker, ctx)
+    # Clean the name
+    job.file_name = clean_name(raw_name, ctx.cleanup_engine)
+    job.values = resolve_variables(row_data, variables, ctx.cleanup_engine)
+    return job
+
+def prepare_certificate(acc_idx, row_idx, row_data, worker=None, ctx=None):
+    """Create the job for a row and record that it started"""
+    job = build_certificate_job(acc_idx, row_idx, row_data, worker, ctx)
+    job.ctx.state['current_name'] = job.file_name
+    job_store.mark_started(job.ctx.config['sheet_id'], row_idx)
+    broadcast_state()
+    return job
+
+def copy_template(job, services):
+    """1. Copy template into the temp folder"""
+    drive, _, _, _ = services
+    config = job.ctx.config
+    
+    # Use shared root folder as temp folder
+    temp_folder = config.get('temp_folder_id') or SHARED_ROOT_FOLDER
+    
+    with metrics.timer('certgen_stage_seconds', stage='copy'):
+        job.doc_id = execute_api(drive.files().copy(
+            fileId=job.ctx.baked_template.source_id(),
+            body={'name': job.file_name, 'parents': [temp_folder], 'appProperties': TEMP_COPY_PROPERTY},
+            supportsAllDrives=True,
+            fields='id'
+        ), job.acc_idx, 'drive')['id']
+
+def copy_templates(jobs, services):
+    """1. Copy the template for several rows in one batch request.
+    
+    Returns [(job, error)] for the copies that failed.
+    """
+    drive, _, _, _ = services
+    config = jobs[0].ctx.config
+    temp_folder = config.get('temp_folder_id') or SHARED_ROOT_FOLDER
+    
+    source_id = jobs[0].ctx.baked_template.source_id()
+    requests = [
+        (idx, drive.files().copy(
+            fileId=source_id,
+            body={'name': job.file_name, 'parents': [temp_folder], 'appProperties': TEMP_COPY_PROPERTY},
+            supportsAllDrives=True,
+            fields='id'
+        ))
+        for idx, job in enumerate(jobs)
+    ]
+    start = time.monotonic()
+    results = execute_batch(drive, jobs[0].acc_idx, 'drive', requests)
+    # One sample per row like the other stages, each its share of the batch
+    share = (time.monotonic() - start) / len(jobs)
+    for _ in jobs:
+        metrics.observe('certgen_stage_seconds', share, stage='copy')
+    
+    failed = []
+    for idx, job in enumerate(jobs):
+        response, error = results.get(idx, (None, None))
+        if error is not None or not response:
+            failed.append((job, error or Exception('Copy returned no file')))
+        else:
+            job.doc_id = response['id']
+    return failed
+
+class BakedTemplate:
+    """Run-scoped copy of the template with the static variables filled in.
+
+    Rows are copied from it instead of the template, so their batchUpdate
+    only carries the per-row (column) values.
+    """
+    
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.lock = threading.Lock()
+        self.doc_id = None
+        self.acc_idx = 0
+        self.placeholders = set()
+    
+    def source_id(self):
+        """File the rows are copied from"""
+        with self.lock:
+            return self.doc_id or self.ctx.config['template_doc_id']
+    
+    def bake(self, acc_idx=0):
+        """Create the copy for this run (no-op without static variables)"""
+        self.release()
+        static = [(var['placeholder'], var.get('value', '')) for var in self.ctx.variables if var['source'] != 'column']
+        if not static:
+            return False
+        
+        job = CertificateJob(acc_idx, 0, [], None, self.ctx)
+        job.file_name = 'template-baked'
+        job.values = static
+        with account_services(acc_idx) as services:
+            copy_template(job, services)
+            try:
+                replace_variables(job, services)
+            except Exception:
+                janitor.discard(acc_idx, job.doc_id)
+                raise
+        
+        with self.lock:
+            self.doc_id = job.doc_id
+            self.acc_idx = acc_idx
+            self.placeholders = {placeholder for placeholder, _ in static}
+        self.ctx.log(f'🧁 Template pre-filled with {len(static)} static variables', 'info')
+        return True
+    
+    def release(self):
+        """Hand the copy to the janitor once the run no longer needs it"""
+        with self.lock:
+            doc_id, self.doc_id = self.doc_id, None
+            self.placeholders = set()
+        if doc_id:
+            janitor.discard(self.acc_idx, doc_id)
+
+def resolve_variables(row_data, variables, engine=None):
+    """[(placeholder, value)] for a row (column values cleaned with engine,
+    or the saved cleanup config)"""
+    values = []
+    for var in variables:
+        if var['source'] == 'column':
+            col_idx = column_to_index(var['column'])
+            raw_value = row_data[col_idx] if len(row_data) > col_idx else ''
+            # Always clean name values
+            value = clean_name(raw_value, engine)
+        else:
+            value = var.get('value', '')
+        values.append((var['placeholder'], value))
+    return values
+
+def replace_variables(job, services):
+    """2. Replace ALL variables in the copy"""
+    _, docs, slides, _ = services
+    
+    # Rendered locally - nothing to fill in Drive
+    if not job.doc_id:
+        return
+    
+    # Detect if template is Slides or Docs
+    template_type = job.ctx.config.get('template_type', 'doc')  # 'doc' or 'slide'
+    
+    requests = []
+    for placeholder, value in job.values:
+        # Already filled in the pre-baked copy
+        if placeholder in job.ctx.baked_template.placeholders:
+            continue
+        requests.append({
+            'replaceAllText': {
+                'containsText': {'text': placeholder, 'matchCase': True},
+                'replaceText': str(value)
+            }
+        })
+    
+    if not requests:
+        return
+    
+    # The copy may not be visible to Docs/Slides yet - retry until it is
+    if template_type == 'slide':
+        # Use Slides API
+        retry_until_ready(lambda: execute_api(slides.presentations().batchUpdate(
+            presentationId=job.doc_id,
+            body={'requests': requests}
+        ), job.acc_idx, 'slides'))
+    else:
+        # Use Docs API
+        retry_until_ready(lambda: execute_api(docs.documents().batchUpdate(
+            documentId=job.doc_id,
+            body={'requests': requests}
+        ), job.acc_idx, 'docs'))
+
+def export_pdf(job, services):
+    """3. Export the filled copy as PDF"""
+    drive, _, _, _ = services
+    
+    if not job.doc_id:
+        local_renderer.render(job)
+        return
+    
+    spool = PdfSpool()
+    chunksize = int(state['config']['pdf_chunk_mb'] * MB)
+    try:
+        retry_until_ready(lambda: execute_api(MediaDownload(
+            drive.files().export_media(fileId=job.doc_id, mimeType='application/pdf'), spool.file, chunksize
+        ), job.acc_idx, 'drive'))
+    except Exception:
+        spool.close()
+        raise
+    job.pdf_data = spool
+
+def upload_pdf(job, services):
+    """4. Upload PDF to the target folder"""
+    drive, _, _, _ = services
+    job.pdf_data.file.seek(0)
+    media = MediaIoBaseUpload(
+        job.pdf_data.file,
+        mimetype='application/pdf',
+        chunksize=int(state['config']['pdf_chunk_mb'] * MB),
+        resumable=True
+    )
+    try:
+        pdf_file = execute_api(drive.files().create(
+            body={'name': f'{job.file_name}.pdf', 'parents': [job.ctx.config['target_folder_id']]},
+            media_body=media,
+            fields='id, webViewLink',
+            supportsAllDrives=True
+        ), job.acc_idx, 'drive')
+    finally:
+        job.release_pdf()
+    job.file_id = pdf_file['id']
+    job.link = pdf_file['webViewLink']
+    drive_cache.invalidate(job.ctx.config['target_folder_id'])
+
+def shape_text(text):
+    """Arabic letters joined and ordered right-to-left for drawing"""
+    return get_display(arabic_reshaper.reshape(text))
+
+class LocalRenderer:
+    """Fills certificates locally on a blank PDF of the template.
+
+    The template is exported once with its placeholders emptied; each
+    certificate then only draws its values into the configured regions
+    (render_fields, in PDF points from the page's bottom-left corner) and
+    is uploaded, skipping the per-row copy, batchUpdate, export and delete.
+    Blank templates are kept per template revision, so jobs rendering
+    different templates can run side by side; a template is never evicted
+    while a job still uses it (prepare() until release()).
+    """
+    
+    def __init__(self, max_templates=4):
+        self.lock = threading.Lock()
+        self.templates = OrderedDict()  # {key: (template_pdf, page_sizes)}
+        self.users = {}  # {key: set of JobContexts rendering with it}
+        self.max_templates = max_templates
+        self.fonts = set()
+        self.rendered = 0
+        self.render_time = 0.0
+    
+    def prepare(self, ctx, acc_idx=0):
+        """Export the job's blank template (once per template revision)"""
+        config = ctx.config
+        with account_services(acc_idx) as services:
+            drive = services[0]
+            info = execute_api(drive.files().get(
+                fileId=config['template_doc_id'],
+                fields='id, modifiedTime',
+                supportsAllDrives=True
+            ), acc_idx, 'drive')
+            key = (config['template_doc_id'], info.get('modifiedTime'),
+                   tuple(var['placeholder'] for var in ctx.variables))
+            with self.lock:
+                if key in self.templates:
+                    self.templates.move_to_end(key)
+                    self._use(ctx, key)
+                    return
+            
+            job = CertificateJob(acc_idx, 0, [], None, ctx)
+            job.file_name = 'template-blank'
+            job.values = [(var['placeholder'], '') for var in ctx.variables]
+            copy_template(job, services)
+            try:
+                replace_variables(job, services)
+                export_pdf(job, services)
+            finally:
+                janitor.discard(acc_idx, job.doc_id)
+        
+        template_pdf = job.pdf_data.getvalue()
+        job.release_pdf()
+        reader = PdfReader(io.BytesIO(template_pdf))
+        page_sizes = [(float(page.mediabox.width), float(page.mediabox.height)) for page in reader.pages]
+        with self.lock:
+            self.templates[key] = (template_pdf, page_sizes)
+            self._use(ctx, key)
+            self._evict()
+        ctx.log(f'🖨️ Template exported for local rendering ({len(page_sizes)} pages)', 'info')
+    
+    def _use(self, ctx, key):
+        """Make key ctx's template (caller holds the lock)"""
+        if ctx.render_key in self.users:
+            self.users[ctx.render_key].discard(ctx)
+        self.users.setdefault(key, set()).add(ctx)
+        ctx.render_key = key
+    
+    def _evict(self):
+        """Drop the oldest unused templates beyond max_templates (caller holds the lock)"""
+        for key in list(self.templates):
+            if len(self.templates) <= self.max_templates:
+                break
+            if not self.users.get(key):
+                del self.templates[key]
+                self.users.pop(key, None)
+    
+    def release(self, ctx):
+        """ctx no longer renders; its template may be evicted"""
+        with self.lock:
+            users = self.users.get(ctx.render_key)
+            if users:
+                users.discard(ctx)
+            self._evict()
+    
+    def page_sizes(self, ctx):
+        """[(width, height)] of the job's blank template pages"""
+        with self.lock:
+            entry = self.templates.get(ctx.render_key)
+        return entry[1] if entry else []
+    
+    def _font(self, path):
+        """Register a TTF font once; returns its name"""
+        if not path:
+            return 'Helvetica'
+        name = os.path.splitext(os.path.basename(path))[0]
+        with self.lock:
+            if name not in self.fonts:
+                pdfmetrics.registerFont(TTFont(name, path))
+                self.fonts.add(name)
+        return name
+    
+    def _overlay(self, size, fields, values):
+        """One-page PDF with the field values drawn in place"""
+        buf = io.BytesIO()
+        c = pdf_canvas.Canvas(buf, pagesize=size)
+        for field in fields:
+            text = shape_text(str(values.get(field['placeholder'], '')))
+            font = field['font_name']
+            font_size = float(field.get('font_size', 24))
+            box = float(field.get('width', 0))
+            
+            # Shrink long names to fit the region
+            while box and font_size > 6 and pdfmetrics.stringWidth(text, font, font_size) > box:
+                font_size -= 1
+            
+            c.setFont(font, font_size)
+            c.setFillColor(HexColor(field.get('color', '#000000')))
+            x, y = float(field['x']), float(field['y'])
+            align = field.get('align', 'center')
+            if align == 'center':
+                c.drawCentredString(x + box / 2, y, text)
+            elif align == 'right':
+                c.drawRightString(x + box, y, text)
+            else:
+                c.drawString(x, y, text)
+        c.save()
+        return PdfReader(io.BytesIO(buf.getvalue())).pages[0]
+    
+    def _draw(self, template_pdf, fields, values):
+        """The filled certificate as PDF bytes; touches no shared state, so it
+        can run off the hub"""
+        reader = PdfReader(io.BytesIO(template_pdf))
+        writer = PdfWriter()
+        for page_no, page in enumerate(reader.pages):
+            page_fields = [f for f in fields if int(f.get('page', 0)) == page_no]
+            if page_fields:
+                size = (float(page.mediabox.width), float(page.mediabox.height))
+                page.merge_page(self._overlay(size, page_fields, values))
+            writer.add_page(page)
+        buf = io.BytesIO()
+        writer.write(buf)
+        return buf.getvalue()
+    
+    def render(self, job):
+        """Draw the job's values onto the blank template"""
+        start = time.monotonic()
+        config = job.ctx.config
+        default_font = config.get('render_font', '')
+        # Fonts are registered here, on the hub; drawing runs on an OS thread
+        fields = [
+            dict(field, font_name=self._font(field.get('font') or default_font))
+            for field in config.get('render_fields', [])
+        ]
+        with self.lock:
+            entry = self.templates.get(job.ctx.render_key)
+        if entry is None:
+            # Not prepared by this context (e.g. replaced) - export it again
+            self.prepare(job.ctx, job.acc_idx)
+            with self.lock:
+                entry = self.templates[job.ctx.render_key]
+        template_pdf = entry[0]
+        
+        data = offload(self._draw, template_pdf, fields, dict(job.values))
+        spool = PdfSpool()
+        spool.file.write(data)
+        job.pdf_data = spool
+        
+        with self.lock:
+            self.rendered += 1
+            self.render_time += time.monotonic() - start
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'available': LOCAL_RENDER_AVAILABLE,
+                'active': default_job.local_render,
+                'templates': len(self.templates),
+                'rendered': self.rendered,
+                'avg_ms': round(self.render_time / self.rendered * 1000, 1) if self.rendered else 0,
+            }
+
+local_renderer = LocalRenderer()
+
+def use_local_render(ctx):
+    """Whether the job's run can render locally; prepares the blank template"""
+    config = ctx.config
+    if config.get('render_mode') != 'local':
+        return False
+    if not LOCAL_RENDER_AVAILABLE:
+        ctx.log('⚠️ Local rendering needs pypdf, reportlab, arabic-reshaper and python-bidi - using Drive export', 'warning')
+        return False
+    if not config.get('render_fields'):
+        ctx.log('⚠️ No render regions set - using Drive export', 'warning')
+        return False
+    try:
+        local_renderer.prepare(ctx)
+        return True
+    except Exception as e:
+        ctx.log(f'⚠️ Could not prepare local rendering: {str(e)[:100]} - using Drive export', 'warning')
+        return False
+
+# This installation (host + directory; workers apart from their controller),
+# so a sweep never touches copies another instance may still be using
+INSTANCE_ID = hashlib.sha1(
+    f'{socket.gethostname()}:{os.path.abspath(".")}:{"worker" if WORKER_MODE else "controller"}'.encode('utf-8')
+).hexdigest()[:12]
+
+# Marks template copies made by this tool so orphans can be found later
+TEMP_COPY_PROPERTY = {'certgen': 'temp', 'certgen_instance': INSTANCE_ID}
+
+# Copies made this long before startup may still belong to the previous run
+TEMP_SWEEP_GRACE = 600  # seconds
+
+class TempJanitor:
+    """Deletes temporary Doc/Slides copies off the critical path.
+
+    Copies are queued with discard() and deleted in bulk by a background
+    thread. Failed deletions are retried later; the last attempt trashes the
+    copy instead. sweep() re-queues tagged copies left behind by crashed runs
+    of this instance.
+    """
+    
+    def __init__(self, bulk_size=20, max_attempts=3):
+        self.bulk_size = bulk_size
+        self.max_attempts = max_attempts
+        self.pending = deque()  # (acc_idx, doc_id, attempts, not_before)
+        self.deleted = 0
+        self.trashed = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.started = time.time()
+    
+    def start(self):
+        """Start the background deleter (idempotent)"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def discard(self, acc_idx, doc_id, attempts=0, not_before=0):
+        """Queue a temp copy for deletion"""
+        with self.lock:
+            self.pending.append((acc_idx, doc_id, attempts, not_before))
+        self.wakeup.set()
+    
+    def _take_batch(self):
+        """Up to bulk_size due items, grouped by account"""
+        now = time.monotonic()
+        batch = {}
+        taken = 0
+        with self.lock:
+            for _ in range(len(self.pending)):
+                if taken >= self.bulk_size:
+                    break
+                item = self.pending.popleft()
+                if item[3] > now:
+                    self.pending.append(item)  # Not due yet
+                    continue
+                batch.setdefault(item[0], []).append(item)
+                taken += 1
+        return batch
+    
+    def _run(self):
+        while True:
+            self.wakeup.wait(timeout=2)
+            self.wakeup.clear()
+            batch = self._take_batch()
+            while batch:
+                for acc_idx, items in batch.items():
+                    self._delete_items(acc_idx, items)
+                batch = self._take_batch()
+    
+    def _delete_items(self, acc_idx, items):
+        """Delete (or, on the last attempt, trash) items in one batch request"""
+        with account_services(acc_idx) as (drive, _, _, _):
+            requests = []
+            for _, doc_id, attempts, _ in items:
+                if attempts + 1 >= self.max_attempts:
+                    # Try to trash instead
+                    api_request = drive.files().update(fileId=doc_id, body={'trashed': True}, supportsAllDrives=True)
+                else:
+                    api_request = drive.files().delete(fileId=doc_id, supportsAllDrives=True)
+                requests.append(((doc_id, attempts), api_request))
+            
+            try:
+                with metrics.timer('certgen_stage_seconds', stage='delete'):
+                    results = execute_batch(drive, acc_idx, 'drive', requests)
+            except Exception as e:
+                results = {key: (None, e) for key, _ in requests}
+        
+        for (doc_id, attempts), (_, error) in results.items():
+            if error is not None:
+                self._retry_or_give_up(acc_idx, doc_id, attempts, error)
+            elif attempts + 1 >= self.max_attempts:
+                with self.lock:
+                    self.trashed += 1
+            else:
+                with self.lock:
+                    self.deleted += 1
+    
+    def _retry_or_give_up(self, acc_idx, doc_id, attempts, error):
+        if getattr(getattr(error, 'resp', None), 'status', None) == 404:
+            return  # Already gone
+        if attempts + 1 >= self.max_attempts:
+            with self.lock:
+                self.failed += 1
+            add_log(f'⚠️ Could not delete temp doc: {str(error)[:80]}', 'warning')
+            return
+        self.discard(acc_idx, doc_id, attempts + 1, time.monotonic() + 2 ** attempts)
+    
+    def sweep(self):
+        """Queue tagged temp copies left behind by earlier runs of this instance"""
+        found = 0
+        cutoff = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(self.started - TEMP_SWEEP_GRACE))
+        query = (f"appProperties has {{ key='certgen' and value='temp' }} "
+                 f"and createdTime < '{cutoff}' and trashed=false")
+        for acc_idx in range(len(state['accounts'])):
+            try:
+                with account_services(acc_idx) as (drive, _, _, _):
+                    page_token = None
+                    while True:
+                        result = execute_api(drive.files().list(
+                            q=query,
+                            fields='nextPageToken, files(id, appProperties)',
+                            pageSize=1000,
+                            pageToken=page_token,
+                            corpora='allDrives',
+                            supportsAllDrives=True,
+                            includeItemsFromAllDrives=True
+                        ), acc_idx, 'drive')
+                        for f in result.get('files', []):
+                            # Untagged copies predate instance ids
+                            instance = f.get('appProperties', {}).get('certgen_instance', INSTANCE_ID)
+                            if instance != INSTANCE_ID:
+                                continue
+                            self.discard(acc_idx, f['id'])
+                            found += 1
+                        page_token = result.get('nextPageToken')
+                        if not page_token:
+                            break
+            except Exception as e:
+                add_log(f'⚠️ Temp sweep failed for account {acc_idx}: {str(e)[:80]}', 'warning')
+        
+        if found:
+            add_log(f'🧹 Found {found} orphaned temp copies, deleting in background', 'info')
+        return found
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'pending': len(self.pending),
+                'deleted': self.deleted,
+                'trashed': self.trashed,
+                'failed': self.failed,
+            }
+
+janitor = TempJanitor()
+
+def finish_certificate(job, services):
+    """5. Hand temp doc to the janitor and 6. queue the link for the sheet"""
+    ctx = job.ctx
+    config = ctx.config
+    
+    if job.doc_id:
+        janitor.discard(job.acc_idx, job.doc_id)
+    job.doc_id = None
+    
+    # Queue link for the sheet (written in batches by link_writer)
+    link_col = config['link_column'].upper()
+    
+    # row_idx is the actual row number in the sheet
+    link_writer.add(config['sheet_id'], f"{link_col}{job.row_idx}", job.link)
+    
+    # Track processed rows
+    output_cache.remember(job)
+    job_store.mark_done(config['sheet_id'], job.row_idx, job.file_id, job.link)
+    metrics.inc('certgen_certificates_total', account=job.acc_idx, result='success')
+    with ctx.lock:
+        ctx.state['completed'] += 1
+        completed = ctx.state['completed']
+    
+    ctx.log(f'✅ [{completed}/{ctx.state["total"]}] {job.file_name}', 'success')
+    broadcast_state()
+
+def fail_certificate(job, error):
+    """Count a failed certificate and remove its temp copy"""
+    ctx = job.ctx
+    with ctx.lock:
+        ctx.state['failed'] += 1
+    job_store.mark_failed(ctx.config['sheet_id'], job.row_idx, error)
+    metrics.inc('certgen_certificates_total', account=job.acc_idx, result='failure')
+    ctx.log(f'❌ {job.file_name}: {str(error)[:100]}', 'error')
+    
+    if job.doc_id:
+        janitor.discard(job.acc_idx, job.doc_id)
+        job.doc_id = None
+    
+    job.release_pdf()
+    broadcast_state()
+
+# Stages after the copy; the copy itself runs on the account workers
+PIPELINE_STAGES = [
+    ('replace', replace_variables),
+    ('export', export_pdf),
+    ('upload', upload_pdf),
+    ('finish', finish_certificate),
+]
+
+def wait_if_paused(ctx=None):
+    """Block while the job is paused; returns False if it was stopped"""
+    ctx = ctx or default_job
+    if ctx.stop_flag.is_set():
+        return False
+    
+    while ctx.pause_flag.is_set():
+        time.sleep(0.5)
+        if ctx.stop_flag.is_set():
+            return False
+    return True
+
+class CertificatePipeline:
+    """Runs PIPELINE_STAGES on their own worker threads, linked by bounded queues.
+
+    While row N is exporting, row N+1 can be filling in and row N+2 copying.
+    Full queues block the producer, which bounds memory (e.g. PDFs waiting
+    for upload). on_done(job) is called once per job, succeeded or not.
+    """
+    
+    def __init__(self, workers, queue_size, on_done, stop=stop_flag, pool=None):
+        self.on_done = on_done
+        self.stop = stop
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in PIPELINE_STAGES]
+        counts = [max(1, workers.get(name, 1)) for name, _ in PIPELINE_STAGES]
+        pool = pool or eventlet.GreenPool(sum(counts))
+        self.threads = [[pool.spawn(self._run_stage, idx) for _ in range(count)] for idx, count in enumerate(counts)]
+    
+    def submit(self, job):
+        """Hand a copied job to the first stage (blocks while the queue is full)"""
+        self.queues[0].put(job)
+    
+    def _run_stage(self, idx):
+        name, stage = PIPELINE_STAGES[idx]
+        while True:
+            job = self.queues[idx].get()
+            if job is None:
+                break
+            
+            try:
+                if self.stop.is_set():
+                    # Stopped - drop the job and clean up its temp copy
+                    if job.doc_id:
+                        janitor.discard(job.acc_idx, job.doc_id)
+                    job.release_pdf()
+                    self.on_done(job)
+                    continue
+                work_queue = job.ctx.work_queue
+                if work_queue is not None:
+                    row_progress.beat = lambda: work_queue.start([job.row_idx], job.worker)
+                    report_progress()
+                with account_services(job.acc_idx) as services:
+                    with metrics.timer('certgen_stage_seconds', stage=name):
+                        stage(job, services)
+            except Exception as e:
+                fail_certificate(job, e)
+                self.on_done(job)
+                continue
+            finally:
+                row_progress.beat = None
+            
+            if idx + 1 < len(self.queues):
+                self.queues[idx + 1].put(job)
+            else:
+                self.on_done(job)
+    
+    def depths(self):
+        return {name: self.queues[idx].qsize() for idx, (name, _) in enumerate(PIPELINE_STAGES)}
+    
+    def close(self):
+        """Drain all stages in order and stop their workers"""
+        for idx, stage_threads in enumerate(self.threads):
+            for _ in stage_threads:
+                self.queues[idx].put(None)
+            for t in stage_threads:
+                t.wait()
+
+# Restarts the stall clock of the rows the current green thread works on
+row_progress = threading.local()
+PROGRESS_INTERVAL = 5  # seconds between progress reports while waiting
+
+def report_progress():
+    """Tell the WorkQueue the calling thread's rows are still moving (API
+    backoff and quota waits call this, so only dead rows count as stalled)"""
+    beat = getattr(row_progress, 'beat', None)
+    if beat:
+        beat()
+
+class WorkQueue:
+    """Shared queue of (row_idx, row_data) items pulled by all account workers.
+
+    Fast accounts simply pull more items. The stall clock of an item starts
+    once its worker calls start() (unpaused and holding an account slot) and
+    restarts whenever the row reports progress; an item without progress for
+    stall_timeout is re-queued so another worker can pick it up.
+    """
+    
+    def __init__(self, items, stall_timeout=300, stop=stop_flag):
+        self.pending = deque(items)
+        self.stop = stop
+        self.in_flight = {}  # {row_idx: (worker, started or None while waiting, item)}
+        self.finished = set()
+        self.stall_timeout = stall_timeout
+        self.requeued = 0
+        self.lock = threading.Lock()
+    
+    def _requeue_stalled(self):
+        now = time.monotonic()
+        for row_idx, (worker, started, item) in list(self.in_flight.items()):
+            if started is not None and now - started > self.stall_timeout:
+                del self.in_flight[row_idx]
+                self.pending.appendleft(item)
+                self.requeued += 1
+                add_log(f'🔁 Row {row_idx} stalled on worker {worker}, re-queued', 'warning')
+    
+    def get(self, worker, max_items=1):
+        """Up to max_items items for worker, or [] once everything is finished"""
+        while not self.stop.is_set():
+            with self.lock:
+                self._requeue_stalled()
+                items = []
+                while self.pending and len(items) < max_items:
+                    item = self.pending.popleft()
+                    if item[0] in self.finished:
+                        continue  # Finished late by the worker that stalled
+                    self.in_flight[item[0]] = (worker, None, item)
+                    items.append(item)
+                if items:
+                    return items
+                if not self.in_flight:
+                    return []
+            # Queue is empty but items are in flight and may be re-queued
+            time.sleep(1)
+        return []
+    
+    def start(self, row_idxs, worker):
+        """(Re)start the stall clock of worker's items; they are being processed"""
+        now = time.monotonic()
+        with self.lock:
+            for row_idx in row_idxs:
+                owner = self.in_flight.get(row_idx)
+                if owner and owner[0] == worker:
+                    self.in_flight[row_idx] = (worker, now, owner[2])
+    
+    def task_done(self, row_idx, worker):
+        with self.lock:
+            self.finished.add(row_idx)
+            owner = self.in_flight.get(row_idx)
+            if owner and owner[0] == worker:
+                del self.in_flight[row_idx]
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'pending': len(self.pending),
+                'in_flight': len(self.in_flight),
+                'finished': len(self.finished),
+                'requeued': self.requeued,
+            }
+
+def reuse_outputs(jobs, services):
+    """Finish the jobs whose PDF is cached and still in Drive; returns them"""
+    hits = [job for job in jobs if output_cache.lookup(job)]
+    if not hits:
+        return []
+    
+    # Check each file with the account that uploaded it
+    by_account = {}
+    for idx, job in enumerate(hits):
+        by_account.setdefault(job.cache_account % len(state['accounts']), []).append((idx, job))
+    results = {}
+    for acc_idx, group in by_account.items():
+        try:
+            with account_services(acc_idx) as (drive, _, _, _):
+                results.update(execute_batch(drive, acc_idx, 'drive', [
+                    (idx, drive.files().get(fileId=job.file_id, fields='id, trashed', supportsAllDrives=True))
+                    for idx, job in group
+                ]))
+        except Exception as e:
+            results.update({idx: (None, e) for idx, _ in group})
+    
+    reused = []
+    for idx, job in enumerate(hits):
+        response, error = results.get(idx, (None, None))
+        if response and not response.get('trashed'):
+            finish_certificate(job, services)
+            reused.append(job)
+        elif response or getattr(getattr(error, 'resp', None), 'status', None) == 404:
+            output_cache.forget(job)  # Trashed or deleted
+        else:
+            output_cache.skip(job)  # Transient error - keep the entry
+    return reused
+
+def account_worker(ctx, rows, certificate_pipeline, worker, copy_batch_size=1):
+    """Worker of one job: pulls rows from the job's queue, leases an account
+    slot for them from account_scheduler, copies the template for the rows
+    in one batch and hands the copies to the pipeline"""
+    while True:
+        items = rows.get(worker, copy_batch_size)
+        if not items:
+            break
+        
+        lease = account_scheduler.acquire(ctx, len(items)) if wait_if_paused(ctx) else None
+        if lease is None:
+            # Stopped
+            for row_idx, _ in items:
+                rows.task_done(row_idx, worker)
+            continue
+        
+        # Waiting for the pause or the slot is not stalling
+        row_idxs = [row_idx for row_idx, _ in items]
+        rows.start(row_idxs, worker)
+        row_progress.beat = lambda: rows.start(row_idxs, worker)
+        jobs, failed = [], []
+        for row_idx, row_data in items:
+            try:
+                job = prepare_certificate(lease.acc_idx, row_idx, row_data, worker, ctx)
+            except Exception as e:
+                # Still fail the row so its slot and queue entry are released
+                job = CertificateJob(lease.acc_idx, row_idx, row_data, worker, ctx)
+                job.file_name = f'Row {row_idx}'
+                failed.append((job, e))
+                continue
+            job.lease = lease
+            jobs.append(job)
+        try:
+            with account_services(lease.acc_idx) as services:
+                # Rows whose PDF already exists skip generation
+                for job in reuse_outputs(jobs, services):
+                    jobs.remove(job)
+                    rows.task_done(job.row_idx, worker)
+                    lease.done()
+                # Rendered in the export stage - no copy needed
+                if jobs and not ctx.local_render:
+                    failed += copy_templates(jobs, services)
+        except Exception as e:
+            failed += [(job, e) for job in jobs]
+        
+        row_progress.beat = None
+        failed_jobs = set()
+        for job, error in failed:
+            try:
+                fail_certificate(job, error)
+            except Exception as e:
+                ctx.log(f'⚠️ Could not record failure of row {job.row_idx}: {str(e)[:100]}', 'warning')
+            rows.task_done(job.row_idx, worker)
+            lease.done()
+            failed_jobs.add(job)
+        
+        for job in jobs:
+            if job not in failed_jobs:
+                certificate_pipeline.submit(job)
+
+def get_scan_range(config):
+    """First and last sheet row to scan (last is None for open-ended)"""
+    # Determine range based on mode
+    if config['range_mode'] == 'custom':
+        return int(config.get('range_start', 2)), int(config.get('range_end', 1000))
+    # All rows mode - start from row 2 (after header)
+    return 2, None
+
+def read_sheet_rows(sheets, sheet_id, start_row, end_row=None):
+    """Read columns A:Z from start_row to end_row (or the last row)"""
+    sheet_range = f'A{start_row}:Z{end_row}' if end_row else f'A{start_row}:Z'
+    result = execute_api(sheets.spreadsheets().values().get(
+        spreadsheetId=sheet_id,
+        range=sheet_range
+    ), 0, 'sheets')
+    return result.get('values', [])
+
+def get_name_column_index(variables):
+    """Column holding the name used for duplicate detection"""
+    # Get name column from first variable
+    if variables and variables[0].get('column'):
+        return column_to_index(variables[0]['column'])
+    return column_to_index('C')  # Default to C
+
+class NameIndex:
+    """Normalized name → sheet rows holding it, kept across scans.
+
+    A row is re-cleaned only when its raw name changed, so rescanning the
+    sheet costs O(changed rows) and a watcher tail scan O(new rows). The
+    index resets itself when the sheet, name column or cleanup rules change.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self, key=None):
+        self.key = key
+        self.raw_by_row = {}  # {row: raw name}
+        self.name_by_row = {}  # {row: (cleaned, normalized)}
+        self.rows_by_name = {}  # {normalized: sorted [row, ...]}
+    
+    def _set(self, row, raw, names):
+        old = self.name_by_row.pop(row, None)
+        if old:
+            rows = self.rows_by_name[old[1]]
+            rows.remove(row)
+            if not rows:
+                del self.rows_by_name[old[1]]
+        self.raw_by_row.pop(row, None)
         
-        # Check for duplicate names and mark them
-        seen_names = {}
-        rows_to_mark = {}  # {row_number: first_occurrence_row}
+        if raw:
+            self.raw_by_row[row] = raw
+            self.name_by_row[row] = names
+            bisect.insort(self.rows_by_name.setdefault(names[1], []), row)
+    
+    def update(self, sheet_id, rows, start_row, name_col_idx, full=False):
+        """Index rows read from start_row; full=True drops rows outside them"""
+        key = (sheet_id, name_col_idx, get_cleanup_engine().fingerprint)
+        if key != self.key:
+            self.reset(key)
+        
+        end_row = start_row + len(rows) - 1
+        if full:
+            for row in [r for r in self.raw_by_row if r < start_row or r > end_row]:
+                self._set(row, '', None)
         
+        changed = []
         for i, row in enumerate(rows):
-            if len(row) > name_col_idx and row[name_col_idx] and row[name_col_idx].strip():
-                raw_name = row[name_col_idx].strip()
-                cleaned_name = clean_name(raw_name)
-                # Normalize for comparison to catch typos like "على" vs "علي"
-                normalized_name = normalize_name_for_comparison(cleaned_name)
-                actual_row = start_row + i
-                
-                if normalized_name in seen_names:
-                    # Found duplicate - mark it with first occurrence row
-                    first_row = seen_names[normalized_name]
-                    rows_to_mark[actual_row] = first_row
-                    add_log(f'⚠️ Duplicate: "{raw_name}" (cleaned: "{cleaned_name}") at row {actual_row} = row {first_row}', 'warning')
-                else:
-                    seen_names[normalized_name] = actual_row
+            raw = row[name_col_idx].strip() if len(row) > name_col_idx and row[name_col_idx] else ''
+            if self.raw_by_row.get(start_row + i, '') != raw:
+                changed.append((start_row + i, raw))
         
-        # Mark duplicate rows with "مكرر - صف X" in the link column
-        if rows_to_mark:
-            add_log(f'🔖 Marking {len(rows_to_mark)} duplicate rows...', 'info')
-            mark_duplicate_rows(config['sheet_id'], rows_to_mark, config['link_column'], sheets)
-            
-            # Re-read the sheet after marking duplicates
-            result = sheets.spreadsheets().values().get(
-                spreadsheetId=config['sheet_id'],
-                range=sheet_range
-            ).execute()
-            rows = result.get('values', [])
+        cleaned_names = clean_names([raw for _, raw in changed])
+        # Normalize for comparison to catch typos like "على" vs "علي"
+        normalized_names = normalize_names(cleaned_names)
+        for (row, raw), cleaned, normalized in zip(changed, cleaned_names, normalized_names):
+            self._set(row, raw, (cleaned, normalized))
+    
+    def first_row(self, row):
+        """First row holding the same name as row (row itself if unique)"""
+        names = self.name_by_row.get(row)
+        return self.rows_by_name[names[1]][0] if names else None
+    
+    def stats(self):
+        with self.lock:
+            return {'rows': len(self.raw_by_row), 'names': len(self.rows_by_name)}
+
+DUPLICATE_MARK = 'مكرر - صف {}'
+
+def collect_pending_rows(sheets, rows, start_row, full=True, ctx=None):
+    """Mark duplicates in rows (read from start_row) and return the rows that
+    still need certificates. Duplicates are checked against the job's name
+    index, which also remembers rows from earlier scans; full=True means rows
+    cover the whole scanned range.
+    """
+    ctx = ctx or default_job
+    config = ctx.config
+    name_index = ctx.name_index
+    
+    link_col_idx = column_to_index(config['link_column'])
+    link_col = config['link_column'].upper()
+    name_col_idx = get_name_column_index(ctx.variables)
+    
+    # Check for duplicate names and mark them
+    rows_to_mark = {}  # {row_number: first_occurrence_row}
+    
+    with name_index.lock:
+        name_index.update(config['sheet_id'], rows, start_row, name_col_idx, full)
         
-        todo = []
         for i, row in enumerate(rows):
-            has_link = len(row) > link_col_idx and row[link_col_idx] and row[link_col_idx].strip()
-            # Check if marked as duplicate (starts with "مكرر")
-            is_duplicate = has_link and row[link_col_idx].strip().startswith('مكرر')
-            has_name = len(row) > name_col_idx and row[name_col_idx] and row[name_col_idx].strip()
+            actual_row = start_row + i
+            first_row = name_index.first_row(actual_row)
+            if first_row is None or first_row == actual_row:
+                continue
             
-            # Only add to todo if has name and no link (or link is http - real link)
-            if has_name and not has_link:
-                # Store actual row number in sheet (1-based)
-                actual_row = start_row + i
-                todo.append((actual_row, row))
-            elif has_name and is_duplicate:
-                # Skip duplicates silently (already logged above)
-                pass
+            # Found duplicate - mark it with first occurrence row
+            is_marked = len(row) > link_col_idx and row[link_col_idx].strip().startswith('مكرر')
+            if not is_marked:
+                rows_to_mark[actual_row] = first_row
+                cleaned_name = name_index.name_by_row[actual_row][0]
+                ctx.log(f'⚠️ Duplicate: "{name_index.raw_by_row[actual_row]}" (cleaned: "{cleaned_name}") at row {actual_row} = row {first_row}', 'warning')
+    
+    # Mark duplicate rows with "مكرر - صف X" in the link column
+    if rows_to_mark:
+        ctx.log(f'🔖 Marking {len(rows_to_mark)} duplicate rows...', 'info')
+        mark_duplicate_rows(config['sheet_id'], rows_to_mark, config['link_column'], sheets)
         
-        return todo
+        # Apply the marks to the rows we already have instead of re-reading
+        for dup_row, first_row in rows_to_mark.items():
+            row = rows[dup_row - start_row]
+            if len(row) <= link_col_idx:
+                row.extend([''] * (link_col_idx + 1 - len(row)))
+            row[link_col_idx] = DUPLICATE_MARK.format(first_row)
+    
+    todo = []
+    for i, row in enumerate(rows):
+        has_link = len(row) > link_col_idx and row[link_col_idx] and row[link_col_idx].strip()
+        has_name = len(row) > name_col_idx and row[name_col_idx] and row[name_col_idx].strip()
+        
+        # Only add to todo if has name and no link (duplicates are marked in the link column)
+        if has_name and not has_link:
+            # Store actual row number in sheet (1-based)
+            actual_row = start_row + i
+            # Link already generated but still buffered in link_writer
+            if link_writer.is_pending(config['sheet_id'], f'{link_col}{actual_row}'):
+                continue
+            todo.append((actual_row, row))
+    
+    return todo
+
+def get_pending_rows(ctx=None):
+    """Get rows of the job's sheet that need certificates"""
+    ctx = ctx or default_job
+    config = ctx.config
+    
+    if not config['sheet_id']:
+        return []
+    
+    try:
+        with account_services(0) as (_, _, _, sheets):
+            start_row, end_row = get_scan_range(config)
+            rows = read_sheet_rows(sheets, config['sheet_id'], start_row, end_row)
+            return collect_pending_rows(sheets, rows, start_row, ctx=ctx)
     except Exception as e:
-        add_log(f'❌ Error reading sheet: {e}', 'error')
+        ctx.log(f'❌ Error reading sheet: {e}', 'error')
         return []
 
 def mark_duplicate_rows(sheet_id, row_mapping, link_column, sheets):
@@ -705,143 +2946,833 @@ def mark_duplicate_rows(sheet_id, row_mapping, link_column, sheets):
         for dup_row, first_row in row_mapping.items():
             data.append({
                 'range': f'{link_column}{dup_row}',
-                'values': [[f'مكرر - صف {first_row}']]
+                'values': [[DUPLICATE_MARK.format(first_row)]]
             })
         
         if data:
-            sheets.spreadsheets().values().batchUpdate(
+            execute_api(sheets.spreadsheets().values().batchUpdate(
                 spreadsheetId=sheet_id,
                 body={
                     'valueInputOption': 'RAW',
                     'data': data
                 }
-            ).execute()
+            ), 0, 'sheets')
             add_log(f'✅ Marked {len(row_mapping)} duplicate rows', 'success')
     except Exception as e:
         add_log(f'⚠️ Could not mark duplicate rows: {e}', 'warning')
 
-def retry_failed_certificates():
+def retry_failed_certificates(ctx=None):
     """Retry generation for certificates that don't have links"""
-    if state['retry_count'] >= state['max_retries']:
-        add_log(f'⚠️ Reached maximum retry attempts ({state["max_retries"]})', 'warning')
+    ctx = ctx or default_job
+    job_state = ctx.state
+    if job_state['retry_count'] >= job_state['max_retries']:
+        ctx.log(f'⚠️ Reached maximum retry attempts ({job_state["max_retries"]})', 'warning')
         return False
     
-    state['retry_count'] += 1
-    add_log(f'🔄 Starting retry attempt {state["retry_count"]}/{state["max_retries"]}...', 'info')
+    job_state['retry_count'] += 1
+    ctx.log(f'🔄 Starting retry attempt {job_state["retry_count"]}/{job_state["max_retries"]}...', 'info')
     
     # Get pending rows (those without links)
-    todo = get_pending_rows()
+    todo = get_pending_rows(ctx)
     
     if not todo:
-        add_log('✅ No pending certificates to retry', 'success')
+        ctx.log('✅ No pending certificates to retry', 'success')
         return False
     
-    add_log(f'📝 Found {len(todo)} certificates to retry', 'info')
+    ctx.log(f'📝 Found {len(todo)} certificates to retry', 'info')
+    
+    # Run generator with the pending items
+    run_generator(todo, is_retry=True, ctx=ctx)
+    
+    return True
+
+def run_in_process(ctx, todo):
+    """Generate the job's rows in this process: account workers copy, the
+    pipeline fills, exports and uploads"""
+    config = ctx.config
+    
+    ctx.local_render = use_local_render(ctx)
+    if ctx.local_render:
+        ctx.log('🖨️ Rendering certificates locally', 'info')
+    elif len(todo) >= int(config.get('bake_min_rows', 20)):
+        try:
+            ctx.baked_template.bake()
+        except Exception as e:
+            ctx.log(f'⚠️ Could not pre-fill template: {str(e)[:100]}', 'warning')
+    output_cache.begin(ctx)
+    
+    # The job's workers pull from its own queue; account_scheduler shares
+    # the account slots between all running jobs
+    num_accounts = len(state['accounts'])
+    concurrency = max(1, int(state['config'].get('account_concurrency', 2)))
+    account_scheduler.resize(num_accounts, concurrency)
+    ctx.work_queue = work_queue = WorkQueue(todo, int(config.get('stall_timeout', 300)), ctx.stop_flag)
+    num_workers = min(len(todo), num_accounts * concurrency)
+    copy_batch_size = max(1, int(config.get('copy_batch_size', 5)))
+    
+    # Later stages get their own workers; 0 means one per account worker
+    stage_workers = {
+        name: int(config.get('pipeline_workers', {}).get(name) or num_workers)
+        for name, _ in PIPELINE_STAGES
+    }
+    
+    # One sized green pool per run; over green_pool_size, account and stage
+    # workers are scaled down together
+    pool_size = max(len(PIPELINE_STAGES) + 1, int(state['config'].get('green_pool_size', 500)))
+    wanted = num_workers + sum(stage_workers.values())
+    if wanted > pool_size:
+        scale = pool_size / wanted
+        num_workers = max(1, int(num_workers * scale))
+        stage_workers = {name: max(1, int(count * scale)) for name, count in stage_workers.items()}
+    pool = eventlet.GreenPool(num_workers + sum(stage_workers.values()))
+    
+    def on_done(job):
+        work_queue.task_done(job.row_idx, job.worker)
+        job.lease.done()
+    
+    ctx.pipeline = pipeline = CertificatePipeline(
+        stage_workers,
+        int(config.get('pipeline_queue_size', 10)),
+        on_done,
+        ctx.stop_flag,
+        pool
+    )
+    
+    workers = [
+        pool.spawn(account_worker, ctx, work_queue, pipeline, f'{ctx.id}.{n}', copy_batch_size)
+        for n in range(num_workers)
+    ]
+    
+    ctx.log(f'👥 {len(workers)} workers ({num_accounts} accounts × {concurrency} slots, weight {ctx.weight}) sharing {len(todo)} items', 'info')
+    
+    for worker in workers:
+        worker.wait()
+    pipeline.close()
+    ctx.baked_template.release()
+    if ctx.local_render:
+        local_renderer.release(ctx)
+
+def run_generator(todo=None, is_retry=False, ctx=None):
+    """Main generator function (runs the dashboard's job unless ctx is given)"""
+    ctx = ctx or default_job
+    job_state = ctx.state
+    
+    ctx.stop_flag.clear()
+    ctx.pause_flag.clear()
+    
+    job_state['status'] = 'running'
+    job_state['start_time'] = time.time()
+    link_writer.start()
+    janitor.start()
+    
+    broadcast_state()
+    ctx.log('🚀 Starting certificate generation...', 'info')
+    
+    if not state['accounts_loaded']:
+        if not load_service_accounts():
+            job_state['status'] = 'idle'
+            ctx.log('❌ Cannot start: No service accounts!', 'error')
+            broadcast_state()
+            return
+    
+    config = ctx.config
+    
+    # Only require template, target folder, and sheet (temp folder uses shared root)
+    if not all([config['template_doc_id'], config['target_folder_id'], config['sheet_id']]):
+        job_state['status'] = 'idle'
+        ctx.log('❌ Missing configuration! Please fill all required fields.', 'error')
+        broadcast_state()
+        return
+    
+    # Leased rows carry the job's config and data - never serve them unauthenticated
+    if config.get('execution') == 'workers' and not WORKER_TOKEN:
+        job_state['status'] = 'idle'
+        ctx.log('❌ Worker execution needs the CERTGEN_WORKER_TOKEN environment variable', 'error')
+        broadcast_state()
+        return
+    
+    job_id = None
+    try:
+        if todo is None:
+            ctx.log('📖 Reading spreadsheet...', 'info')
+            todo = get_pending_rows(ctx)
+        
+        job_state['total'] = len(todo)
+        job_state['completed'] = 0
+        job_state['failed'] = 0
+        
+        ctx.log(f'📝 {len(todo)} certificates to generate', 'info')
+        broadcast_state()
+        
+        if not todo:
+            job_state['status'] = 'watching' if config['auto_watch'] else 'idle'
+            ctx.log('✅ No pending certificates.', 'success')
+            broadcast_state()
+            return
+        
+        job_id = job_store.start_job(config, ctx.variables, todo, get_name_column_index(ctx.variables), ctx.id, ctx.weight)
+        job_state['job_id'] = job_id
+        
+        if config.get('execution') == 'workers':
+            worker_dispatcher.run(ctx, job_id)
+        else:
+            run_in_process(ctx, todo)
+        
+        # Write any links still buffered before retrying/reporting
+        link_writer.flush()
+        job_store.finish_job(job_id, 'stopped' if ctx.stop_flag.is_set() else 'completed')
+        
+        elapsed = time.time() - job_state['start_time']
+        rate = job_state['completed'] / (elapsed / 60) if elapsed > 0 else 0
+        
+        ctx.log(f'🎉 Batch completed! {job_state["completed"]} certificates in {elapsed/60:.1f} minutes ({rate:.0f}/min)', 'success')
+        
+        # Check if there are failed certificates and retry
+        if job_state['failed'] > 0 and not is_retry and not ctx.stop_flag.is_set():
+            ctx.log(f'⚠️ {job_state["failed"]} certificates failed. Preparing to retry...', 'warning')
+            time.sleep(2)  # Wait 2 seconds before retry
+            
+            # Reset retry counter for new batch
+            job_state['retry_count'] = 0
+            
+            # Try to retry failed certificates
+            retry_success = retry_failed_certificates(ctx)
+            
+            # If retry was performed, the status will be set by the retry run
+            if not retry_success:
+                job_state['status'] = 'watching' if config['auto_watch'] else 'completed'
+        else:
+            job_state['status'] = 'watching' if config['auto_watch'] else 'completed'
+            if is_retry:
+                ctx.log(f'✅ Retry completed. Total completed: {job_state["completed"]}, Failed: {job_state["failed"]}', 'success')
+        
+        broadcast_state()
+        
+    except Exception as e:
+        job_state['status'] = 'idle'
+        ctx.baked_template.release()
+        local_renderer.release(ctx)
+        if job_id:
+            job_store.finish_job(job_id, 'failed')
+        ctx.log(f'💥 Error: {str(e)}', 'error')
+        broadcast_state()
+
+# ============ JOBS ============
+
+class JobContext:
+    """Everything one certificate job runs with: its configuration, variables,
+    counters, stop/pause flags, logs and per-run helpers.
+
+    The dashboard's job (default_job) wraps the global state; job_manager
+    runs more jobs beside it, all sharing the accounts via account_scheduler.
+    """
+    
+    def __init__(self, job_key, job_state, weight=1, lock=None, stop=None, pause=None):
+        self.id = job_key
+        self.state = job_state
+        self.weight = weight
+        self.lock = lock or threading.Lock()
+        self.stop_flag = stop or threading.Event()
+        self.pause_flag = pause or threading.Event()
+        self.baked_template = BakedTemplate(self)
+        self.name_index = NameIndex()
+        self.local_render = False
+        self.render_key = None  # local_renderer template of this run
+        self.output_key = None  # output_cache template revision of this run
+        self.cleanup_engine = None  # Own cleanup rules (workers); None uses the saved config
+        self.work_queue = None
+        self.pipeline = None
+        self.thread = None
+        self.logs = deque(maxlen=200)
+    
+    @property
+    def config(self):
+        return self.state['config']
+    
+    @property
+    def variables(self):
+        return self.state['variables']
+    
+    def log(self, message, level='info'):
+        add_log(message, level, self)
+    
+    def summary(self):
+        with self.lock:
+            return {
+                'id': self.id,
+                'weight': self.weight,
+                'status': self.state['status'],
+                'total': self.state['total'],
+                'completed': self.state['completed'],
+                'failed': self.state['failed'],
+                'current_name': self.state['current_name'],
+                'job_id': self.state['job_id'],
+                'template_doc_id': self.config['template_doc_id'],
+                'sheet_id': self.config['sheet_id'],
+                'target_folder_id': self.config['target_folder_id'],
+                'slots': account_scheduler.stats()['held'].get(self.id, 0),
+            }
+
+default_job = JobContext('default', state, lock=state_lock, stop=stop_flag, pause=pause_flag)
+
+def new_job_state(config, variables):
+    """Counters and settings of a job other than the dashboard's"""
+    return {
+        'status': 'idle',
+        'total': 0,
+        'completed': 0,
+        'failed': 0,
+        'current_name': '',
+        'start_time': None,
+        'retry_count': 0,
+        'max_retries': state['max_retries'],
+        'job_id': None,
+        'config': config,
+        'variables': variables,
+    }
+
+class AccountLease:
+    """An account slot held until every row admitted with it has left the pipeline"""
+    
+    def __init__(self, scheduler, acc_idx, ctx, rows):
+        self.scheduler = scheduler
+        self.acc_idx = acc_idx
+        self.ctx = ctx
+        self.remaining = rows
+        self.lock = threading.Lock()
+    
+    def done(self):
+        """One row finished (or failed); frees the slot after the last one"""
+        with self.lock:
+            self.remaining -= 1
+            last = self.remaining == 0
+        if last:
+            self.scheduler.release(self.acc_idx, self.ctx)
+
+class AccountScheduler:
+    """Shares the account slots (account_concurrency per account) between
+    running jobs by stride scheduling.
+
+    A slot admits one copy batch and stays taken until those rows are done.
+    Every grant advances the job's pass by 1/weight and a free slot always
+    goes to the waiting job with the lowest pass, so busy jobs get slots in
+    proportion to their weights. A job that starts waiting joins at the
+    current pass, so idle time is not saved up as credit.
+    """
+    
+    def __init__(self, num_accounts=0, concurrency=1):
+        self.cond = threading.Condition()
+        self.free = {}  # {acc_idx: free slots}
+        self.passes = {}  # {job: pass}
+        self.waiting = {}  # {job: waiting workers}
+        self.held = {}  # {job: slots held}
+        self.virtual_time = 0.0
+        self.grants = 0
+        self.resize(num_accounts, concurrency)
+    
+    def resize(self, num_accounts, concurrency):
+        """Match the loaded accounts; slots in use stay counted"""
+        with self.cond:
+            in_use = {acc_idx: self.capacity - free for acc_idx, free in self.free.items()} if self.free else {}
+            self.capacity = max(1, concurrency)
+            self.free = {acc_idx: self.capacity - in_use.get(acc_idx, 0) for acc_idx in range(num_accounts)}
+            self.cond.notify_all()
+    
+    def _next_account(self):
+        """Account with the most free slots, or None"""
+        acc_idx = max(self.free, key=self.free.get, default=None)
+        return acc_idx if acc_idx is not None and self.free[acc_idx] > 0 else None
+    
+    def _is_next(self, ctx):
+        return min(self.waiting, key=lambda job: (self.passes[job], job.id)) is ctx
+    
+    def acquire(self, ctx, rows=1):
+        """Block until ctx gets an account slot for rows; returns its
+        AccountLease, or None if the job is stopped"""
+        with self.cond:
+            if not self.waiting.get(ctx):
+                self.passes[ctx] = max(self.passes.get(ctx, 0.0), self.virtual_time)
+            self.waiting[ctx] = self.waiting.get(ctx, 0) + 1
+            try:
+                while True:
+                    if ctx.stop_flag.is_set():
+                        return None
+                    acc_idx = self._next_account()
+                    if acc_idx is not None and self._is_next(ctx):
+                        break
+                    self.cond.wait(0.5)
+                
+                self.free[acc_idx] -= 1
+                self.held[ctx.id] = self.held.get(ctx.id, 0) + 1
+                self.virtual_time = self.passes[ctx]
+                self.passes[ctx] += 1.0 / max(ctx.weight, 0.01)
+                self.grants += 1
+                return AccountLease(self, acc_idx, ctx, rows)
+            finally:
+                self.waiting[ctx] -= 1
+                if not self.waiting[ctx]:
+                    del self.waiting[ctx]
+                self.cond.notify_all()
+    
+    def release(self, acc_idx, ctx):
+        with self.cond:
+            if acc_idx in self.free:
+                self.free[acc_idx] = min(self.capacity, self.free[acc_idx] + 1)
+            self.held[ctx.id] -= 1
+            if not self.held[ctx.id]:
+                del self.held[ctx.id]
+            self.cond.notify_all()
+    
+    def forget(self, ctx):
+        """Drop a finished job's pass"""
+        with self.cond:
+            if not self.waiting.get(ctx):
+                self.passes.pop(ctx, None)
+    
+    def stats(self):
+        with self.cond:
+            return {
+                'capacity': self.capacity * len(self.free),
+                'free': sum(self.free.values()),
+                'held': dict(self.held),
+                'waiting': {ctx.id: n for ctx, n in self.waiting.items()},
+                'grants': self.grants,
+            }
+
+account_scheduler = AccountScheduler()
+
+# Per-job settings accepted by /api/active-jobs; tuning and cleanup stay global
+JOB_CONFIG_KEYS = (
+    'template_doc_id', 'template_doc_name', 'template_type',
+    'target_folder_id', 'target_folder_name', 'temp_folder_id',
+    'sheet_id', 'sheet_name', 'link_column', 'name_column',
+    'range_mode', 'range_start', 'range_end',
+    'render_mode', 'render_font', 'render_fields', 'reuse_outputs', 'execution',
+)
+
+class JobManager:
+    """Jobs running beside the dashboard's job, each with its own template,
+    sheet, target folder, variables, counters and logs"""
+    
+    def __init__(self, keep_finished=20):
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()  # {job key: JobContext}
+        self.keep_finished = keep_finished
+        self.counter = 0
+    
+    def create(self, config, variables, weight=1, todo=None):
+        """Start a job; config overrides the dashboard's configuration and
+        todo, if given, replaces reading the sheet"""
+        job_config = copy.deepcopy(state['config'])
+        job_config.update(config)
+        job_config['auto_watch'] = False  # Only the dashboard's job is watched
+        
+        with self.lock:
+            self.counter += 1
+            ctx = JobContext(f'job-{self.counter}', new_job_state(job_config, variables), weight)
+            self.jobs[ctx.id] = ctx
+            self._trim()
+        
+        ctx.thread = threading.Thread(target=self._run, args=(ctx, todo), daemon=True)
+        ctx.thread.start()
+        return ctx
+    
+    def _run(self, ctx, todo=None):
+        try:
+            run_generator(todo, ctx=ctx)
+        finally:
+            account_scheduler.forget(ctx)
+            broadcast_state()
+    
+    def _trim(self):
+        """Forget the oldest finished jobs beyond keep_finished"""
+        finished = [ctx for ctx in self.jobs.values() if ctx.thread and not ctx.thread.is_alive()]
+        for ctx in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self.jobs[ctx.id]
+    
+    def get(self, job_key):
+        if job_key == default_job.id:
+            return default_job
+        with self.lock:
+            return self.jobs.get(job_key)
+    
+    def all(self):
+        with self.lock:
+            return [default_job] + list(self.jobs.values())
+    
+    def active(self):
+        return [ctx for ctx in self.all() if ctx.state['status'] in ('running', 'paused')]
+
+job_manager = JobManager()
+
+# ============ WORKERS ============
+
+# Shared secret workers send in X-Worker-Token; worker execution is refused without it
+WORKER_TOKEN = os.environ.get('CERTGEN_WORKER_TOKEN', '')
+
+class WorkerDispatcher:
+    """Controller side of worker execution.
+
+    Jobs run with execution='workers' leave their rows pending in job_store;
+    worker processes (python app.py worker <controller url>) lease them
+    through /api/worker/sync, generate the PDFs with their own service
+    accounts and report back in the next sync. The controller then does the
+    bookkeeping (sheet link, job store, counters, logs) as for local rows.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}  # {job_id: JobContext}
+        self.workers = {}  # {worker: {'last_seen', 'accounts', 'leased', 'done', 'failed'}}
+        self.requeued = 0
+    
+    def run(self, ctx, job_id):
+        """Serve the job's rows to workers until all are done or it is stopped"""
+        with self.lock:
+            self.jobs[job_id] = ctx
+        ctx.log(f'📡 Rows queued for workers ({len(self.alive())} connected)', 'info')
+        warned = False
+        try:
+            while not ctx.stop_flag.is_set():
+                counts = job_store.queue_counts(job_id)
+                if not counts.get('pending') and not counts.get('leased'):
+                    break
+                if not self.alive() and not warned:
+                    ctx.log('⚠️ No workers connected - start one with: python app.py worker <controller url>', 'warning')
+                warned = not self.alive()
+                ctx.stop_flag.wait(1)
+        finally:
+            with self.lock:
+                self.jobs.pop(job_id, None)
+    
+    def alive(self, timeout=30):
+        now = time.time()
+        with self.lock:
+            return [worker for worker, info in self.workers.items() if now - info['last_seen'] < timeout]
+    
+    def sync(self, worker, accounts, max_rows, results, renew):
+        """Take a worker's results, extend its leases and hand it new rows"""
+        with self.lock:
+            info = self.workers.setdefault(worker, {'accounts': 0, 'leased': 0, 'done': 0, 'failed': 0})
+            info['last_seen'] = time.time()
+            info['accounts'] = accounts
+        
+        for result in results:
+            self._report(worker, result)
+        
+        lease_seconds = int(state['config'].get('worker_lease_seconds', 120))
+        if renew:
+            job_store.renew_leases(worker, [(r['job_id'], r['row']) for r in renew], lease_seconds)
+        
+        tasks, jobs = self._lease(worker, max_rows, lease_seconds)
+        with self.lock:
+            info['leased'] += len(tasks)
+        return {'tasks': tasks, 'jobs': jobs, 'lease_seconds': lease_seconds}
+    
+    def _lease(self, worker, max_rows, lease_seconds):
+        """Up to max_rows rows, split between running jobs by weight"""
+        with self.lock:
+            active = [(job_id, ctx) for job_id, ctx in self.jobs.items()
+                      if not ctx.pause_flag.is_set() and not ctx.stop_flag.is_set()]
+        total_weight = sum(ctx.weight for _, ctx in active)
+        
+        tasks, jobs = [], {}
+        for job_id, ctx in sorted(active, key=lambda item: -item[1].weight):
+            wanted = max_rows - len(tasks)
+            if wanted <= 0:
+                break
+            share = max(1, round(max_rows * ctx.weight / total_weight))
+            rows, requeued = job_store.lease_rows(job_id, worker, min(share, wanted), lease_seconds)
+            if requeued:
+                self.requeued += requeued
+                ctx.log(f'🔁 {requeued} rows of a silent worker re-queued', 'warning')
+            if not rows:
+                continue
+            jobs[job_id] = {'config': ctx.config, 'variables': ctx.variables}
+            tasks += [dict(row, job_id=job_id) for row in rows]
+            ctx.state['current_name'] = f'{len(rows)} rows → {worker}'
+        
+        # Left-over room goes to whichever job still has rows
+        for job_id, ctx in active:
+            wanted = max_rows - len(tasks)
+            if wanted <= 0:
+                break
+            rows, _ = job_store.lease_rows(job_id, worker, wanted, lease_seconds)
+            if rows:
+                jobs[job_id] = {'config': ctx.config, 'variables': ctx.variables}
+                tasks += [dict(row, job_id=job_id) for row in rows]
+        return tasks, jobs
+    
+    def _report(self, worker, result):
+        """Finish or fail one row reported by a worker that still leases it"""
+        sheet_id, row = result['sheet_id'], result['row']
+        current = job_store.row_status(sheet_id, row)
+        if not current or current['status'] != 'leased' or current['lease_owner'] != worker:
+            # The lease ran out and the row went to another worker (or is done)
+            if result.get('file_id'):
+                janitor.discard(0, result['file_id'])
+            add_log(f'🔁 Dropped late result for row {row} from {worker}', 'warning')
+            return
+        
+        with self.lock:
+            ctx = self.jobs.get(result['job_id'])
+            info = self.workers[worker]
+            info['failed' if result.get('error') else 'done'] += 1
+        
+        if ctx is None:
+            # Job stopped meanwhile - keep the result for the next scan
+            if not result.get('error'):
+                job_store.mark_done(sheet_id, row, result['file_id'], result['link'])
+            return
+        
+        job = CertificateJob(f'{worker}/{result.get("account", 0)}', row, result.get('row_data', []), worker, ctx)
+        job.file_name = result.get('name', '')
+        if result.get('error'):
+            fail_certificate(job, Exception(result['error']))
+        else:
+            job.file_id, job.link = result['file_id'], result['link']
+            finish_certificate(job, None)
+    
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            return {
+                'jobs': list(self.jobs),
+                'requeued': self.requeued,
+                'workers': {
+                    worker: dict(info, last_seen=round(now - info['last_seen'], 1))
+                    for worker, info in self.workers.items()
+                },
+            }
+
+worker_dispatcher = WorkerDispatcher()
+
+class ControllerClient:
+    """Worker side of /api/worker/sync"""
+    
+    def __init__(self, url, token=''):
+        self.url = url.rstrip('/')
+        self.token = token
+    
+    def sync(self, payload, timeout=60):
+        req = urllib.request.Request(
+            f'{self.url}/api/worker/sync',
+            data=json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+            headers={'Content-Type': 'application/json', 'X-Worker-Token': self.token},
+        )
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read().decode('utf-8'))
+
+# Stages a worker runs; 'finish' (link, job store, counters) stays on the controller
+WORKER_STAGES = [(name, stage) for name, stage in PIPELINE_STAGES if name != 'finish']
+
+def generate_remote_row(ctx, acc_idx, task, worker):
+    """Generate one leased row; returns the result to report"""
+    job = build_certificate_job(acc_idx, task['row'], task['row_data'], worker, ctx)
+    result = {
+        'job_id': task['job_id'],
+        'sheet_id': task['sheet_id'],
+        'row': task['row'],
+        'name': job.file_name,
+        'account': job.acc_idx,
+    }
+    try:
+        with account_services(job.acc_idx) as services:
+            if not ctx.local_render:
+                copy_template(job, services)
+            for name, stage in WORKER_STAGES:
+                with metrics.timer('certgen_stage_seconds', stage=name):
+                    stage(job, services)
+        result.update(file_id=job.file_id, link=job.link)
+    except Exception as e:
+        result['error'] = str(e)[:500]
+        job.release_pdf()
+    finally:
+        if job.doc_id:
+            janitor.discard(job.acc_idx, job.doc_id)
+    return result
+
+def run_worker(controller_url, slots=None, idle_wait=2):
+    """Worker process: lease rows from the controller, generate them with
+    this host's service accounts and report the results"""
+    if not WORKER_TOKEN:
+        print('❌ Set CERTGEN_WORKER_TOKEN to the controller\'s worker token')
+        return
+    if not load_service_accounts():
+        print('❌ No service accounts - a worker needs its own service account files')
+        return
+    janitor.start()
+    
+    worker = f'{socket.gethostname()}-{os.getpid()}'
+    client = ControllerClient(controller_url, WORKER_TOKEN)
+    num_accounts = len(state['accounts'])
+    slots = slots or num_accounts * max(1, int(state['config']['account_concurrency']))
+    print(f'\n  👷 Worker {worker}: {num_accounts} accounts, {slots} slots → {controller_url}\n')
+    
+    contexts = {}  # {job_id: JobContext}
+    tasks = queue.Queue()
+    results = queue.Queue()
+    in_flight = {}  # {(job_id, row): task}
+    
+    def run_slot(n):
+        acc_idx = n % num_accounts
+        while True:
+            task = tasks.get()
+            ctx = contexts[task['job_id']]
+            results.put(generate_remote_row(ctx, acc_idx, task, worker))
     
-    # Run generator with the pending items
-    run_generator(todo, is_retry=True)
+    pool = eventlet.GreenPool(slots)
+    for n in range(slots):
+        pool.spawn_n(run_slot, n)
     
-    return True
+    unreported = []
+    while True:
+        # Wait for a result, or poll again after idle_wait with nothing in flight
+        try:
+            unreported.append(results.get(timeout=idle_wait if not in_flight else 5))
+        except queue.Empty:
+            pass
+        while not results.empty():
+            unreported.append(results.get())
+        for result in unreported:
+            in_flight.pop((result['job_id'], result['row']), None)
+        
+        try:
+            reply = client.sync({
+                'worker': worker,
+                'accounts': num_accounts,
+                'max_rows': slots - len(in_flight),
+                'results': unreported,
+                'renew': [{'job_id': job_id, 'row': row} for job_id, row in in_flight],
+            })
+        except Exception as e:
+            add_log(f'⚠️ Controller unreachable: {str(e)[:100]}', 'warning')
+            time.sleep(5)
+            continue
+        unreported = []
+        
+        for job_id, spec in reply['jobs'].items():
+            job_id = int(job_id)
+            ctx = contexts.get(job_id)
+            if ctx is None or ctx.config != spec['config'] or ctx.variables != spec['variables']:
+                if ctx is not None:
+                    local_renderer.release(ctx)
+                ctx = JobContext(f'job-{job_id}', new_job_state(spec['config'], spec['variables']))
+                ctx.local_render = use_local_render(ctx)
+                # Clean names with the controller's rules, not this process's defaults
+                ctx.cleanup_engine = CleanupEngine(spec['config'].get('cleanup', {}))
+                contexts[job_id] = ctx
+        for task in reply['tasks']:
+            in_flight[(task['job_id'], task['row'])] = task
+            tasks.put(task)
 
-def run_generator(todo=None, is_retry=False):
-    """Main generator function"""
-    global state
-    
-    stop_flag.clear()
-    pause_flag.clear()
+# ============ AUTO WATCHER ============
+
+def row_fingerprint(row, link_col_idx):
+    """Short content hash of one sheet row, ignoring the link column
+    (which this tool writes to itself)"""
+    cells = row[:link_col_idx] + row[link_col_idx + 1:]
+    while cells and not cells[-1]:
+        cells = cells[:-1]
+    return hashlib.sha1(json.dumps(cells, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+class SheetTail:
+    """Incremental view of the watched sheet.
+
+    Keeps a high-water mark (last row seen) and a fingerprint per row, so a
+    watcher tick only reads rows from the last seen row on and dedups them
+    against name_index. The last seen row is re-read as an anchor: if its
+    content changed (rows inserted, deleted or sorted) or every
+    full_scan_every ticks, the whole range is reconciled instead.
+    """
     
-    state['status'] = 'running'
-    state['start_time'] = time.time()
+    def __init__(self, full_scan_every=10):
+        self.full_scan_every = full_scan_every
+        self.reset()
     
-    broadcast_state()
-    add_log('🚀 Starting certificate generation...', 'info')
+    def reset(self):
+        self.key = None
+        self.last_row = 0
+        self.fingerprints = {}  # {row_number: fingerprint}
+        self.ticks = 0
     
-    if not state['accounts_loaded']:
-        if not load_service_accounts():
-            state['status'] = 'idle'
-            add_log('❌ Cannot start: No service accounts!', 'error')
-            broadcast_state()
-            return
+    def _config_key(self, config):
+        return (config['sheet_id'], config['range_mode'], config.get('range_start'),
+                config.get('range_end'), config['link_column'], get_name_column_index(state['variables']))
     
-    config = state['config']
+    def _fingerprints(self, rows):
+        link_col_idx = column_to_index(state['config']['link_column'])
+        return offload(lambda: [row_fingerprint(row, link_col_idx) for row in rows], size=len(rows))
     
-    # Only require template, target folder, and sheet (temp folder uses shared root)
-    if not all([config['template_doc_id'], config['target_folder_id'], config['sheet_id']]):
-        state['status'] = 'idle'
-        add_log('❌ Missing configuration! Please fill all required fields.', 'error')
-        broadcast_state()
-        return
+    def _remember(self, rows, start_row, fingerprints=None):
+        if fingerprints is None:
+            fingerprints = self._fingerprints(rows)
+        for i, fingerprint in enumerate(fingerprints):
+            self.fingerprints[start_row + i] = fingerprint
+        if rows:
+            self.last_row = max(self.last_row, start_row + len(rows) - 1)
     
-    try:
-        if todo is None:
-            add_log('📖 Reading spreadsheet...', 'info')
-            todo = get_pending_rows()
-        
-        state['total'] = len(todo)
-        state['completed'] = 0
-        state['failed'] = 0
-        
-        add_log(f'📝 {len(todo)} certificates to generate', 'info')
-        broadcast_state()
-        
-        if not todo:
-            state['status'] = 'watching' if config['auto_watch'] else 'idle'
-            add_log('✅ No pending certificates.', 'success')
-            broadcast_state()
-            return
-        
-        # Distribute among accounts
-        num_accounts = len(state['accounts'])
-        batches = [[] for _ in range(num_accounts)]
-        
-        for idx, item in enumerate(todo):
-            batches[idx % num_accounts].append(item)
-        
-        rate_limiters = [RateLimiter(50) for _ in range(num_accounts)]
-        
-        threads = []
-        for acc_idx, batch in enumerate(batches):
-            if batch:
-                add_log(f'👤 Account {acc_idx}: {len(batch)} items', 'info')
-                t = threading.Thread(target=account_worker, args=(acc_idx, batch, rate_limiters[acc_idx]))
-                t.start()
-                threads.append(t)
-        
-        for t in threads:
-            t.join()
-        
-        elapsed = time.time() - state['start_time']
-        rate = state['completed'] / (elapsed / 60) if elapsed > 0 else 0
+    def reconcile(self, sheets):
+        """Full scan of the configured range"""
+        config = state['config']
+        start_row, end_row = get_scan_range(config)
+        rows = read_sheet_rows(sheets, config['sheet_id'], start_row, end_row)
         
-        add_log(f'🎉 Batch completed! {state["completed"]} certificates in {elapsed/60:.1f} minutes ({rate:.0f}/min)', 'success')
+        fingerprints = self._fingerprints(rows)
+        changed = 0
+        for i, fingerprint in enumerate(fingerprints):
+            previous = self.fingerprints.get(start_row + i)
+            if previous is not None and previous != fingerprint:
+                changed += 1
+        if changed:
+            add_log(f'🔄 Reconciled sheet: {changed} rows changed since last scan', 'info')
         
-        # Check if there are failed certificates and retry
-        if state['failed'] > 0 and not is_retry:
-            add_log(f'⚠️ {state["failed"]} certificates failed. Preparing to retry...', 'warning')
-            time.sleep(2)  # Wait 2 seconds before retry
-            
-            # Reset retry counter for new batch
-            state['retry_count'] = 0
-            
-            # Try to retry failed certificates
-            retry_success = retry_failed_certificates()
-            
-            # If retry was performed, the status will be set by the retry run
-            if not retry_success:
-                state['status'] = 'watching' if config['auto_watch'] else 'completed'
-        else:
-            state['status'] = 'watching' if config['auto_watch'] else 'completed'
-            if is_retry:
-                add_log(f'✅ Retry completed. Total completed: {state["completed"]}, Failed: {state["failed"]}', 'success')
+        self.key = self._config_key(config)
+        self.last_row = start_row - 1
+        self.fingerprints = {}
+        self.ticks = 0
         
-        broadcast_state()
+        todo = collect_pending_rows(sheets, rows, start_row)
+        self._remember(rows, start_row, fingerprints)
+        return todo
+    
+    def poll(self):
+        """Rows needing certificates since the last poll"""
+        config = state['config']
+        if not config['sheet_id']:
+            return []
         
-    except Exception as e:
-        state['status'] = 'idle'
-        add_log(f'💥 Error: {str(e)}', 'error')
-        broadcast_state()
+        try:
+            with account_services(0) as (_, _, _, sheets):
+                self.ticks += 1
+                if (self.key != self._config_key(config) or not self.last_row
+                        or self.ticks >= self.full_scan_every):
+                    return self.reconcile(sheets)
+                
+                start_row, end_row = get_scan_range(config)
+                anchor = max(self.last_row, start_row)
+                if end_row and anchor > end_row:
+                    return []
+                
+                rows = read_sheet_rows(sheets, config['sheet_id'], anchor, end_row)
+                link_col_idx = column_to_index(config['link_column'])
+                if not rows or self.fingerprints.get(anchor) != row_fingerprint(rows[0], link_col_idx):
+                    # Rows moved under us - fall back to a full scan
+                    return self.reconcile(sheets)
+                
+                if len(rows) == 1:
+                    return []  # Nothing appended
+                
+                # Anchor row was handled before; only look at appended rows
+                new_rows = rows[1:]
+                todo = collect_pending_rows(sheets, new_rows, anchor + 1, full=False)
+                self._remember(new_rows, anchor + 1)
+                return todo
+        except Exception as e:
+            add_log(f'❌ Error reading sheet: {e}', 'error')
+            return []
 
-# ============ AUTO WATCHER ============
+sheet_tail = SheetTail()
 
 def watcher_loop():
     """Watch for new entries and auto-generate"""
@@ -849,8 +3780,10 @@ def watcher_loop():
     
     while not watch_stop_flag.is_set():
         if state['status'] not in ['running', 'paused']:
-            # Check for new entries
-            todo = get_pending_rows()
+            # Check for new entries (incremental; full scan every few ticks)
+            sheet_tail.full_scan_every = int(state['config'].get('watch_full_scan_every', 10))
+            with metrics.timer('certgen_watcher_scan_seconds'):
+                todo = sheet_tail.poll()
             
             if todo:
                 add_log(f'🆕 Found {len(todo)} new entries!', 'info')
@@ -890,43 +3823,115 @@ def stop_watcher():
 # Shared Drive folder ID (the root folder shared with all service accounts)
 SHARED_ROOT_FOLDER = '0AHlyd4Og76tkUk9PVA'
 
-def list_drive_files(folder_id='root', file_type='all'):
-    """List files in a Google Drive folder"""
-    drive, _, _, _ = get_services(0)
-    if not drive:
-        return []
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+def drive_list_query(folder_id, file_type):
+    """files.list query for the children of a folder shown in the browser"""
+    parent_query = f"'{folder_id}' in parents"
     
-    try:
+    # Determine what to show based on type
+    if file_type == 'folder':
+        # Show only folders
+        mime_query = "mimeType='application/vnd.google-apps.folder'"
+    elif file_type == 'doc':
+        # Show folders, Google Docs, and Google Slides
+        mime_query = "(mimeType='application/vnd.google-apps.folder' or mimeType='application/vnd.google-apps.document' or mimeType='application/vnd.google-apps.presentation')"
+    elif file_type == 'sheet':
+        # Show folders and Google Sheets
+        mime_query = "(mimeType='application/vnd.google-apps.folder' or mimeType='application/vnd.google-apps.spreadsheet')"
+    else:
+        # Show all
+        mime_query = "mimeType != 'application/vnd.google-apps.form'"
+    
+    return f"{parent_query} and {mime_query} and trashed=false"
+
+class DriveListingCache:
+    """Folder listings for the Drive browser, one Drive page per entry.
+
+    Entries are keyed by (folder, type filter, page token) and expire after
+    drive_cache_ttl seconds. Opening a folder lists the first page of its
+    subfolders in the background, and listings rotate over the loaded
+    accounts. invalidate() drops a folder's entries once its files change.
+    """
+    
+    def __init__(self, max_entries=2000, prefetch_workers=4):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # {(folder_id, file_type, page_token): (expires, files, next_page_token)}
+        self.inflight = {}  # {key: Event} pages being listed right now
+        self.max_entries = max_entries
+        self.prefetch_workers = prefetch_workers
+        self.pool = None
+        self.accounts = itertools.count()
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+    
+    def page(self, folder_id, file_type='all', page_token=''):
+        """(files, next_page_token) for one page of a folder"""
         # Use shared root folder if 'root' is requested
         if folder_id == 'root':
             folder_id = SHARED_ROOT_FOLDER
+        files, next_page_token = self._get((folder_id, file_type, page_token or ''))
+        if not page_token:
+            self._prefetch([f['id'] for f in files if f['isFolder']], file_type)
+        return files, next_page_token
+    
+    def _fresh(self, key):
+        entry = self.entries.get(key)
+        return entry if entry and entry[0] > time.time() else None
+    
+    def _get(self, key):
+        while True:
+            with self.lock:
+                entry = self._fresh(key)
+                if entry:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1], entry[2]
+                event = self.inflight.get(key)
+                if event is None:
+                    self.inflight[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # Already being listed (e.g. by the prefetcher) - use its result
+            event.wait(30)
         
-        parent_query = f"'{folder_id}' in parents"
-        
-        # Determine what to show based on type
-        if file_type == 'folder':
-            # Show only folders
-            mime_query = "mimeType='application/vnd.google-apps.folder'"
-        elif file_type == 'doc':
-            # Show folders, Google Docs, and Google Slides
-            mime_query = "(mimeType='application/vnd.google-apps.folder' or mimeType='application/vnd.google-apps.document' or mimeType='application/vnd.google-apps.presentation')"
-        elif file_type == 'sheet':
-            # Show folders and Google Sheets
-            mime_query = "(mimeType='application/vnd.google-apps.folder' or mimeType='application/vnd.google-apps.spreadsheet')"
-        else:
-            # Show all
-            mime_query = "mimeType != 'application/vnd.google-apps.form'"
-        
-        query = f"{parent_query} and {mime_query} and trashed=false"
-        
-        results = drive.files().list(
-            q=query,
-            fields="files(id, name, mimeType)",
-            orderBy="folder,name",
-            pageSize=100,
+        try:
+            files, next_page_token = self._fetch(*key)
+            ttl = int(state['config'].get('drive_cache_ttl', 300))
+            with self.lock:
+                self.entries[key] = (time.time() + ttl, files, next_page_token)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        finally:
+            with self.lock:
+                self.inflight.pop(key).set()
+        return files, next_page_token
+    
+    def _fetch(self, folder_id, file_type, page_token):
+        acc_idx = next(self.accounts) % max(1, len(state['accounts']))
+        try:
+            return self._list(acc_idx, folder_id, file_type, page_token)
+        except Exception:
+            if acc_idx == 0:
+                raise
+            # The folder may only be shared with the first account
+            return self._list(0, folder_id, file_type, page_token)
+    
+    def _list(self, acc_idx, folder_id, file_type, page_token):
+        params = dict(
+            q=drive_list_query(folder_id, file_type),
+            fields='nextPageToken, files(id, name, mimeType)',
+            orderBy='folder,name',
+            pageSize=int(state['config'].get('drive_page_size', 200)),
             supportsAllDrives=True,
             includeItemsFromAllDrives=True
-        ).execute()
+        )
+        if page_token:
+            params['pageToken'] = page_token
+        with account_services(acc_idx) as (drive, _, _, _):
+            results = execute_api(drive.files().list(**params), acc_idx, 'drive')
         
         files = []
         for f in results.get('files', []):
@@ -934,42 +3939,98 @@ def list_drive_files(folder_id='root', file_type='all'):
                 'id': f['id'],
                 'name': f['name'],
                 'mimeType': f['mimeType'],
-                'isFolder': f['mimeType'] == 'application/vnd.google-apps.folder'
+                'isFolder': f['mimeType'] == FOLDER_MIME
             })
         
         # Sort: folders first, then by name
         files.sort(key=lambda x: (not x['isFolder'], x['name'].lower()))
-        
-        return files
-        
+        return files, results.get('nextPageToken')
+    
+    def _prefetch(self, folder_ids, file_type):
+        """List the first page of up to drive_prefetch subfolders in the background"""
+        limit = int(state['config'].get('drive_prefetch', 10))
+        if limit <= 0:
+            return
+        if self.pool is None:
+            self.pool = eventlet.GreenPool(self.prefetch_workers)
+        for folder_id in folder_ids[:limit]:
+            key = (folder_id, file_type, '')
+            with self.lock:
+                if self._fresh(key) or key in self.inflight:
+                    continue
+            if not self.pool.free():
+                break  # Prefetching never makes a request wait
+            self.pool.spawn_n(self._prefetch_one, key)
+    
+    def _prefetch_one(self, key):
+        try:
+            self._get(key)
+            with self.lock:
+                self.prefetched += 1
+        except Exception:
+            pass
+    
+    def invalidate(self, folder_id=None):
+        """Forget a folder's listings (all of them without folder_id)"""
+        if folder_id == 'root':
+            folder_id = SHARED_ROOT_FOLDER
+        with self.lock:
+            if folder_id is None:
+                self.entries.clear()
+            else:
+                for key in [key for key in self.entries if key[0] == folder_id]:
+                    del self.entries[key]
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'prefetched': self.prefetched,
+                'hit_rate': round(self.hits / lookups * 100, 1) if lookups else 0,
+            }
+
+drive_cache = DriveListingCache()
+
+def list_drive_files(folder_id='root', file_type='all'):
+    """List all files in a Google Drive folder (every page, cached)"""
+    files, page_token = [], ''
+    try:
+        while True:
+            page, page_token = drive_cache.page(folder_id, file_type, page_token)
+            files += page
+            if not page_token:
+                return files
     except Exception as e:
         add_log(f'❌ Error listing drive: {e}', 'error')
-        return []
+        return files
 
 def get_sheet_columns(sheet_id):
     """Get column headers from first row of sheet"""
     try:
-        _, _, _, sheets = get_services(0)
-        result = sheets.spreadsheets().values().get(
-            spreadsheetId=sheet_id,
-            range='1:1'  # First row only
-        ).execute()
-        
-        headers = result.get('values', [[]])[0]
-        columns = []
-        for idx, header in enumerate(headers):
-            col_letter = ''
-            n = idx
-            while n >= 0:
-                col_letter = chr(n % 26 + ord('A')) + col_letter
-                n = n // 26 - 1
-            columns.append({
-                'letter': col_letter,
-                'name': header.strip() if header else f'Column {col_letter}',
-                'index': idx
-            })
-        add_log(f'📊 Loaded {len(columns)} columns from sheet', 'info')
-        return columns
+        with account_services(0) as (_, _, _, sheets):
+            result = sheets.spreadsheets().values().get(
+                spreadsheetId=sheet_id,
+                range='1:1'  # First row only
+            ).execute()
+            
+            headers = result.get('values', [[]])[0]
+            columns = []
+            for idx, header in enumerate(headers):
+                col_letter = ''
+                n = idx
+                while n >= 0:
+                    col_letter = chr(n % 26 + ord('A')) + col_letter
+                    n = n // 26 - 1
+                columns.append({
+                    'letter': col_letter,
+                    'name': header.strip() if header else f'Column {col_letter}',
+                    'index': idx
+                })
+            add_log(f'📊 Loaded {len(columns)} columns from sheet', 'info')
+            return columns
     except Exception as e:
         import traceback
         print(f"Error reading sheet columns: {e}")
@@ -1002,70 +4063,70 @@ def auto_detect_name_column(columns):
 def find_or_create_link_column(sheet_id):
     """Find 'رابط الشهادة' column or create it as last column"""
     try:
-        _, _, _, sheets = get_services(0)
-        
-        # Get all rows to find actual last column with data
-        result = sheets.spreadsheets().values().get(
-            spreadsheetId=sheet_id,
-            range='1:100'  # Check first 100 rows
-        ).execute()
-        
-        rows = result.get('values', [])
-        if not rows:
-            # Empty sheet - start at column A
+        with account_services(0) as (_, _, _, sheets):
+            
+            # Get all rows to find actual last column with data
+            result = sheets.spreadsheets().values().get(
+                spreadsheetId=sheet_id,
+                range='1:100'  # Check first 100 rows
+            ).execute()
+            
+            rows = result.get('values', [])
+            if not rows:
+                # Empty sheet - start at column A
+                sheets.spreadsheets().values().update(
+                    spreadsheetId=sheet_id,
+                    range='A1',
+                    valueInputOption='RAW',
+                    body={'values': [['رابط الشهادة']]}
+                ).execute()
+                add_log('🔗 Created link column "رابط الشهادة" at A', 'success')
+                return 'A'
+            
+            headers = rows[0] if rows else []
+            
+            # Search for existing "رابط الشهادة" column
+            link_column_names = ['رابط الشهادة', 'رابط الشهاده', 'Certificate Link', 'certificate_link', 'Link']
+            for idx, header in enumerate(headers):
+                header_clean = header.strip().lower() if header else ''
+                for name in link_column_names:
+                    if name.lower() in header_clean or header_clean in name.lower():
+                        # Found! Calculate column letter
+                        col_letter = ''
+                        n = idx
+                        while n >= 0:
+                            col_letter = chr(n % 26 + ord('A')) + col_letter
+                            n = n // 26 - 1
+                        add_log(f'🔗 Found link column "{header}" at {col_letter}', 'info')
+                        return col_letter
+            
+            # Not found - find the last non-empty column across all rows
+            max_col = 0
+            for row in rows:
+                # Find last non-empty cell in this row
+                for i in range(len(row) - 1, -1, -1):
+                    if row[i] and str(row[i]).strip():
+                        max_col = max(max_col, i)
+                        break
+            
+            # Add column after last used column
+            next_col_idx = max_col + 1
+            col_letter = ''
+            n = next_col_idx
+            while n >= 0:
+                col_letter = chr(n % 26 + ord('A')) + col_letter
+                n = n // 26 - 1
+            
+            # Write header with name "رابط الشهادة"
             sheets.spreadsheets().values().update(
                 spreadsheetId=sheet_id,
-                range='A1',
+                range=f'{col_letter}1',
                 valueInputOption='RAW',
                 body={'values': [['رابط الشهادة']]}
             ).execute()
-            add_log('🔗 Created link column "رابط الشهادة" at A', 'success')
-            return 'A'
-        
-        headers = rows[0] if rows else []
-        
-        # Search for existing "رابط الشهادة" column
-        link_column_names = ['رابط الشهادة', 'رابط الشهاده', 'Certificate Link', 'certificate_link', 'Link']
-        for idx, header in enumerate(headers):
-            header_clean = header.strip().lower() if header else ''
-            for name in link_column_names:
-                if name.lower() in header_clean or header_clean in name.lower():
-                    # Found! Calculate column letter
-                    col_letter = ''
-                    n = idx
-                    while n >= 0:
-                        col_letter = chr(n % 26 + ord('A')) + col_letter
-                        n = n // 26 - 1
-                    add_log(f'🔗 Found link column "{header}" at {col_letter}', 'info')
-                    return col_letter
-        
-        # Not found - find the last non-empty column across all rows
-        max_col = 0
-        for row in rows:
-            # Find last non-empty cell in this row
-            for i in range(len(row) - 1, -1, -1):
-                if row[i] and str(row[i]).strip():
-                    max_col = max(max_col, i)
-                    break
-        
-        # Add column after last used column
-        next_col_idx = max_col + 1
-        col_letter = ''
-        n = next_col_idx
-        while n >= 0:
-            col_letter = chr(n % 26 + ord('A')) + col_letter
-            n = n // 26 - 1
-        
-        # Write header with name "رابط الشهادة"
-        sheets.spreadsheets().values().update(
-            spreadsheetId=sheet_id,
-            range=f'{col_letter}1',
-            valueInputOption='RAW',
-            body={'values': [['رابط الشهادة']]}
-        ).execute()
-        
-        add_log(f'🔗 Created link column "رابط الشهادة" at {col_letter}', 'success')
-        return col_letter
+            
+            add_log(f'🔗 Created link column "رابط الشهادة" at {col_letter}', 'success')
+            return col_letter
         
     except Exception as e:
         import traceback
@@ -1074,6 +4135,127 @@ def find_or_create_link_column(sheet_id):
         add_log(f'⚠️ Could not find/create link column: {str(e)[:100]}', 'warning')
         return 'O'  # Default fallback
 
+# ============ ZIP EXPORT ============
+
+class ZipStream:
+    """Write-only file object that hands written bytes to a generator"""
+    
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self.offset
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def zip_entry_names(files):
+    """'<name>.pdf' per file, numbered when names repeat"""
+    seen = {}
+    for f in files:
+        base = clean_name(f['name'] or '') or f'Certificate_{f["row"]}'
+        count = seen.get(base, 0) + 1
+        seen[base] = count
+        f['zip_name'] = f'{base}.pdf' if count == 1 else f'{base} ({count}).pdf'
+    return files
+
+def fetch_job_pdfs(files, out, stop, workers):
+    """Download files into PdfSpools on worker threads, putting
+    (file, spool, error) on the bounded queue out; None marks the end"""
+    num_accounts = max(1, len(state['accounts']))
+    chunksize = int(state['config']['pdf_chunk_mb'] * MB)
+    pending = iter(files)
+    pending_lock = threading.Lock()
+    
+    def worker(acc_idx):
+        with account_services(acc_idx) as (drive, _, _, _):
+            while not stop.is_set():
+                with pending_lock:
+                    f = next(pending, None)
+                if f is None:
+                    break
+                spool = PdfSpool()
+                try:
+                    execute_api(MediaDownload(
+                        drive.files().get_media(fileId=f['file_id'], supportsAllDrives=True), spool.file, chunksize
+                    ), acc_idx, 'drive')
+                    out.put((f, spool, None))
+                except Exception as e:
+                    spool.close()
+                    out.put((f, None, e))
+    
+    threads = [threading.Thread(target=worker, args=(i % num_accounts,), daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    out.put(None)
+
+def stream_job_zip(job_id):
+    """Yield a ZIP of a job's PDFs as it is written.
+
+    Files are fetched concurrently into PdfSpools (bounded by the PDF
+    memory budget) and at most a few are waiting at any time, so memory
+    stays flat however many files the job has.
+    """
+    files = zip_entry_names(job_store.job_files(job_id))
+    workers = max(1, int(state['config'].get('zip_fetch_workers', 4)))
+    out = queue.Queue(maxsize=workers)
+    stop = threading.Event()
+    fetcher = threading.Thread(target=fetch_job_pdfs, args=(files, out, stop, workers), daemon=True)
+    fetcher.start()
+    
+    stream = ZipStream()
+    zf = zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED, allowZip64=True)
+    failed = []
+    try:
+        while True:
+            item = out.get()
+            if item is None:
+                break
+            f, spool, error = item
+            if error is not None:
+                failed.append(f'{f["zip_name"]}: {str(error)[:200]}')
+                continue
+            try:
+                spool.file.seek(0)
+                with zf.open(f['zip_name'], 'w', force_zip64=True) as entry:
+                    for block in iter(lambda: spool.file.read(MB), b''):
+                        entry.write(block)
+                        yield stream.drain()
+            finally:
+                spool.close()
+        
+        if failed:
+            zf.writestr('FAILED.txt', '\n'.join(failed))
+        zf.close()
+        yield stream.drain()
+        add_log(f'📦 Job {job_id} ZIP: {len(files) - len(failed)} files' + (f', {len(failed)} failed' if failed else ''), 'info')
+    finally:
+        # Client gone or done - stop fetching and free what is queued
+        stop.set()
+        while True:
+            try:
+                item = out.get_nowait()
+            except queue.Empty:
+                if not fetcher.is_alive():
+                    break
+                time.sleep(0.05)
+                continue
+            if item and item[1]:
+                item[1].close()
+
 # ============ ROUTES ============
 
 @app.route('/')
@@ -1082,12 +4264,25 @@ def index():
 
 @app.route('/api/drive/list')
 def api_drive_list():
-    """API to list files in Google Drive"""
+    """One page of a Google Drive folder; pass next_page_token back as
+    page_token for the next one"""
     folder_id = request.args.get('folder_id', 'root')
     file_type = request.args.get('type', 'all')
+    page_token = request.args.get('page_token', '')
     
-    files = list_drive_files(folder_id, file_type)
-    return jsonify({'files': files})
+    try:
+        files, next_page_token = drive_cache.page(folder_id, file_type, page_token)
+    except Exception as e:
+        add_log(f'❌ Error listing drive: {e}', 'error')
+        return jsonify({'files': [], 'next_page_token': None, 'error': str(e)})
+    return jsonify({'files': files, 'next_page_token': next_page_token})
+
+@app.route('/api/drive/invalidate', methods=['POST'])
+def api_drive_invalidate():
+    """Forget cached listings of one folder ({"folder_id": ...}) or of all"""
+    folder_id = (request.json or {}).get('folder_id')
+    drive_cache.invalidate(folder_id)
+    return jsonify({'success': True})
 
 @app.route('/api/sheet/columns')
 def api_sheet_columns():
@@ -1113,7 +4308,23 @@ def get_state():
         'columns': state.get('columns', []),
         'accounts_count': len(state['accounts']),
         'available_sheets': state['available_sheets'],
-        'logs': state['logs'][-50:]
+        'name_cache': get_name_cache_stats(),
+        'service_pool': service_pool.stats(),
+        'link_writer': link_writer.stats(),
+        'rate_limits': rate_limiter.stats(),
+        'queue': default_job.work_queue.stats() if default_job.work_queue else None,
+        'pipeline': default_job.pipeline.depths() if default_job.pipeline else None,
+        'janitor': janitor.stats(),
+        'name_index': default_job.name_index.stats(),
+        'jobs': [ctx.summary() for ctx in job_manager.all()],
+        'scheduler': account_scheduler.stats(),
+        'workers': worker_dispatcher.stats(),
+        'job_id': state['job_id'],
+        'local_render': local_renderer.stats(),
+        'output_cache': output_cache.stats(),
+        'pdf_memory': memory_budget.stats(),
+        'drive_cache': drive_cache.stats(),
+        'logs': log_store.recent(50)
     })
 
 @app.route('/api/config', methods=['POST'])
@@ -1125,30 +4336,7 @@ def save_config():
     state['config']['template_doc_name'] = data.get('template_doc_name', '')
     
     # Auto-detect template type from Drive API
-    if state['config']['template_doc_id']:
-        try:
-            drive, _, _, _ = get_services(0)
-            file_info = drive.files().get(
-                fileId=state['config']['template_doc_id'], 
-                fields='mimeType',
-                supportsAllDrives=True
-            ).execute()
-            mime_type = file_info.get('mimeType', '')
-            
-            if 'presentation' in mime_type:
-                state['config']['template_type'] = 'slide'
-                add_log('📊 Detected template type: Google Slides', 'info')
-            elif 'document' in mime_type:
-                state['config']['template_type'] = 'doc'
-                add_log('📄 Detected template type: Google Docs', 'info')
-            else:
-                state['config']['template_type'] = 'doc'  # Default
-                add_log(f'⚠️ Unknown template type: {mime_type}, defaulting to Docs', 'warning')
-        except Exception as e:
-            state['config']['template_type'] = 'doc'  # Default on error
-            add_log(f'⚠️ Could not detect template type: {str(e)[:50]}', 'warning')
-    else:
-        state['config']['template_type'] = 'doc'
+    state['config']['template_type'] = detect_template_type(state['config']['template_doc_id'])
     
     # Target folder
     state['config']['target_folder_id'] = data.get('target_folder_id', '')
@@ -1178,6 +4366,45 @@ def save_config():
     state['config']['range_start'] = int(data.get('range_start', 2))
     state['config']['range_end'] = int(data.get('range_end', 1000))
     state['config']['watch_interval'] = int(data.get('watch_interval', 30))
+    state['config']['watch_full_scan_every'] = int(data.get('watch_full_scan_every', state['config']['watch_full_scan_every']))
+    state['config']['service_pool_size'] = int(data.get('service_pool_size', state['config']['service_pool_size']))
+    service_pool.resize(state['config']['service_pool_size'])
+    state['config']['link_flush_rows'] = int(data.get('link_flush_rows', state['config']['link_flush_rows']))
+    state['config']['link_flush_interval'] = int(data.get('link_flush_interval', state['config']['link_flush_interval']))
+    link_writer.flush_rows = state['config']['link_flush_rows']
+    link_writer.flush_interval = state['config']['link_flush_interval']
+    state['config']['account_concurrency'] = int(data.get('account_concurrency', state['config']['account_concurrency']))
+    state['config']['stall_timeout'] = int(data.get('stall_timeout', state['config']['stall_timeout']))
+    state['config']['green_pool_size'] = int(data.get('green_pool_size', state['config']['green_pool_size']))
+    state['config']['cpu_offload'] = bool(data.get('cpu_offload', state['config']['cpu_offload']))
+    state['config']['cpu_batch_size'] = int(data.get('cpu_batch_size', state['config']['cpu_batch_size']))
+    state['config']['copy_batch_size'] = int(data.get('copy_batch_size', state['config']['copy_batch_size']))
+    state['config']['bake_min_rows'] = int(data.get('bake_min_rows', state['config']['bake_min_rows']))
+    state['config']['pipeline_queue_size'] = int(data.get('pipeline_queue_size', state['config']['pipeline_queue_size']))
+    if isinstance(data.get('pipeline_workers'), dict):
+        state['config']['pipeline_workers'].update({k: int(v) for k, v in data['pipeline_workers'].items()})
+    if data.get('render_mode') in ('drive', 'local'):
+        state['config']['render_mode'] = data['render_mode']
+    if data.get('execution') in ('local', 'workers'):
+        state['config']['execution'] = data['execution']
+    state['config']['worker_lease_seconds'] = int(data.get('worker_lease_seconds', state['config']['worker_lease_seconds']))
+    state['config']['pdf_memory_budget_mb'] = int(data.get('pdf_memory_budget_mb', state['config']['pdf_memory_budget_mb']))
+    state['config']['pdf_spool_mb'] = float(data.get('pdf_spool_mb', state['config']['pdf_spool_mb']))
+    state['config']['pdf_chunk_mb'] = int(data.get('pdf_chunk_mb', state['config']['pdf_chunk_mb']))
+    memory_budget.limit = state['config']['pdf_memory_budget_mb'] * MB
+    state['config']['zip_fetch_workers'] = int(data.get('zip_fetch_workers', state['config']['zip_fetch_workers']))
+    state['config']['drive_page_size'] = int(data.get('drive_page_size', state['config']['drive_page_size']))
+    state['config']['drive_cache_ttl'] = int(data.get('drive_cache_ttl', state['config']['drive_cache_ttl']))
+    state['config']['drive_prefetch'] = int(data.get('drive_prefetch', state['config']['drive_prefetch']))
+    state['config']['broadcast_interval_ms'] = int(data.get('broadcast_interval_ms', state['config']['broadcast_interval_ms']))
+    broadcaster.interval = state['config']['broadcast_interval_ms'] / 1000
+    state['config']['reuse_outputs'] = bool(data.get('reuse_outputs', state['config']['reuse_outputs']))
+    state['config']['render_font'] = data.get('render_font', state['config']['render_font'])
+    if isinstance(data.get('render_fields'), list):
+        state['config']['render_fields'] = data['render_fields']
+    if isinstance(data.get('api_quotas'), dict):
+        state['config']['api_quotas'].update({k: int(v) for k, v in data['api_quotas'].items()})
+        rate_limiter.configure(state['config']['api_quotas'])
     
     add_log('⚙️ Configuration saved', 'info')
     
@@ -1199,47 +4426,73 @@ def save_config():
     
     return jsonify({'success': True, 'config': state['config'], 'variables': state['variables'], 'columns': state['columns']})
 
+def detect_template_type(template_id):
+    """'slide' for a Google Slides template, 'doc' otherwise"""
+    if not template_id:
+        return 'doc'
+    try:
+        with account_services(0) as (drive, _, _, _):
+            file_info = drive.files().get(
+                fileId=template_id, 
+                fields='mimeType',
+                supportsAllDrives=True
+            ).execute()
+            mime_type = file_info.get('mimeType', '')
+            
+            if 'presentation' in mime_type:
+                add_log('📊 Detected template type: Google Slides', 'info')
+                return 'slide'
+            elif 'document' in mime_type:
+                add_log('📄 Detected template type: Google Docs', 'info')
+                return 'doc'
+            else:
+                add_log(f'⚠️ Unknown template type: {mime_type}, defaulting to Docs', 'warning')
+                return 'doc'  # Default
+    except Exception as e:
+        add_log(f'⚠️ Could not detect template type: {str(e)[:50]}', 'warning')
+        return 'doc'  # Default on error
+
 def detect_template_variables(template_id, template_type='doc'):
     """Detect {{VARIABLE}} patterns in template document or presentation"""
     try:
-        drive, docs, slides, _ = get_services(0)
-        
-        full_text = ''
-        
-        if template_type == 'slide':
-            # Get Slides presentation
-            presentation = slides.presentations().get(presentationId=template_id).execute()
+        with account_services(0) as (drive, docs, slides, _):
             
-            # Extract text from all slides
-            for slide in presentation.get('slides', []):
-                for element in slide.get('pageElements', []):
-                    if 'shape' in element:
-                        shape = element['shape']
-                        if 'text' in shape:
-                            for text_elem in shape['text'].get('textElements', []):
-                                if 'textRun' in text_elem:
-                                    full_text += text_elem['textRun'].get('content', '')
-        else:
-            # Get Docs document
-            doc = docs.documents().get(documentId=template_id).execute()
+            full_text = ''
+            
+            if template_type == 'slide':
+                # Get Slides presentation
+                presentation = slides.presentations().get(presentationId=template_id).execute()
+                
+                # Extract text from all slides
+                for slide in presentation.get('slides', []):
+                    for element in slide.get('pageElements', []):
+                        if 'shape' in element:
+                            shape = element['shape']
+                            if 'text' in shape:
+                                for text_elem in shape['text'].get('textElements', []):
+                                    if 'textRun' in text_elem:
+                                        full_text += text_elem['textRun'].get('content', '')
+            else:
+                # Get Docs document
+                doc = docs.documents().get(documentId=template_id).execute()
+                
+                # Extract all text from document
+                content = doc.get('body', {}).get('content', [])
+                
+                for element in content:
+                    if 'paragraph' in element:
+                        for elem in element['paragraph'].get('elements', []):
+                            if 'textRun' in elem:
+                                full_text += elem['textRun'].get('content', '')
             
-            # Extract all text from document
-            content = doc.get('body', {}).get('content', [])
+            # Find all <<VARIABLE>> patterns (Arabic and English)
+            import re
+            # Match <<text>> where text can be Arabic, English, numbers, spaces, or underscores
+            variables = re.findall(r'<<([\u0600-\u06FFa-zA-Z0-9_\s]+)>>', full_text)
             
-            for element in content:
-                if 'paragraph' in element:
-                    for elem in element['paragraph'].get('elements', []):
-                        if 'textRun' in elem:
-                            full_text += elem['textRun'].get('content', '')
-        
-        # Find all <<VARIABLE>> patterns (Arabic and English)
-        import re
-        # Match <<text>> where text can be Arabic, English, numbers, spaces, or underscores
-        variables = re.findall(r'<<([\u0600-\u06FFa-zA-Z0-9_\s]+)>>', full_text)
-        
-        # Return unique variables with <<>> format
-        unique_vars = list(dict.fromkeys(['<<' + v.strip() + '>>' for v in variables]))
-        return unique_vars
+            # Return unique variables with <<>> format
+            unique_vars = list(dict.fromkeys(['<<' + v.strip() + '>>' for v in variables]))
+            return unique_vars
         
     except Exception as e:
         add_log(f'⚠️ Could not read template: {str(e)[:50]}', 'warning')
@@ -1288,6 +4541,237 @@ def save_variables():
     add_log(f'📝 Saved {len(state["variables"])} variables', 'info')
     return jsonify({'success': True})
 
+@app.route('/api/render/template')
+def api_render_template():
+    """Blank template page sizes and detected variables, for placing render regions"""
+    config = state['config']
+    if not LOCAL_RENDER_AVAILABLE:
+        return jsonify({'success': False, 'error': 'Local rendering dependencies are not installed'})
+    if not config['template_doc_id']:
+        return jsonify({'success': False, 'error': 'No template selected'})
+    try:
+        local_renderer.prepare(default_job)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+    return jsonify({
+        'success': True,
+        'pages': [{'width': w, 'height': h} for w, h in local_renderer.page_sizes(default_job)],
+        'variables': detect_template_variables(config['template_doc_id'], config.get('template_type', 'doc')),
+        'fields': config['render_fields'],
+    })
+
+def parse_render_field(field):
+    """A render region from the dashboard, validated; raises ValueError"""
+    if not isinstance(field, dict) or not str(field.get('placeholder', '')).strip():
+        raise ValueError('Each region needs a placeholder')
+    if field.get('x') is None or field.get('y') is None:
+        raise ValueError(f'Region {field["placeholder"]} needs x and y')
+    align = field.get('align', 'center')
+    if align not in ('left', 'center', 'right'):
+        raise ValueError(f'Unknown alignment: {align}')
+    color = str(field.get('color', '#000000'))
+    if not re.fullmatch(r'#[0-9a-fA-F]{6}', color):
+        raise ValueError(f'Invalid color: {color}')
+    parsed = {
+        'placeholder': str(field['placeholder']).strip(),
+        'page': int(field.get('page', 0)),
+        'x': float(field['x']),
+        'y': float(field['y']),
+        'width': float(field.get('width', 0)),
+        'font_size': float(field.get('font_size', 24)),
+        'color': color,
+        'align': align,
+    }
+    if parsed['page'] < 0 or parsed['width'] < 0 or parsed['font_size'] <= 0:
+        raise ValueError('Page, width and font size must be positive')
+    if field.get('font'):
+        parsed['font'] = str(field['font'])
+    return parsed
+
+@app.route('/api/render/settings', methods=['POST'])
+def api_render_settings():
+    """Save the render mode, font and regions (leaves the rest of the config,
+    including the variable mapping, untouched)"""
+    data = request.get_json(silent=True) or {}
+    config = state['config']
+    fields = data.get('render_fields', config['render_fields'])
+    if not isinstance(fields, list):
+        return jsonify({'success': False, 'error': 'render_fields must be a list'}), 400
+    try:
+        fields = [parse_render_field(field) for field in fields]
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    font = str(data.get('render_font', config['render_font'])).strip()
+    if font and not os.path.isfile(font):
+        return jsonify({'success': False, 'error': f'Font file not found: {font}'}), 400
+    
+    if data.get('render_mode') in ('drive', 'local'):
+        config['render_mode'] = data['render_mode']
+    config['render_font'] = font
+    config['render_fields'] = fields
+    add_log(f'🖨️ Saved local rendering settings ({len(fields)} regions, mode {config["render_mode"]})', 'info')
+    return jsonify({'success': True, 'fields': fields})
+
+@app.route('/api/jobs')
+def api_jobs():
+    """Recent generation jobs with per-row counts from the job store"""
+    return jsonify({'jobs': job_store.recent_jobs(int(request.args.get('limit', 20)))})
+
+@app.route('/api/jobs/<int:job_id>/zip')
+def api_job_zip(job_id):
+    """Download all PDFs generated by a job as one ZIP, streamed"""
+    return Response(
+        stream_job_zip(job_id),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="certificates-job-{job_id}.zip"'}
+    )
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Stage latencies, per-account counters and queue depths for Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/logs')
+def api_logs():
+    """Log entries after a sequence number, e.g. /api/logs?after=1200&level=error,warning&job=job-2"""
+    after = int(request.args.get('after', 0))
+    limit = min(int(request.args.get('limit', 500)), 5000)
+    levels = set(request.args['level'].split(',')) if request.args.get('level') else None
+    entries, last_seq = log_store.query(after, levels, limit, request.args.get('job'))
+    return jsonify({
+        'logs': entries,
+        'last_seq': last_seq,
+        'has_more': len(entries) >= limit,
+    })
+
+@app.route('/api/active-jobs', methods=['GET'])
+def api_active_jobs():
+    """Running and recent jobs with the account scheduler's view"""
+    return jsonify({
+        'jobs': [ctx.summary() for ctx in job_manager.all()],
+        'scheduler': account_scheduler.stats(),
+    })
+
+@app.route('/api/active-jobs', methods=['POST'])
+def api_create_job():
+    """Start a job beside the dashboard's one, e.g.
+    {"template_doc_id": ..., "target_folder_id": ..., "sheet_id": ..., "weight": 2}"""
+    data = request.json or {}
+    config = {key: data[key] for key in JOB_CONFIG_KEYS if key in data}
+    if not all([config.get('template_doc_id'), config.get('target_folder_id'), config.get('sheet_id')]):
+        return jsonify({'error': 'template_doc_id, target_folder_id and sheet_id are required'}), 400
+    
+    if 'template_type' not in config:
+        config['template_type'] = detect_template_type(config['template_doc_id'])
+    if 'link_column' not in config:
+        config['link_column'] = find_or_create_link_column(config['sheet_id'])
+    if 'name_column' not in config:
+        config['name_column'] = auto_detect_name_column(get_sheet_columns(config['sheet_id']))
+    
+    variables = data.get('variables')
+    if not isinstance(variables, list):
+        # Same default as the dashboard: the first template variable is the name
+        detected = detect_template_variables(config['template_doc_id'], config['template_type'])
+        variables = [{
+            'placeholder': detected[0],
+            'source': 'column',
+            'column': config['name_column'] or 'A',
+            'description': 'الاسم'
+        }] if detected else []
+    
+    weight = float(data.get('weight', 1))
+    if weight <= 0:
+        return jsonify({'error': 'weight must be positive'}), 400
+    
+    ctx = job_manager.create(config, variables, weight)
+    add_log(f'🗂️ Started {ctx.id} (weight {weight:g})', 'info')
+    return jsonify({'success': True, 'job': ctx.summary()})
+
+@app.route('/api/active-jobs/<job_key>/<action>', methods=['POST'])
+def api_job_action(job_key, action):
+    """pause (toggle), stop or weight ({"weight": 3}) for one job"""
+    ctx = job_manager.get(job_key)
+    if ctx is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    
+    if action == 'pause':
+        if ctx.pause_flag.is_set():
+            ctx.pause_flag.clear()
+            ctx.state['status'] = 'running'
+            ctx.log('▶️ Resumed', 'info')
+        else:
+            ctx.pause_flag.set()
+            ctx.state['status'] = 'paused'
+            ctx.log('⏸️ Paused', 'warning')
+    elif action == 'stop':
+        ctx.stop_flag.set()
+        ctx.pause_flag.clear()
+        ctx.state['status'] = 'idle'
+        ctx.log('⏹️ Stopped', 'warning')
+    elif action == 'weight':
+        weight = float((request.json or {}).get('weight', ctx.weight))
+        if weight <= 0:
+            return jsonify({'error': 'weight must be positive'}), 400
+        ctx.weight = weight
+        ctx.log(f'⚖️ Weight set to {weight:g}', 'info')
+    else:
+        return jsonify({'error': 'Unknown action'}), 400
+    
+    broadcast_state()
+    return jsonify({'success': True, 'job': ctx.summary()})
+
+@app.route('/api/active-jobs/<job_key>/logs')
+def api_job_logs(job_key):
+    """Recent log entries of one job"""
+    ctx = job_manager.get(job_key)
+    if ctx is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify({'logs': list(ctx.logs)})
+
+@app.route('/api/worker/sync', methods=['POST'])
+def api_worker_sync():
+    """Worker results in, lease renewals and new rows out"""
+    if not WORKER_TOKEN:
+        return jsonify({'error': 'Worker execution is disabled (CERTGEN_WORKER_TOKEN not set)'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Worker-Token', ''), WORKER_TOKEN):
+        return jsonify({'error': 'Invalid worker token'}), 403
+    
+    data = request.get_json(silent=True)
+    try:
+        worker = data['worker']
+        accounts = int(data.get('accounts', 0))
+        max_rows = max(0, int(data.get('max_rows', 0)))
+        results = data.get('results', [])
+        renew = data.get('renew', [])
+        if not isinstance(worker, str) or not worker:
+            raise ValueError('worker')
+        if not isinstance(results, list) or not all(
+            isinstance(r, dict) and {'job_id', 'sheet_id', 'row'} <= r.keys()
+            and (r.get('error') or {'file_id', 'link'} <= r.keys())
+            for r in results
+        ):
+            raise ValueError('results')
+        if not isinstance(renew, list) or not all(isinstance(r, dict) and {'job_id', 'row'} <= r.keys() for r in renew):
+            raise ValueError('renew')
+    except (TypeError, KeyError, ValueError, AttributeError):
+        return jsonify({'error': 'Malformed sync request'}), 400
+    return jsonify(worker_dispatcher.sync(worker, accounts, max_rows, results, renew))
+
+@app.route('/api/workers')
+def api_workers():
+    """Connected workers and the jobs served to them"""
+    return jsonify(worker_dispatcher.stats())
+
+@app.route('/api/rate-limits')
+def api_rate_limits():
+    """Current token-bucket levels per account and API family"""
+    return jsonify(rate_limiter.stats())
+
+@app.route('/api/name-cache')
+def api_name_cache():
+    """Hit/miss statistics for the cleaned/normalized name caches"""
+    return jsonify(get_name_cache_stats())
+
 @app.route('/api/cleanup-config', methods=['POST'])
 def save_cleanup_config():
     data = request.json
@@ -1298,6 +4782,7 @@ def save_cleanup_config():
         'remove_alef': data.get('remove_alef', True),
         'trim_spaces': data.get('trim_spaces', True)
     }
+    invalidate_cleanup_engine()
     add_log(f'🧹 Saved cleanup config ({len(state["config"]["cleanup"]["remove_words"])} words)', 'info')
     return jsonify({'success': True})
 
@@ -1318,6 +4803,10 @@ def start_generation():
 
 @app.route('/api/pause', methods=['POST'])
 def pause_generation():
+    """Pause/resume the dashboard's job, or another one given {"job": id}"""
+    job_key = (request.get_json(silent=True) or {}).get('job')
+    if job_key and job_key != default_job.id:
+        return api_job_action(job_key, 'pause')
     if pause_flag.is_set():
         pause_flag.clear()
         state['status'] = 'running'
@@ -1332,8 +4821,13 @@ def pause_generation():
 
 @app.route('/api/stop', methods=['POST'])
 def stop_generation():
+    """Stop the dashboard's job (and auto-watch), or another one given {"job": id}"""
+    job_key = (request.get_json(silent=True) or {}).get('job')
+    if job_key and job_key != default_job.id:
+        return api_job_action(job_key, 'stop')
     stop_flag.set()
     pause_flag.clear()
+    link_writer.flush()
     stop_watcher()
     state['status'] = 'idle'
     add_log('⏹️ Stopped', 'warning')
@@ -1358,6 +4852,7 @@ def toggle_auto_watch():
 def reload_accounts():
     state['accounts'] = []
     state['accounts_loaded'] = False
+    service_pool.clear()
     load_service_accounts()
     return jsonify({'success': True, 'count': len(state['accounts'])})
 
@@ -1365,19 +4860,16 @@ def reload_accounts():
 
 @socketio.on('connect')
 def handle_connect():
-    emit('state_update', {
-        'status': state['status'],
-        'total': state['total'],
-        'completed': state['completed'],
-        'failed': state['failed'],
-        'current_name': state['current_name'],
-        'watching': state['config']['auto_watch'],
-    })
+    # Ticks only carry changes, so a new client gets the full state first
+    emit('state_update', state_snapshot())
 
 # ============ MAIN ============
 
 if __name__ == '__main__':
-    import sys
+    # python app.py worker http://controller:5000 [slots]
+    if len(sys.argv) > 2 and sys.argv[1] == 'worker':
+        run_worker(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else None)
+        sys.exit(0)
     
     port = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
     
@@ -1388,5 +4880,19 @@ if __name__ == '__main__':
     
     load_service_accounts()
     
+    # Write links buffered before a crash/restart
+    replayed = link_writer.replay_journal()
+    if replayed:
+        add_log(f'🔗 Replaying {replayed} buffered links from last run', 'info')
+        link_writer.flush()
+    link_writer.start()
+    
+    # Clean up temp copies orphaned by crashed runs
+    janitor.start()
+    janitor.sweep()
+    
+    # Pick up where interrupted jobs left off
+    resume_interrupted_jobs()
+    
     # Production mode (no debug)
     socketio.run(app, host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,409 @@
+"""
+Offline benchmark for the certificate scheduler.
+
+Runs the real run_generator against an in-process fake Google backend
+(Drive, Docs, Slides, Sheets) with configurable latency, error rate and
+per-account quotas, and reports certificates/min, per-certificate latency
+and API calls per certificate. No credentials or quota are used.
+
+    python scripts/benchmark.py --rows 500 --accounts 4 --latency 0.2
+    python scripts/benchmark.py --rows 200 --quota 120 --json > baseline.json
+"""
+
+import sys, types, os
+import argparse
+import json
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+
+# Ensure project root is in sys.path so 'app' can be imported
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+# Stubs so we can import app without the web stack
+class ThreadPool:
+    """Stand-in for eventlet.GreenPool running plain threads"""
+    def __init__(self, size=1000):
+        self.size = size
+    def spawn(self, fn, *args):
+        t = threading.Thread(target=fn, args=args, daemon=True)
+        t.wait = t.join
+        t.start()
+        return t
+    def spawn_n(self, fn, *args):
+        self.spawn(fn, *args)
+sys.modules['eventlet'] = types.SimpleNamespace(
+    monkey_patch=lambda: None,
+    GreenPool=ThreadPool,
+    tpool=types.SimpleNamespace(execute=lambda fn, *a, **k: fn(*a, **k)),
+)
+class DummyFlask:
+    def __init__(self, *a, **k):
+        self.config = {}
+    def route(self, *a, **k):
+        def decorator(f):
+            return f
+        return decorator
+    def run(self, *a, **k):
+        return None
+flask = types.SimpleNamespace(
+    Flask=DummyFlask,
+    Response=lambda *a, **k: None,
+    render_template=lambda *a, **k: '',
+    jsonify=lambda *a, **k: {},
+    request=types.SimpleNamespace()
+)
+sys.modules['flask'] = flask
+
+class DummySocketIO:
+    def __init__(self, *a, **k):
+        pass
+    def emit(self, *a, **k):
+        return None
+    def on(self, *args, **k):
+        def decorator(f):
+            return f
+        return decorator
+    def run(self, *a, **k):
+        return None
+
+sys.modules['flask_socketio'] = types.SimpleNamespace(SocketIO=DummySocketIO, emit=lambda *a, **k: None)
+
+from googleapiclient.errors import HttpError
+
+
+# ============ FAKE BACKEND ============
+
+class FakeGoogle:
+    """Shared state of the simulated APIs: latency, errors, quotas, call counts"""
+
+    def __init__(self, latency, jitter, error_rate, quota, rows):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quota = quota  # Requests per minute per account and API family (0 = unlimited)
+        self.lock = threading.Lock()
+        self.calls = Counter()  # {method: count}
+        self.http_requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.windows = {}  # {(account, family): [timestamps]}
+        self.ids = 0
+        self.sheet = [['Name', 'Link']] + [[f'Attendee {i}', ''] for i in range(rows)]
+
+    def new_id(self, prefix):
+        with self.lock:
+            self.ids += 1
+            return f'{prefix}{self.ids}'
+
+    def call(self, account, family, method, result, http=True):
+        """Simulate one API call: quota check, latency, random failure"""
+        now = time.monotonic()
+        with self.lock:
+            self.calls[method] += 1
+            if http:
+                self.http_requests += 1
+            if self.quota:
+                window = [t for t in self.windows.get((account, family), []) if now - t < 60]
+                over = len(window) >= self.quota
+                if not over:
+                    window.append(now)
+                self.windows[(account, family)] = window
+                if over:
+                    self.rate_limited += 1
+                    raise fake_http_error(429, 'rateLimitExceeded')
+
+        if http and self.latency:
+            time.sleep(max(0, random.gauss(self.latency, self.latency * self.jitter)))
+
+        if self.error_rate and random.random() < self.error_rate:
+            with self.lock:
+                self.errors += 1
+            raise fake_http_error(500, 'backendError')
+        return result() if callable(result) else result
+
+def fake_http_error(status, reason):
+    resp = types.SimpleNamespace(status=status, reason=reason)
+    content = json.dumps({'error': {'code': status, 'errors': [{'reason': reason}], 'message': reason}})
+    return HttpError(resp, content.encode('utf-8'))
+
+class FakeRequest:
+    def __init__(self, backend, account, family, method, result):
+        self.backend = backend
+        self.account = account
+        self.family = family
+        self.method = method
+        self.result = result
+
+    def execute(self, http=True):
+        return self.backend.call(self.account, self.family, self.method, self.result, http)
+
+class FakeBatch:
+    """One HTTP round trip carrying several sub-requests"""
+
+    def __init__(self, backend, callback):
+        self.backend = backend
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        with self.backend.lock:
+            self.backend.http_requests += 1
+        if self.backend.latency:
+            time.sleep(self.backend.latency)
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(http=False), None)
+            except HttpError as e:
+                self.callback(request_id, None, e)
+
+class FakeDownload:
+    """Stands in for MediaIoBaseDownload: writes the request's bytes in one chunk"""
+
+    def __init__(self, fh, request, chunksize=None):
+        self.fh = fh
+        self.request = request
+
+    def next_chunk(self):
+        self.fh.write(self.request.execute())
+        return None, True
+
+PDF_BYTES = b'%PDF-1.4\n' + b'0' * 200000
+
+class FakeFiles:
+    def __init__(self, backend, account):
+        self.b = backend
+        self.a = account
+
+    def _req(self, method, result):
+        return FakeRequest(self.b, self.a, 'drive', method, result)
+
+    def copy(self, **kw):
+        return self._req('drive.copy', lambda: {'id': self.b.new_id('doc')})
+
+    def export_media(self, **kw):
+        return self._req('drive.export', PDF_BYTES)
+
+    def get_media(self, **kw):
+        return self._req('drive.get_media', PDF_BYTES)
+
+    def create(self, **kw):
+        def result():
+            file_id = self.b.new_id('pdf')
+            return {'id': file_id, 'webViewLink': f'https://drive.example/{file_id}'}
+        return self._req('drive.create', result)
+
+    def get(self, **kw):
+        return self._req('drive.get', {'id': kw.get('fileId'), 'version': '1', 'trashed': False,
+                                       'mimeType': 'application/vnd.google-apps.document'})
+
+    def delete(self, **kw):
+        return self._req('drive.delete', {})
+
+    def update(self, **kw):
+        return self._req('drive.update', {})
+
+    def list(self, **kw):
+        return self._req('drive.list', {'files': []})
+
+class FakeDrive:
+    def __init__(self, backend, account):
+        self.b = backend
+        self.a = account
+
+    def files(self):
+        return FakeFiles(self.b, self.a)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self.b, callback)
+
+class FakeDocs:
+    def __init__(self, backend, account):
+        self.b = backend
+        self.a = account
+
+    def documents(self):
+        return types.SimpleNamespace(
+            batchUpdate=lambda **kw: FakeRequest(self.b, self.a, 'docs', 'docs.batchUpdate', {}),
+        )
+
+class FakeSlides:
+    def __init__(self, backend, account):
+        self.b = backend
+        self.a = account
+
+    def presentations(self):
+        return types.SimpleNamespace(
+            batchUpdate=lambda **kw: FakeRequest(self.b, self.a, 'slides', 'slides.batchUpdate', {}),
+        )
+
+RANGE_RE = re.compile(r'([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?$')
+
+class FakeValues:
+    def __init__(self, backend, account):
+        self.b = backend
+        self.a = account
+
+    def get(self, spreadsheetId=None, range=None, **kw):
+        def result():
+            m = RANGE_RE.match(range.split('!')[-1])
+            start = int(m.group(2) or 1)
+            end = int(m.group(4)) if m.group(4) else len(self.b.sheet)
+            with self.b.lock:
+                return {'values': [list(row) for row in self.b.sheet[start - 1:end]]}
+        return FakeRequest(self.b, self.a, 'sheets', 'sheets.get', result)
+
+    def _write(self, cell_range, value):
+        import app
+        m = RANGE_RE.match(cell_range.split('!')[-1])
+        col = app.column_to_index(m.group(1))
+        row = int(m.group(2))
+        with self.b.lock:
+            while len(self.b.sheet) < row:
+                self.b.sheet.append([])
+            cells = self.b.sheet[row - 1]
+            while len(cells) <= col:
+                cells.append('')
+            cells[col] = value
+
+    def batchUpdate(self, spreadsheetId=None, body=None, **kw):
+        def result():
+            for item in body['data']:
+                self._write(item['range'], item['values'][0][0])
+            return {}
+        return FakeRequest(self.b, self.a, 'sheets', 'sheets.batchUpdate', result)
+
+    def update(self, spreadsheetId=None, range=None, body=None, **kw):
+        def result():
+            self._write(range, body['values'][0][0])
+            return {}
+        return FakeRequest(self.b, self.a, 'sheets', 'sheets.update', result)
+
+class FakeSheets:
+    def __init__(self, backend, account):
+        self.b = backend
+        self.a = account
+
+    def spreadsheets(self):
+        return types.SimpleNamespace(values=lambda: FakeValues(self.b, self.a))
+
+
+# ============ BENCHMARK ============
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='certgen-bench-')
+    os.chdir(workdir)  # Job store, link journal etc. go to a scratch folder
+
+    import app
+
+    backend = FakeGoogle(args.latency, args.jitter, args.error_rate, args.quota, args.rows)
+    app.MediaIoBaseDownload = FakeDownload
+    app.service_pool._build = lambda account: (
+        FakeDrive(backend, account), FakeDocs(backend, account),
+        FakeSlides(backend, account), FakeSheets(backend, account),
+    )
+    app.state['accounts'] = [{'file': f'fake-{i}.json', 'creds': i} for i in range(args.accounts)]
+    app.state['accounts_loaded'] = True
+    app.state['variables'] = [{'placeholder': '<<Name>>', 'source': 'column', 'column': 'A'}]
+    if args.static_vars:
+        app.state['variables'] += [
+            {'placeholder': f'<<Static {i}>>', 'source': 'value', 'value': f'Value {i}'}
+            for i in range(args.static_vars)
+        ]
+
+    config = app.state['config']
+    config.update(
+        template_doc_id='template', target_folder_id='target', sheet_id='sheet',
+        name_column='A', link_column='B', range_mode='all', auto_watch=False,
+        account_concurrency=args.concurrency, copy_batch_size=args.copy_batch_size,
+        reuse_outputs=False,
+    )
+    if args.quota:
+        config['api_quotas'] = {family: args.quota for family in config['api_quotas']}
+    else:
+        config['api_quotas'] = {family: 10 ** 6 for family in config['api_quotas']}
+    app.rate_limiter.configure(config['api_quotas'])
+
+    start = time.monotonic()
+    app.run_generator()
+    app.link_writer.flush()
+    elapsed = time.monotonic() - start
+
+    rows = app.job_store._query(
+        "SELECT finished_at - started_at AS seconds FROM rows WHERE status = 'done'"
+    )
+    latencies = [r['seconds'] for r in rows if r['seconds'] is not None]
+    completed = sum(1 for row in backend.sheet[1:] if len(row) > 1 and row[1].startswith('https://'))
+    api_calls = sum(backend.calls.values())
+
+    return {
+        'rows': args.rows,
+        'accounts': args.accounts,
+        'concurrency': args.concurrency,
+        'latency': args.latency,
+        'error_rate': args.error_rate,
+        'quota': args.quota,
+        'completed': completed,
+        'failed': args.rows - completed,
+        'seconds': round(elapsed, 2),
+        'certs_per_min': round(completed / (elapsed / 60), 1) if elapsed else 0,
+        'latency_p50': round(percentile(latencies, 50), 3),
+        'latency_p95': round(percentile(latencies, 95), 3),
+        'api_calls_per_cert': round(api_calls / completed, 2) if completed else 0,
+        'http_requests_per_cert': round(backend.http_requests / completed, 2) if completed else 0,
+        'rate_limited': backend.rate_limited,
+        'injected_errors': backend.errors,
+        'calls': dict(sorted(backend.calls.items())),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark run_generator against a simulated Google backend')
+    parser.add_argument('--rows', type=int, default=200, help='sheet rows to generate')
+    parser.add_argument('--accounts', type=int, default=4, help='service accounts')
+    parser.add_argument('--concurrency', type=int, default=2, help='workers per account')
+    parser.add_argument('--copy-batch-size', type=int, default=5, help='template copies per batch request')
+    parser.add_argument('--latency', type=float, default=0.1, help='mean seconds per API call')
+    parser.add_argument('--jitter', type=float, default=0.3, help='latency std-dev as a fraction of the mean')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of a 500 per call')
+    parser.add_argument('--quota', type=int, default=0, help='requests/min per account and API (0 = unlimited)')
+    parser.add_argument('--static-vars', type=int, default=0, help='extra static variables in the template')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print the result as JSON')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    result = run(args)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print('-' * 60)
+    print(f"{result['rows']} rows × {result['accounts']} accounts (×{result['concurrency']}), "
+          f"latency {result['latency']}s, errors {result['error_rate']:.0%}, quota {result['quota'] or '∞'}/min")
+    print('-' * 60)
+    print(f"Completed:        {result['completed']}  (failed {result['failed']})")
+    print(f"Time:             {result['seconds']}s")
+    print(f"Throughput:       {result['certs_per_min']} certificates/min")
+    print(f"Latency p50/p95:  {result['latency_p50']}s / {result['latency_p95']}s")
+    print(f"API calls/cert:   {result['api_calls_per_cert']}  (HTTP requests/cert {result['http_requests_per_cert']})")
+    print(f"429s / errors:    {result['rate_limited']} / {result['injected_errors']}")
+    for method, count in result['calls'].items():
+        print(f'  {method:<20} {count}')
+    print('-' * 60)
+
+if __name__ == '__main__':
+    main()
@@ -22,7 +22,8 @@ flask = types.SimpleNamespace(
     Flask=DummyFlask,
     render_template=lambda *a, **k: '',
     jsonify=lambda *a, **k: {},
-    request=types.SimpleNamespace()
+    request=types.SimpleNamespace(),
+    Response=lambda *a, **k: None
 )
 sys.modules['flask'] = flask
 
@@ -0,0 +1,90 @@
+import threading
+import time
+import unittest
+
+from tests.support import app
+
+
+def job(job_key, weight=1):
+    return app.JobContext(job_key, app.new_job_state({}, []), weight)
+
+
+class AccountSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = app.AccountScheduler(num_accounts=1, concurrency=1)
+        self.grants = []
+        self.grants_lock = threading.Lock()
+
+    def run_jobs(self, jobs, grants, workers=2):
+        """Busy workers (several per job, so each job always has one waiting)
+        until grants slots were handed out; returns the job id per grant"""
+        done = threading.Event()
+
+        def worker(ctx):
+            while not done.is_set():
+                lease = self.scheduler.acquire(ctx)
+                if lease is None:
+                    return
+                with self.grants_lock:
+                    self.grants.append(ctx.id)
+                    if len(self.grants) >= grants:
+                        done.set()
+                lease.done()
+
+        # Hold the only slot until every worker is queued, so no job gets a head start
+        blocker = self.scheduler.acquire(job('blocker'))
+        threads = [threading.Thread(target=worker, args=(ctx,), daemon=True)
+                   for ctx in jobs for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        while sum(self.scheduler.stats()['waiting'].values()) < len(threads):
+            time.sleep(0.01)
+        blocker.done()
+        done.wait(10)
+        for ctx in jobs:
+            ctx.stop_flag.set()
+        for thread in threads:
+            thread.join(5)
+        return self.grants[:grants]
+
+    def test_slots_follow_the_weights(self):
+        heavy, light = job('heavy', 2), job('light', 1)
+        grants = self.run_jobs([heavy, light], 300)
+        self.assertAlmostEqual(grants.count('heavy') / grants.count('light'), 2, delta=0.2)
+
+    def test_equal_weights_alternate(self):
+        grants = self.run_jobs([job('a'), job('b')], 100)
+        self.assertAlmostEqual(grants.count('a'), 50, delta=3)
+
+    def test_late_job_gets_no_credit_for_idle_time(self):
+        early, late = job('early'), job('late')
+        for _ in range(50):
+            self.scheduler.acquire(early).done()
+        grants = self.run_jobs([early, late], 20)
+        self.assertAlmostEqual(grants.count('late'), 10, delta=3)
+
+    def test_lease_frees_the_slot_after_its_last_row(self):
+        ctx = job('a')
+        lease = self.scheduler.acquire(ctx, rows=2)
+        self.assertEqual(self.scheduler.stats()['free'], 0)
+        lease.done()
+        self.assertEqual(self.scheduler.stats()['free'], 0)
+        lease.done()
+        self.assertEqual(self.scheduler.stats()['free'], 1)
+        self.assertEqual(self.scheduler.stats()['held'], {})
+
+    def test_stopped_job_stops_waiting(self):
+        holder, waiter = job('holder'), job('waiter')
+        self.scheduler.acquire(holder)
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self.scheduler.acquire(waiter)))
+        thread.start()
+        time.sleep(0.1)
+        waiter.stop_flag.set()
+        thread.join(5)
+        self.assertEqual(result, [None])
+        self.assertEqual(self.scheduler.stats()['waiting'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
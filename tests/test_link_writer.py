@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+
+from tests.support import app
+
+
+class FakeSheets:
+    """sheets service whose batchUpdate fails for the sheets in `failing`"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.writes = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def batchUpdate(self, spreadsheetId, body):
+        self.writes.append((spreadsheetId, [item['range'] for item in body['data']]))
+        return spreadsheetId
+
+
+class LinkWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.journal = os.path.join(self.dir, 'pending-links.jsonl')
+        self.sheets = FakeSheets()
+
+        @contextmanager
+        def account_services(acc_idx=0):
+            yield None, None, None, self.sheets
+
+        def execute_api(sheet_id, acc_idx, family):
+            if sheet_id in self.sheets.failing:
+                raise RuntimeError('backend error')
+
+        for name, fake in (('account_services', account_services), ('execute_api', execute_api)):
+            patcher = mock.patch.object(app, name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def writer(self, flush_rows=100):
+        return app.LinkWriter(flush_rows=flush_rows, flush_interval=60, journal_file=self.journal)
+
+    def test_journal_is_replayed_after_a_crash(self):
+        crashed = self.writer()
+        crashed.add('sheet', 'B2', 'link-2')
+        crashed.add('sheet', 'B3', 'link-3')
+
+        restarted = self.writer()
+        self.assertEqual(restarted.replay_journal(), 2)
+        self.assertTrue(restarted.is_pending('sheet', 'B3'))
+        self.assertEqual(restarted.flush(), 2)
+        self.assertEqual(self.sheets.writes, [('sheet', ['B2', 'B3'])])
+        self.assertFalse(os.path.exists(self.journal))
+
+    def test_replay_skips_a_partially_written_line(self):
+        self.writer().add('sheet', 'B2', 'link-2')
+        with open(self.journal, 'a', encoding='utf-8') as f:
+            f.write('{"sheet_id": "sheet", "ra')
+
+        restarted = self.writer()
+        self.assertEqual(restarted.replay_journal(), 1)
+
+    def test_latest_link_for_a_cell_wins(self):
+        crashed = self.writer()
+        crashed.add('sheet', 'B2', 'old')
+        crashed.add('sheet', 'B2', 'new')
+
+        restarted = self.writer()
+        restarted.replay_journal()
+        self.assertEqual(dict(restarted.pending), {('sheet', 'B2'): 'new'})
+
+    def test_failed_sheet_stays_journaled(self):
+        self.sheets.failing.add('bad')
+        writer = self.writer()
+        writer.add('good', 'B2', 'link-good')
+        writer.add('bad', 'B2', 'link-bad')
+        self.assertEqual(writer.flush(), 1)
+
+        restarted = self.writer()
+        self.assertEqual(restarted.replay_journal(), 1)
+        self.assertEqual(list(restarted.pending), [('bad', 'B2')])
+
+    def test_flushes_when_buffer_is_full(self):
+        writer = self.writer(flush_rows=2)
+        writer.add('sheet', 'B2', 'link-2')
+        self.assertEqual(self.sheets.writes, [])
+        writer.add('sheet', 'B3', 'link-3')
+        self.assertEqual(self.sheets.writes, [('sheet', ['B2', 'B3'])])
+
+
+if __name__ == '__main__':
+    unittest.main()
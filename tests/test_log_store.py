@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests.support import app
+
+
+class LogStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'certificates.log')
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            if store.handler:
+                store.handler.close()
+        shutil.rmtree(self.dir)
+
+    def store(self, path='default', **kwargs):
+        store = app.LogStore(self.path if path == 'default' else path, **kwargs)
+        self.stores.append(store)
+        return store
+
+    def messages(self, entries):
+        return [entry['message'] for entry in entries]
+
+    def test_cursor_returns_only_newer_entries(self):
+        store = self.store(path=None)
+        for i in range(5):
+            store.append(f'm{i}', 'info')
+        entries, last_seq = store.query(after=3)
+        self.assertEqual(self.messages(entries), ['m3', 'm4'])
+        self.assertEqual(last_seq, 5)
+        self.assertEqual(store.query(after=last_seq)[0], [])
+
+    def test_filters_by_level_and_job(self):
+        store = self.store(path=None)
+        store.append('a', 'info', job='j1')
+        store.append('b', 'error', job='j1')
+        store.append('c', 'error', job='j2')
+        self.assertEqual(self.messages(store.query(levels={'error'})[0]), ['b', 'c'])
+        self.assertEqual(self.messages(store.query(job='j1')[0]), ['a', 'b'])
+
+    def test_limit_keeps_the_oldest(self):
+        store = self.store(path=None)
+        for i in range(5):
+            store.append(f'm{i}', 'info')
+        entries, last_seq = store.query(limit=2)
+        self.assertEqual(self.messages(entries), ['m0', 'm1'])
+        self.assertEqual(last_seq, 5)  # Page forward from entries[-1]['seq']
+
+    def test_entries_older_than_the_ring_come_from_disk(self):
+        store = self.store(capacity=3)
+        for i in range(10):
+            store.append(f'm{i}', 'info')
+        self.assertEqual(self.messages(store.recent()), ['m7', 'm8', 'm9'])
+        self.assertEqual(self.messages(store.query(after=2, limit=3)[0]), ['m2', 'm3', 'm4'])
+
+    def test_cursor_reads_across_rotated_files(self):
+        store = self.store(max_bytes=300, backups=5)
+        for i in range(12):
+            store.append(f'm{i}', 'info')
+        self.assertTrue(os.path.exists(self.path + '.1'))
+        self.assertEqual(self.messages(store.query(after=0)[0]), [f'm{i}' for i in range(12)])
+
+    def test_numbering_continues_after_a_restart(self):
+        first = self.store(capacity=3)
+        for i in range(4):
+            first.append(f'm{i}', 'info')
+        first.handler.close()
+
+        restarted = self.store(capacity=3)
+        self.assertEqual(restarted.append('again', 'info')['seq'], 5)
+        self.assertEqual(self.messages(restarted.recent()), ['m2', 'm3', 'again'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import copy
+import unittest
+
+from tests.support import app
+
+
+class NameCacheTest(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = app.NameCache(max_size=2)
+        cache.get_or_compute('a', lambda: 1)
+        cache.get_or_compute('b', lambda: 2)
+        cache.get_or_compute('a', lambda: 0)  # Touch a, so b is the oldest
+        cache.get_or_compute('c', lambda: 3)
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+
+    def test_counts_hits_and_misses(self):
+        cache = app.NameCache()
+        calls = []
+        for _ in range(3):
+            cache.get_or_compute('x', lambda: calls.append(1) or 'X')
+        self.assertEqual(len(calls), 1)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+
+    def test_batch_lookup_returns_only_cached_keys(self):
+        cache = app.NameCache(max_size=2)
+        cache.put_many([('a', 1), ('b', 2), ('c', 3)])
+        self.assertEqual(cache.get_many(['a', 'b', 'c']), {'b': 2, 'c': 3})
+
+
+class CleanupInvalidationTest(unittest.TestCase):
+    def setUp(self):
+        self.cleanup = copy.deepcopy(app.state['config']['cleanup'])
+        app.clean_name_cache.clear()
+
+    def tearDown(self):
+        app.state['config']['cleanup'] = self.cleanup
+        app.invalidate_cleanup_engine()
+
+    def test_rule_change_flushes_cached_names(self):
+        app.state['config']['cleanup']['remove_words'] = ['Dr']
+        app.invalidate_cleanup_engine()
+        self.assertEqual(app.clean_name('Dr Ahmed Ali'), 'Ahmed Ali')
+
+        app.state['config']['cleanup']['remove_words'] = []
+        app.invalidate_cleanup_engine()
+        self.assertEqual(len(app.clean_name_cache.entries), 0)
+        self.assertEqual(app.clean_name('Dr Ahmed Ali'), 'Dr Ahmed Ali')
+
+    def test_identical_save_keeps_cached_names(self):
+        app.clean_name('Dr Ahmed Ali')
+        app.invalidate_cleanup_engine()
+        self.assertEqual(len(app.clean_name_cache.entries), 1)
+
+    def test_job_engine_does_not_share_results_with_saved_rules(self):
+        app.state['config']['cleanup']['remove_words'] = ['Dr']
+        app.invalidate_cleanup_engine()
+        engine = app.CleanupEngine(dict(self.cleanup, remove_words=[]))
+        self.assertEqual(app.clean_name('Dr Ahmed Ali'), 'Ahmed Ali')
+        self.assertEqual(app.clean_name('Dr Ahmed Ali', engine), 'Dr Ahmed Ali')
+
+
+if __name__ == '__main__':
+    unittest.main()
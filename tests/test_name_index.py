@@ -0,0 +1,77 @@
+import types
+import unittest
+from unittest import mock
+
+from tests.support import app
+
+NAME_COL = 2  # C
+LINK_COL = 3  # D
+
+
+def sheet(*names):
+    return [['', '', name] for name in names]
+
+
+class NameIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = app.NameIndex()
+
+    def test_duplicates_point_at_the_first_row(self):
+        self.index.update('sheet', sheet('Ahmed Ali', 'Sara', 'أحمد', 'احمد'), 2, NAME_COL, full=True)
+        self.assertEqual(self.index.first_row(2), 2)
+        self.assertEqual(self.index.first_row(3), 3)
+        self.assertEqual(self.index.first_row(5), 4)  # Same name after normalization
+
+    def test_tail_update_matches_earlier_rows(self):
+        self.index.update('sheet', sheet('Ahmed Ali', 'Sara'), 2, NAME_COL, full=True)
+        self.index.update('sheet', sheet('sara'), 4, NAME_COL)
+        self.assertEqual(self.index.first_row(4), 3)
+
+    def test_edited_row_moves_to_its_new_name(self):
+        self.index.update('sheet', sheet('Sara', 'Sara'), 2, NAME_COL, full=True)
+        self.index.update('sheet', sheet('Mona', 'Sara'), 2, NAME_COL, full=True)
+        self.assertEqual(self.index.first_row(3), 3)
+        self.assertEqual(self.index.first_row(2), 2)
+
+    def test_full_scan_drops_rows_outside_the_range(self):
+        self.index.update('sheet', sheet('Sara', 'Mona', 'Sara'), 2, NAME_COL, full=True)
+        self.index.update('sheet', sheet('Mona', 'Sara'), 3, NAME_COL, full=True)
+        self.assertIsNone(self.index.first_row(2))
+        self.assertEqual(self.index.first_row(4), 4)
+
+    def test_other_sheet_resets_the_index(self):
+        self.index.update('sheet', sheet('Sara'), 2, NAME_COL, full=True)
+        self.index.update('other', sheet('Mona', 'Sara'), 2, NAME_COL)
+        self.assertEqual(self.index.first_row(3), 3)
+
+
+class CollectPendingRowsTest(unittest.TestCase):
+    def setUp(self):
+        config = dict(app.state['config'], sheet_id='sheet', link_column='D')
+        self.ctx = types.SimpleNamespace(
+            config=config, name_index=app.NameIndex(),
+            variables=[{'placeholder': '<<NAME>>', 'column': 'C'}], log=lambda *a, **k: None,
+        )
+        self.marked = []
+        patcher = mock.patch.object(app, 'mark_duplicate_rows',
+                                    lambda sheet_id, mapping, column, sheets: self.marked.append(dict(mapping)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_marks_new_duplicates_and_skips_them(self):
+        rows = sheet('Sara', 'Mona', 'sara')
+        todo = app.collect_pending_rows(None, rows, 2, ctx=self.ctx)
+        self.assertEqual([row for row, _ in todo], [2, 3])
+        self.assertEqual(self.marked, [{4: 2}])
+        self.assertEqual(rows[2][LINK_COL], app.DUPLICATE_MARK.format(2))
+
+    def test_already_marked_duplicate_is_not_marked_again(self):
+        rows = sheet('Sara', 'Sara')
+        rows[1].append(app.DUPLICATE_MARK.format(2))
+        todo = app.collect_pending_rows(None, rows, 2, ctx=self.ctx)
+        self.assertEqual([row for row, _ in todo], [2])
+        self.assertEqual(self.marked, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import types
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+
+from tests.support import app, HttpError
+
+
+class FakeDrive:
+    def files(self):
+        return self
+
+    def get(self, fileId, **kwargs):
+        return fileId
+
+
+class OutputCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.store = app.JobStore(':memory:')
+        self.cache = app.OutputCache(self.store)
+        self.ctx = types.SimpleNamespace(output_key=['template', 7])
+        # {file_id: (response, error)} as execute_batch reports them
+        self.drive_files = {}
+        self.checked_by = []
+        self.finished = []
+
+        @contextmanager
+        def account_services(acc_idx=0):
+            yield FakeDrive(), None, None, None
+
+        def execute_batch(service, acc_idx, family, requests):
+            self.checked_by.append(acc_idx)
+            return {key: self.drive_files[file_id] for key, file_id in requests}
+
+        patches = {
+            'account_services': account_services,
+            'execute_batch': execute_batch,
+            'output_cache': self.cache,
+            'finish_certificate': lambda job, services: self.finished.append(job.row_idx),
+        }
+        for name, fake in patches.items():
+            patcher = mock.patch.object(app, name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict(app.state, accounts=[{}, {}, {}])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def job(self, row, name, acc_idx=0):
+        job = app.CertificateJob(acc_idx, row, [name], ctx=self.ctx)
+        job.values = [('<<NAME>>', name)]
+        return job
+
+    def generated(self, row, name, acc_idx, file_id):
+        """Remember a PDF as generated by account acc_idx"""
+        job = self.job(row, name, acc_idx)
+        self.cache.lookup(job)
+        job.file_id, job.link = file_id, f'link-{file_id}'
+        self.cache.remember(job)
+
+    def test_same_values_hit_and_changed_template_misses(self):
+        self.generated(2, 'Sara', 1, 'pdf-sara')
+        job = self.job(3, 'Sara')
+        self.assertTrue(self.cache.lookup(job))
+        self.assertEqual((job.file_id, job.cache_account), ('pdf-sara', 1))
+
+        self.ctx.output_key = ['template', 8]
+        self.assertFalse(self.cache.lookup(self.job(4, 'Sara')))
+        self.assertFalse(self.cache.lookup(self.job(5, 'Mona')))
+
+    def test_disabled_without_a_pinned_template(self):
+        self.ctx.output_key = None
+        self.assertFalse(self.cache.lookup(self.job(2, 'Sara')))
+
+    def test_existing_file_is_reused_and_checked_by_its_account(self):
+        self.generated(2, 'Sara', 2, 'pdf-sara')
+        self.drive_files['pdf-sara'] = ({'id': 'pdf-sara', 'trashed': False}, None)
+        reused = app.reuse_outputs([self.job(3, 'Sara')], None)
+        self.assertEqual([job.row_idx for job in reused], [3])
+        self.assertEqual(self.finished, [3])
+        self.assertEqual(self.checked_by, [2])
+
+    def test_trashed_or_deleted_file_is_forgotten(self):
+        self.generated(2, 'Sara', 0, 'pdf-sara')
+        self.generated(3, 'Mona', 0, 'pdf-mona')
+        self.drive_files['pdf-sara'] = ({'id': 'pdf-sara', 'trashed': True}, None)
+        self.drive_files['pdf-mona'] = (None, HttpError(types.SimpleNamespace(status=404)))
+        jobs = [self.job(4, 'Sara'), self.job(5, 'Mona')]
+        self.assertEqual(app.reuse_outputs(jobs, None), [])
+        self.assertEqual([job.file_id for job in jobs], [None, None])
+        self.assertFalse(self.cache.lookup(self.job(6, 'Sara')))
+        self.assertFalse(self.cache.lookup(self.job(7, 'Mona')))
+
+    def test_transient_error_keeps_the_entry(self):
+        self.generated(2, 'Sara', 0, 'pdf-sara')
+        self.drive_files['pdf-sara'] = (None, HttpError(types.SimpleNamespace(status=500)))
+        job = self.job(3, 'Sara')
+        self.assertEqual(app.reuse_outputs([job], None), [])
+        self.assertIsNone(job.file_id)  # Generated normally this time
+        self.assertTrue(self.cache.lookup(self.job(4, 'Sara')))
+
+
+if __name__ == '__main__':
+    unittest.main()
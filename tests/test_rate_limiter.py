@@ -0,0 +1,89 @@
+import unittest
+from unittest import mock
+
+from tests.support import app
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        for name in ('monotonic', 'sleep'):
+            patcher = mock.patch.object(app.time, name, getattr(self.clock, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Backoff jitter off, so delays are exact
+        patcher = mock.patch.object(app.random, 'uniform', lambda a, b: 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_wait_for_refill(self):
+        bucket = app.TokenBucket(60, burst=2)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 1.0)
+        self.assertAlmostEqual(bucket.reserve(), 2.0)
+
+    def test_refill_is_capped_at_burst(self):
+        bucket = app.TokenBucket(60, burst=2)
+        self.clock.now += 3600
+        bucket.refill(self.clock.now)
+        self.assertEqual(bucket.tokens, 2)
+
+    def test_acquire_sleeps_for_the_reserved_wait(self):
+        limiter = app.RateLimiter({'drive': 60})
+        limiter.buckets[(0, 'drive')] = app.TokenBucket(60, burst=1)
+        start = self.clock.now
+        self.assertEqual(limiter.acquire(0, 'drive'), 0)
+        self.assertAlmostEqual(limiter.acquire(0, 'drive'), 1.0)
+        self.assertAlmostEqual(self.clock.now - start, 1.0)
+
+    def test_backoff_doubles_and_resets_on_success(self):
+        limiter = app.RateLimiter({'drive': 6000})
+        delays = [limiter.backoff(0, 'drive') for _ in range(3)]
+        self.assertEqual(delays, [app.BACKOFF_BASE, app.BACKOFF_BASE * 2, app.BACKOFF_BASE * 4])
+
+        limiter.success(0, 'drive')
+        self.assertEqual(limiter.backoff(0, 'drive'), app.BACKOFF_BASE)
+
+    def test_backoff_is_capped(self):
+        limiter = app.RateLimiter({'drive': 6000})
+        for _ in range(20):
+            delay = limiter.backoff(0, 'drive')
+        self.assertEqual(delay, app.BACKOFF_MAX)
+
+    def test_backoff_blocks_only_that_account_and_family(self):
+        limiter = app.RateLimiter({'drive': 6000, 'sheets': 6000})
+        delay = limiter.backoff(0, 'drive')
+        self.assertAlmostEqual(limiter.acquire(0, 'drive'), delay)
+        self.assertEqual(limiter.acquire(0, 'sheets'), 0)
+        self.assertEqual(limiter.acquire(1, 'drive'), 0)
+
+    def test_long_wait_reports_progress_in_slices(self):
+        limiter = app.RateLimiter({'drive': 6000})
+        limiter.backoff(0, 'drive')
+        limiter.backoff(0, 'drive')
+        limiter.backoff(0, 'drive')  # Longer than one progress interval
+        beats = []
+        app.row_progress.beat = lambda: beats.append(self.clock.now)
+        try:
+            limiter.acquire(0, 'drive')
+        finally:
+            app.row_progress.beat = None
+        gaps = [b - a for a, b in zip(beats, beats[1:])]
+        self.assertGreater(len(beats), 1)
+        self.assertLessEqual(max(gaps), app.PROGRESS_INTERVAL)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import threading
+import unittest
+from unittest import mock
+
+from tests.support import app
+
+
+class WorkQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(app.time, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.stop = threading.Event()
+
+    def queue(self, rows, stall_timeout=300):
+        return app.WorkQueue([(row, {'name': f'Name {row}'}) for row in rows], stall_timeout, self.stop)
+
+    def rows(self, items):
+        return [row for row, _ in items]
+
+    def test_stalled_row_is_requeued_to_another_worker(self):
+        rows = self.queue([2, 3])
+        self.assertEqual(self.rows(rows.get('a', 2)), [2, 3])
+        rows.start([2, 3], 'a')
+        rows.task_done(3, 'a')
+
+        self.now += 301
+        self.assertEqual(self.rows(rows.get('b')), [2])
+        self.assertEqual(rows.stats()['requeued'], 1)
+
+    def test_row_waiting_for_a_slot_is_not_stalled(self):
+        rows = self.queue([2, 3])
+        rows.get('a')  # Never started: paused or waiting for an account
+        self.now += 3600
+        self.assertEqual(self.rows(rows.get('b')), [3])
+        self.assertEqual(rows.stats()['requeued'], 0)
+
+    def test_progress_restarts_the_stall_clock(self):
+        rows = self.queue([2, 3])
+        rows.get('a')
+        rows.start([2], 'a')
+        self.now += 200
+        rows.start([2], 'a')  # Heartbeat
+        self.now += 200
+        self.assertEqual(self.rows(rows.get('b')), [3])
+
+    def test_late_finish_of_a_requeued_row_is_not_redone(self):
+        rows = self.queue([2])
+        rows.get('a')
+        rows.start([2], 'a')
+        self.now += 301
+        with rows.lock:
+            rows._requeue_stalled()
+        rows.task_done(2, 'a')  # The stalled worker finishes after all
+        self.assertEqual(rows.get('b'), [])
+
+    def test_stale_worker_cannot_release_the_new_owner(self):
+        rows = self.queue([2])
+        rows.get('a')
+        rows.start([2], 'a')
+        self.now += 301
+        rows.get('b')
+        rows.start([2], 'a')  # Old owner's heartbeat is ignored
+        self.assertEqual(rows.in_flight[2][0], 'b')
+
+    def test_stop_ends_the_queue(self):
+        rows = self.queue([2])
+        self.stop.set()
+        self.assertEqual(rows.get('a'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
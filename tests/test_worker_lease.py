@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from tests import support
+from tests.support import app
+
+
+class LeaseTestCase(unittest.TestCase):
+    """One job with rows 2-4 queued for workers, on a fake clock"""
+
+    def setUp(self):
+        self.now = 1000.0
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.store = app.JobStore(':memory:')
+        self.links = app.LinkWriter(flush_rows=1000, journal_file=os.path.join(self.dir, 'pending-links.jsonl'))
+        self.discarded = []
+        patches = {
+            'job_store': self.store,
+            'output_cache': app.OutputCache(self.store),
+            'link_writer': self.links,
+            'janitor': mock.Mock(discard=lambda acc_idx, file_id: self.discarded.append(file_id)),
+            'broadcast_state': lambda: None,
+            'WORKER_TOKEN': 'secret',
+        }
+        for name, fake in patches.items():
+            patcher = mock.patch.object(app, name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(app.time, 'time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        config = dict(app.state['config'], sheet_id='sheet', link_column='D', worker_lease_seconds=120)
+        self.ctx = app.JobContext('job', app.new_job_state(config, []))
+        todo = [(row, ['', '', f'Name {row}']) for row in (2, 3, 4)]
+        self.job_id = self.store.start_job(config, [], todo, 2)
+        self.dispatcher = app.WorkerDispatcher()
+        self.dispatcher.jobs[self.job_id] = self.ctx
+
+    def sync(self, worker, max_rows=0, results=(), renew=()):
+        return self.dispatcher.sync(worker, 1, max_rows, list(results), list(renew))
+
+    def result(self, row, file_id=None, error=None):
+        result = {'job_id': self.job_id, 'sheet_id': 'sheet', 'row': row}
+        if error:
+            result['error'] = error
+        else:
+            result.update(file_id=file_id, link=f'https://drive/{file_id}')
+        return result
+
+    def leased_rows(self, response):
+        return [task['row'] for task in response['tasks']]
+
+
+class WorkerLeaseTest(LeaseTestCase):
+    def test_leased_rows_are_not_handed_out_twice(self):
+        self.assertEqual(self.leased_rows(self.sync('a', 2)), [2, 3])
+        self.assertEqual(self.leased_rows(self.sync('b', 2)), [4])
+        self.assertEqual(self.store.row_status('sheet', 2)['lease_owner'], 'a')
+
+    def test_reported_rows_are_finished_by_the_controller(self):
+        self.sync('a', 2)
+        self.sync('a', results=[self.result(2, 'pdf-2'), self.result(3, error='boom')])
+        self.assertEqual(self.store.row_status('sheet', 2)['status'], 'done')
+        self.assertEqual(self.store.row_status('sheet', 3)['status'], 'failed')
+        self.assertTrue(self.links.is_pending('sheet', 'D2'))
+        self.assertEqual((self.ctx.state['completed'], self.ctx.state['failed']), (1, 1))
+
+    def test_expired_lease_goes_to_another_worker(self):
+        self.sync('a', 1)
+        self.now += 121
+        self.assertEqual(self.leased_rows(self.sync('b', 1)), [2])
+        self.assertEqual(self.dispatcher.requeued, 1)
+
+    def test_renewed_lease_does_not_expire(self):
+        self.sync('a', 1)
+        self.now += 100
+        self.sync('a', renew=[{'job_id': self.job_id, 'row': 2}])
+        self.now += 100
+        self.assertEqual(self.leased_rows(self.sync('b', 1)), [3])
+
+    def test_only_the_lease_owner_can_renew(self):
+        self.sync('a', 1)
+        self.now += 100
+        self.sync('b', renew=[{'job_id': self.job_id, 'row': 2}])
+        self.now += 100
+        self.assertEqual(self.leased_rows(self.sync('b', 1)), [2])
+
+    def test_late_result_of_a_lost_lease_is_dropped(self):
+        self.sync('a', 1)
+        self.now += 121
+        self.sync('b', 1)
+        self.sync('a', results=[self.result(2, 'pdf-late')])
+        self.assertEqual(self.store.row_status('sheet', 2), {'status': 'leased', 'lease_owner': 'b'})
+        self.assertEqual(self.discarded, ['pdf-late'])
+        self.assertFalse(self.links.is_pending('sheet', 'D2'))
+
+    def test_paused_job_leases_nothing(self):
+        self.ctx.pause_flag.set()
+        self.assertEqual(self.sync('a', 3)['tasks'], [])
+
+
+class WorkerSyncRouteTest(LeaseTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(app, 'worker_dispatcher', self.dispatcher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def call(self, data, token='secret'):
+        support.set_request(data, {'X-Worker-Token': token} if token is not None else {})
+        response = app.api_worker_sync()
+        return response if isinstance(response, tuple) else (response, 200)
+
+    def test_valid_sync(self):
+        response, status = self.call({'worker': 'a', 'accounts': 1, 'max_rows': 1})
+        self.assertEqual(status, 200)
+        self.assertEqual(self.leased_rows(response), [2])
+
+    def test_refused_without_the_token(self):
+        self.assertEqual(self.call({'worker': 'a'}, token=None)[1], 403)
+        self.assertEqual(self.call({'worker': 'a'}, token='wrong')[1], 403)
+        with mock.patch.object(app, 'WORKER_TOKEN', ''):
+            self.assertEqual(self.call({'worker': 'a'}, token='')[1], 403)
+
+    def test_malformed_requests_are_rejected(self):
+        for data in (None, {}, {'worker': ''}, {'worker': 'a', 'max_rows': 'x'},
+                     {'worker': 'a', 'results': [{'row': 2}]},
+                     {'worker': 'a', 'results': [{'job_id': 1, 'sheet_id': 'sheet', 'row': 2}]},
+                     {'worker': 'a', 'renew': 'x'}):
+            self.assertEqual(self.call(data)[1], 400, data)
+
+
+if __name__ == '__main__':
+    unittest.main()